@@ -33,14 +33,20 @@ Several things happen when you do:
     file which was constructed and installed during SCons installation.
 
  3) All available input plugins and TrueType fonts are automatically registered.
+    With a font index (see build_font_index()), font files are registered when
+    maps first use their faces.
 
  4) Boost Python metaclass injectors are used in the '__init__.py' to extend several
     objects adding extra convenience when accessed via Python.
 
 """
 
+import hashlib
 import itertools
 import os
+import re
+import tempfile
+import threading
 import warnings
 try:
     import json
@@ -76,6 +82,77 @@ from ._mapnik import *
 from . import printing
 printing.renderer = render
 
+
+def _read_map_file(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        # load_map reports the error
+        return ''
+
+
+def _with_map_faces(load, source_arg, read):
+    """
+    Wrap load to register the faces used by the map XML before it
+    is parsed, see register_faces().
+    """
+    def call(*args, **kwargs):
+        source = args[1] if len(args) > 1 else kwargs.get(source_arg)
+        if _lazy_font_files and source is not None:
+            register_faces(_xml_face_names(read(source)))
+        return load(*args, **kwargs)
+    call.__name__ = load.__name__
+    call.__doc__ = load.__doc__
+    return call
+
+load_map = _with_map_faces(load_map, 'filename', _read_map_file)
+load_map_from_string = _with_map_faces(load_map_from_string, 'str',
+                                       lambda xml: xml)
+
+from .pool import MapPool
+from .vector_tile_cache import (VectorTileCache, call_signature,
+                                get_vector_tile_cache, set_vector_tile_cache)
+
+
+def _cached_mvt(create, signature):
+    def call(map, *args, **kwargs):
+        cache = get_vector_tile_cache()
+        if cache is None:
+            return create(map, *args, **kwargs)
+        return cache.get_or_create(create, map, args, kwargs, signature)
+    call.__name__ = create.__name__
+    call.__doc__ = create.__doc__
+    return call
+
+# Defaults of the arguments of create_mvt_merc and create_mvt_wafer_merc
+_mvt_options = [
+    ('tile_size', 4096),
+    ('buffer_size', None),
+    ('scale_denom', 0.0),
+    ('offset_x', 0),
+    ('offset_y', 0),
+    ('style_level_filter', False),
+    ('simplify_distance', 0.0),
+    ('area_threshold', 0.1),
+    ('process_all_rings', False),
+    ('multi_polygon_union', False),
+    ('fill_type', polygon_fill_type.positive_fill),
+    ('image_format', 'tiff'),
+    ('scaling_method', scaling_method.BILINEAR),
+    ('threading_mode', threading_mode.deferred),
+]
+
+create_mvt_merc = _cached_mvt(
+    create_mvt_merc,
+    call_signature(('map', 'x', 'y', 'z'), _mvt_options))
+create_mvt_wafer_merc = _cached_mvt(
+    create_mvt_wafer_merc,
+    call_signature(('map', 'x', 'y', 'z', 'span'), _mvt_options))
+
+from .seed import seed_mvt
+from .tile_store import DirectoryWriter, MBTilesWriter
+
 # The base Boost.Python class
 BoostPythonMetaclass = Coord.__class__
 
@@ -793,6 +870,13 @@ class PythonDatasource(object):
         return itertools.imap(make_it, features, itertools.count(1))
 
 
+class _FontSet(FontSet, _injector()):
+
+    def add_face_name(self, face_name):
+        register_faces([face_name])
+        self._c_add_face_name(face_name)
+
+
 class _TextSymbolizer(TextSymbolizer, _injector()):
 
     @property
@@ -822,6 +906,7 @@ class _TextSymbolizer(TextSymbolizer, _injector()):
 
     @face_name.setter
     def face_name(self, face_name):
+        register_faces([face_name])
         self.format.face_name = face_name
 
     @property
@@ -1031,30 +1116,220 @@ def mapnik_version_from_string(version_string):
     return (int(n[0]) * 100000) + (int(n[1]) * 100) + (int(n[2]))
 
 
-def register_plugins(path=None):
-    """Register plugins located by specified path"""
+def register_plugins(path=None, lazy=True):
+    """
+    Register plugins located by specified path
+
+    With lazy, plugins are only indexed and each of them is loaded
+    when a datasource of its type is first created, either by
+    DatasourceCache.create() or by load_map().
+    """
     if not path:
         if 'MAPNIK_INPUT_PLUGINS_DIRECTORY' in os.environ:
             path = os.environ.get('MAPNIK_INPUT_PLUGINS_DIRECTORY')
         else:
             from .paths import inputpluginspath
             path = inputpluginspath
-    DatasourceCache.register_datasources(path)
+    if not lazy:
+        DatasourceCache.register_datasources(path)
+        return
+    try:
+        filenames = os.listdir(path)
+    except OSError:
+        return
+    for filename in filenames:
+        if filename.endswith('.input'):
+            DatasourceCache.defer_datasource(os.path.join(path, filename))
 
 
-def register_fonts(path=None, valid_extensions=[
-                   '.ttf', '.otf', '.ttc', '.pfa', '.pfb', '.ttc', '.dfont', '.woff']):
-    """Recursively register fonts using path argument as base directory"""
-    if not path:
-        if 'MAPNIK_FONT_DIRECTORY' in os.environ:
-            path = os.environ.get('MAPNIK_FONT_DIRECTORY')
-        else:
-            from .paths import fontscollectionpath
-            path = fontscollectionpath
+FONT_INDEX_VERSION = 3
+
+# Font files of a font index which are not registered yet, with their
+# stamps, and the files of their faces.
+_lazy_font_files = {}
+_lazy_faces = {}
+_font_lock = threading.Lock()
+
+
+def font_index_path(path):
+    """
+    Return the path of the font index for the font directory path,
+    or None if the index is disabled.
+
+    The index is stored in the user cache directory unless
+    MAPNIK_FONT_INDEX gives its path. An empty MAPNIK_FONT_INDEX
+    disables the index.
+    """
+    if 'MAPNIK_FONT_INDEX' in os.environ:
+        return os.environ['MAPNIK_FONT_INDEX'] or None
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_home, 'mapnik', 'fonts-%s.json' % digest)
+
+
+def _font_directory(path):
+    if path:
+        return path
+    if 'MAPNIK_FONT_DIRECTORY' in os.environ:
+        return os.environ.get('MAPNIK_FONT_DIRECTORY')
+    from .paths import fontscollectionpath
+    return fontscollectionpath
+
+
+def _file_stamp(filename):
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _xml_face_names(xml):
+    """
+    Return the face names used by attributes of a map XML.
+    """
+    if isinstance(xml, bytes):
+        xml = xml.decode('utf-8', 'replace')
+    names = set()
+    for match in re.finditer(r'face-name\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', xml):
+        name = match.group(1) if match.group(1) is not None else match.group(2)
+        names.add(name.replace('&quot;', '"').replace('&apos;', "'")
+                      .replace('&lt;', '<').replace('&gt;', '>')
+                      .replace('&amp;', '&'))
+    return names
+
+
+def _load_font_index(index_path, path, valid_extensions):
+    """
+    Return the index if no directory under path changed since it was
+    built. Files replaced in place are detected when they are registered.
+    """
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if (index['version'] != FONT_INDEX_VERSION or
+                index['path'] != os.path.abspath(path) or
+                index['extensions'] != sorted(valid_extensions)):
+            return None
+        # Added, removed or renamed files change the directory mtime.
+        for dirpath, mtime in index['directories'].items():
+            if os.stat(dirpath).st_mtime_ns != mtime:
+                return None
+        return index
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _register_font_files(path, valid_extensions):
+    """
+    Register all font files under path, return the stamps of the
+    directories and of the registered files.
+    """
+    directories = {}
+    files = {}
     for dirpath, _, filenames in os.walk(path):
+        directories[dirpath] = os.stat(dirpath).st_mtime_ns
         for filename in filenames:
             if os.path.splitext(filename.lower())[1] in valid_extensions:
-                FontEngine.register_font(os.path.join(dirpath, filename))
+                filename = os.path.join(dirpath, filename)
+                if FontEngine.register_font(filename):
+                    files[filename] = _file_stamp(filename)
+    return directories, files
+
+
+def build_font_index(path=None, valid_extensions=[
+                     '.ttf', '.otf', '.ttc', '.pfa', '.pfb', '.ttc', '.dfont', '.woff'],
+                     index_path=None):
+    """
+    Register all fonts under path and store their faces in a font index
+    at index_path, by default font_index_path(path). Returns the path of
+    the index, None if the index is disabled.
+
+    While no directory under path changes, register_fonts() loads the
+    index instead of opening every font file, and files are registered
+    when maps first use their faces.
+
+    >>> mapnik.build_font_index()
+    """
+    path = _font_directory(path)
+    index_path = index_path or font_index_path(path)
+    directories, files = _register_font_files(path, valid_extensions)
+    if not index_path:
+        return None
+    faces = [[name, filename]
+             for name, (_, filename) in FontEngine.face_mapping().items()
+             if filename in files]
+    index = {
+        'version': FONT_INDEX_VERSION,
+        'path': os.path.abspath(path),
+        'extensions': sorted(valid_extensions),
+        'directories': directories,
+        'files': files,
+        'faces': faces,
+    }
+    index_dir = os.path.dirname(index_path)
+    if index_dir and not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir or None)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def register_fonts(path=None, valid_extensions=[
+                   '.ttf', '.otf', '.ttc', '.pfa', '.pfb', '.ttc', '.dfont', '.woff'],
+                   use_index=True):
+    """
+    Recursively register fonts using path argument as base directory
+
+    With use_index and an up to date font index built by
+    build_font_index(), no font file is opened. Files are registered
+    when their faces are first used, see register_faces(). Without
+    an index, every font file is registered and no index is written.
+    """
+    path = _font_directory(path)
+    index_path = font_index_path(path) if use_index else None
+    if index_path:
+        index = _load_font_index(index_path, path, valid_extensions)
+        if index is not None:
+            with _font_lock:
+                _lazy_font_files.update(index['files'])
+                for name, filename in index['faces']:
+                    _lazy_faces.setdefault(name, filename)
+            return
+    _register_font_files(path, valid_extensions)
+
+
+def _register_lazy_fonts():
+    for filename in sorted(_lazy_font_files):
+        FontEngine.register_font(filename)
+    _lazy_font_files.clear()
+    _lazy_faces.clear()
+
+
+def register_faces(face_names):
+    """
+    Register the font files of faces known from a font index.
+
+    load_map(), load_map_from_string(), FontSet.add_face_name() and
+    TextSymbolizer.face_name register the faces they use, other maps
+    have to register their faces before rendering. If an indexed file
+    changed, the files of all indexed faces are registered.
+    """
+    with _font_lock:
+        filenames = set(_lazy_faces[name] for name in face_names
+                        if name in _lazy_faces)
+        for filename in sorted(filenames):
+            if filename not in _lazy_font_files:
+                continue
+            try:
+                changed = _file_stamp(filename) != _lazy_font_files[filename]
+            except OSError:
+                changed = True
+            if changed:
+                _register_lazy_fonts()
+                return
+            del _lazy_font_files[filename]
+            FontEngine.register_font(filename)
 
 # auto-register known plugins and fonts
 register_plugins()
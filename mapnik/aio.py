@@ -0,0 +1,182 @@
+"""Asyncio front-end for Mapnik.
+
+Blocking Mapnik calls are run in a sized thread pool. Rendering,
+vector tile creation, encoding and I/O release the GIL, so a single
+event loop can keep all cores busy.
+
+    >>> import mapnik
+    >>> from mapnik import aio
+    >>> m = mapnik.Map(256, 256)
+    >>> await aio.load_map(m, 'mapfile.xml')
+    >>> im = mapnik.Image(256, 256)
+    >>> await aio.render(m, im)
+    >>> png = await aio.tostring(im, 'png')
+
+Cancelling an awaitable removes the call from the queue. A call which
+is already running in native code finishes, its result is discarded.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import mapnik
+
+
+class Pool(object):
+    """
+    Thread pool running Mapnik calls for asyncio code.
+
+    max_workers is the number of threads, by default the number of CPUs.
+    map_concurrency limits the number of calls running concurrently with
+    the same Map, None means no limit. It can be set for a single Map
+    by set_map_concurrency().
+    """
+
+    def __init__(self, max_workers=None, map_concurrency=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.map_concurrency = map_concurrency
+        self._executor = ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix='mapnik-aio')
+        self._map_limits = {}
+        self._lock = threading.Lock()
+
+    def set_map_concurrency(self, m, limit):
+        """Limit the number of calls running concurrently with the Map m."""
+        with self._lock:
+            self._set_map_limit(m, limit)
+
+    def _set_map_limit(self, m, limit):
+        key = id(m)
+        if key not in self._map_limits:
+            # The entry is dropped with the Map, once per Map.
+            weakref.finalize(m, self._map_limits.pop, key, None)
+        # asyncio primitives must not be shared between loops, semaphores
+        # of closed loops are dropped with the loops.
+        self._map_limits[key] = (limit, weakref.WeakKeyDictionary())
+
+    def _map_semaphore(self, m):
+        if m is None:
+            return None
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            key = id(m)
+            if key not in self._map_limits:
+                if self.map_concurrency is None:
+                    return None
+                self._set_map_limit(m, self.map_concurrency)
+            limit, semaphores = self._map_limits[key]
+            if limit is None:
+                return None
+            semaphore = semaphores.get(loop)
+            if semaphore is None:
+                semaphore = semaphores[loop] = asyncio.Semaphore(limit)
+            return semaphore
+
+    async def run(self, func, *args, map=None, **kwargs):
+        """Run func(*args, **kwargs) in the pool, limited by the given map."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        semaphore = self._map_semaphore(map)
+        if semaphore is None:
+            return await loop.run_in_executor(self._executor, call)
+        async with semaphore:
+            return await loop.run_in_executor(self._executor, call)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    async def load_map(self, m, filename, *args, **kwargs):
+        return await self.run(mapnik.load_map, m, filename, *args,
+                              map=m, **kwargs)
+
+    async def load_map_from_string(self, m, string, *args, **kwargs):
+        return await self.run(mapnik.load_map_from_string, m, string, *args,
+                              map=m, **kwargs)
+
+    async def render(self, m, image, *args, **kwargs):
+        return await self.run(mapnik.render, m, image, *args,
+                              map=m, **kwargs)
+
+    async def render_to_file(self, m, filename, *args, **kwargs):
+        return await self.run(mapnik.render_to_file, m, filename, *args,
+                              map=m, **kwargs)
+
+    async def render_tiles(self, m, tiles, *args, **kwargs):
+        return await self.run(mapnik.render_tiles, m, tiles, *args,
+                              map=m, **kwargs)
+
+    async def render_metatile(self, m, x, y, z, *args, **kwargs):
+        return await self.run(mapnik.render_metatile, m, x, y, z, *args,
+                              map=m, **kwargs)
+
+    async def create_mvt_merc(self, m, x, y, z, *args, **kwargs):
+        return await self.run(mapnik.create_mvt_merc, m, x, y, z, *args,
+                              map=m, **kwargs)
+
+    async def create_mvt_wafer_merc(self, m, x, y, z, span, *args, **kwargs):
+        return await self.run(mapnik.create_mvt_wafer_merc, m, x, y, z, span,
+                              *args, map=m, **kwargs)
+
+    async def tostring(self, image, *args):
+        return await self.run(image.tostring, *args)
+
+    async def save(self, image, filename, *args):
+        return await self.run(image.save, filename, *args)
+
+    async def encode_parallel(self, tiles, format, *args, **kwargs):
+        return await self.run(mapnik.encode_parallel, tiles, format,
+                              *args, **kwargs)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the default Pool, creating it on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = Pool()
+        return _default_pool
+
+
+def configure(max_workers=None, map_concurrency=None):
+    """Replace the default Pool by a new one with given settings."""
+    global _default_pool
+    with _default_pool_lock:
+        old_pool = _default_pool
+        _default_pool = Pool(max_workers, map_concurrency)
+    if old_pool is not None:
+        old_pool.shutdown(wait=False)
+    return _default_pool
+
+
+def _delegate(name):
+    def call(*args, **kwargs):
+        return getattr(get_pool(), name)(*args, **kwargs)
+    call.__name__ = name
+    call.__doc__ = "Awaitable mapnik.%s() running in the default Pool." % name
+    return call
+
+
+def run(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in the default Pool."""
+    return get_pool().run(func, *args, **kwargs)
+
+
+load_map = _delegate('load_map')
+load_map_from_string = _delegate('load_map_from_string')
+render = _delegate('render')
+render_to_file = _delegate('render_to_file')
+render_tiles = _delegate('render_tiles')
+render_metatile = _delegate('render_metatile')
+create_mvt_merc = _delegate('create_mvt_merc')
+create_mvt_wafer_merc = _delegate('create_mvt_wafer_merc')
+tostring = _delegate('tostring')
+save = _delegate('save')
+encode_parallel = _delegate('encode_parallel')
@@ -0,0 +1,80 @@
+"""Pools of reusable Mapnik objects for multi-threaded servers.
+
+    >>> from mapnik import MapPool, Image, render
+    >>> pool = MapPool('mapfile.xml', 8)
+    >>> with pool.checkout() as m:
+    ...     m.zoom_to_box(bbox)
+    ...     render(m, im)
+"""
+
+import contextlib
+import copy
+import threading
+
+from . import Map, load_map
+
+
+class MapPool(object):
+    """
+    Thread-safe pool of maps loaded from one style file.
+
+    The style is parsed once. Pooled maps are copies of the parsed map,
+    they share its datasources, so startup time and memory scale with
+    the pool size rather than with the parsing cost. Maps are created
+    lazily, checkout() blocks while all size maps are in use.
+
+    Checked out maps may be resized, zoomed and panned, their size,
+    extent, buffer size and aspect fix mode are reset from the template
+    when they are returned. Other changes, including changes of styles
+    and layers, are not reset and should be avoided.
+    """
+
+    def __init__(self, style_path, size, width=256, height=256,
+                 strict=False, base_path=''):
+        if size < 1:
+            raise ValueError('MapPool size must be at least 1')
+        self.size = size
+        self.template = Map(width, height)
+        load_map(self.template, style_path, strict, base_path)
+        self._free = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Take a map from the pool, wait up to timeout seconds if needed."""
+        with self._condition:
+            if not self._free and self._created >= self.size:
+                # Slots of maps which failed to be created are freed too.
+                if not self._condition.wait_for(
+                        lambda: self._free or self._created < self.size,
+                        timeout):
+                    raise RuntimeError('No map available in MapPool')
+            if self._free:
+                return self._free.pop()
+            self._created += 1
+        try:
+            return copy.copy(self.template)
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, m):
+        """Return the map to the pool."""
+        m.aspect_fix_mode = self.template.aspect_fix_mode
+        m.buffer_size = self.template.buffer_size
+        m.resize(self.template.width, self.template.height)
+        m.zoom_to_box(self.template.envelope())
+        with self._condition:
+            self._free.append(m)
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def checkout(self, timeout=None):
+        """Context manager taking a map from the pool and returning it."""
+        m = self.acquire(timeout)
+        try:
+            yield m
+        finally:
+            self.release(m)
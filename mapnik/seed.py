@@ -0,0 +1,169 @@
+"""Seeding of vector tile pyramids.
+
+    >>> import mapnik
+    >>> def map_factory():
+    ...     m = mapnik.Map(256, 256)
+    ...     mapnik.load_map(m, 'mapfile.xml')
+    ...     return m
+    >>> class Sink(object):
+    ...     def write(self, tiles):
+    ...         for z, x, y, data in tiles:
+    ...             store(z, x, y, data)
+    >>> mapnik.seed_mvt(map_factory, (12.0, 48.5, 19.0, 51.1), range(15),
+    ...                 wafer_span=8, workers=4, sink=Sink())
+    {'tiles': 37512, 'bytes': 187921442, 'seconds': 91.6, ...}
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import mapnik
+
+MAX_LATITUDE = 85.0511287798066
+
+_worker = threading.local()
+
+
+def tile_range(bbox, z):
+    """
+    Return (min_x, min_y, max_x, max_y) of tiles at zoom z covering
+    bbox given as (min_lon, min_lat, max_lon, max_lat).
+    """
+    n = 2 ** z
+    min_lon, min_lat, max_lon, max_lat = bbox
+
+    def tile_x(lon):
+        return min(n - 1, max(0, int(math.floor((lon + 180.0) / 360.0 * n))))
+
+    def tile_y(lat):
+        lat = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat)))
+        y = (1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n
+        return min(n - 1, max(0, int(math.floor(y))))
+
+    return (tile_x(min_lon), tile_y(max_lat), tile_x(max_lon), tile_y(min_lat))
+
+
+def wafer_span_for_density(avg_tile_bytes, max_span, wafer_bytes):
+    """
+    Return the largest power of two not above max_span for which a wafer
+    of tiles of avg_tile_bytes fits into wafer_bytes, at least 1.
+    """
+    span = 1
+    while (span * 2 <= max_span and
+           (span * 2) ** 2 * avg_tile_bytes <= wafer_bytes):
+        span *= 2
+    return span
+
+
+def _init_worker(map_factory):
+    _worker.map = map_factory()
+
+
+def _create_wafer(x, y, z, span, tiles, compress, options):
+    # Runs in a worker, the map is created once per worker.
+    m = getattr(_worker, 'map', None)
+    if m is None:
+        raise RuntimeError('seed worker was not initialized')
+    min_x, min_y, max_x, max_y = tiles
+    result = []
+    raw_bytes = 0
+    # Whole wafers query datasources once.
+    options = dict({'chunk_span': span}, **options)
+    for tile_x, tile_y, data in mapnik.iter_mvt_wafer_merc(
+            m, x, y, z, span, **options):
+        if min_x <= tile_x <= max_x and min_y <= tile_y <= max_y:
+            raw_bytes += len(data)
+            if compress:
+                data = mapnik.compress_mvt(data)
+            result.append((z, tile_x, tile_y, data))
+    return result, raw_bytes
+
+
+def seed_mvt(map_factory, bbox, zooms, wafer_span=8, workers=None, sink=None,
+             processes=False, compress=True, batch_size=1000,
+             wafer_bytes=64 * 1024 * 1024, progress=None, **options):
+    """
+    Create vector tiles of zoom levels zooms covering bbox given as
+    (min_lon, min_lat, max_lon, max_lat) and write them to the sink.
+
+    map_factory is called once in each worker and returns the Map used
+    for creating tiles. With processes=True the workers are processes
+    and map_factory must be picklable.
+
+    Tiles are created in wafers of at most wafer_span x wafer_span tiles.
+    The span used for a zoom level is chosen by the average size of tiles
+    of the previous zoom level, so that a wafer takes about wafer_bytes.
+
+    The sink's write() method is called with lists of up to batch_size
+    (z, x, y, data) tuples, data are compressed unless compress is False.
+    The progress callback is called after each batch with the current
+    statistics, which are also returned: tiles, bytes, seconds and
+    tiles_per_second.
+
+    Other keyword arguments are passed to create_mvt_wafer_merc().
+    """
+    if sink is None:
+        raise ValueError('seed_mvt requires a sink')
+    workers = workers or os.cpu_count() or 1
+    executor_type = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    executor = executor_type(workers, initializer=_init_worker,
+                             initargs=(map_factory,))
+    max_pending = workers * 2
+
+    stats = {'tiles': 0, 'bytes': 0, 'seconds': 0.0, 'tiles_per_second': 0.0}
+    start = time.time()
+    batch = []
+
+    def flush():
+        if batch:
+            sink.write(list(batch))
+            del batch[:]
+        stats['seconds'] = time.time() - start
+        if stats['seconds'] > 0:
+            stats['tiles_per_second'] = stats['tiles'] / stats['seconds']
+        if progress is not None:
+            progress(dict(stats))
+
+    def collect(futures):
+        zoom_bytes = 0
+        for future in futures:
+            tiles, raw_bytes = future.result()
+            zoom_bytes += raw_bytes
+            for tile in tiles:
+                batch.append(tile)
+                stats['tiles'] += 1
+                stats['bytes'] += len(tile[3])
+                if len(batch) >= batch_size:
+                    flush()
+        return zoom_bytes
+
+    avg_tile_bytes = 0
+    try:
+        for z in sorted(zooms):
+            tiles = tile_range(bbox, z)
+            min_x, min_y, max_x, max_y = tiles
+            span = min(2 ** z, wafer_span_for_density(
+                avg_tile_bytes, wafer_span, wafer_bytes))
+            pending = set()
+            zoom_bytes = 0
+            # Wafers are aligned to multiples of span to stay in the world.
+            for y in range(min_y - min_y % span, max_y + 1, span):
+                for x in range(min_x - min_x % span, max_x + 1, span):
+                    pending.add(executor.submit(
+                        _create_wafer, x, y, z, span, tiles,
+                        compress, options))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending,
+                                             return_when=FIRST_COMPLETED)
+                        zoom_bytes += collect(done)
+            zoom_bytes += collect(pending)
+            zoom_tiles = (max_x - min_x + 1) * (max_y - min_y + 1)
+            avg_tile_bytes = zoom_bytes / zoom_tiles
+        flush()
+    finally:
+        executor.shutdown(wait=True)
+    return stats
@@ -0,0 +1,287 @@
+"""Writers storing tiles into MBTiles files and z/x/y directory trees.
+
+    >>> import mapnik
+    >>> with mapnik.MBTilesWriter('tiles.mbtiles', background=True) as store:
+    ...     mapnik.seed_mvt(map_factory, bbox, range(15), sink=store)
+
+Writers are sinks of seed_mvt(). Tiles are given as (z, x, y, data)
+tuples, for example:
+
+    >>> store.write((12, x, y, mapnik.compress_mvt(data))
+    ...             for x, y, data in mapnik.iter_mvt_wafer_merc(m, x, y, 12, 8))
+    >>> store.write_dict(mapnik.render_tiles(m, tiles))
+"""
+
+import abc
+import collections
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+
+
+class TileStoreWriter(abc.ABC):
+    """
+    Base of tile store writers.
+
+    Each write() stores its tiles at once, for MBTiles in a single
+    transaction. Tiles with identical content are stored only once.
+    With background=True tiles are stored by a writer thread, write()
+    only waits while max_queued batches are pending. Errors of the
+    writer thread are raised by the next write() or close().
+    """
+
+    def __init__(self, background=False, max_queued=16):
+        self.tiles_written = 0
+        self.duplicates = 0
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue(max_queued)
+            self._thread = threading.Thread(target=self._run,
+                                            name='mapnik-tile-store')
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, tiles):
+        """Store (z, x, y, data) tuples."""
+        self._raise_error()
+        tiles = list(tiles)
+        if not tiles:
+            return
+        if self._queue is None:
+            self._store(tiles)
+        else:
+            self._queue.put(tiles)
+
+    def write_dict(self, tiles, z=None):
+        """
+        Store tiles given as a dict keyed by (x, y, z), as returned by
+        render_tiles(), or by (x, y) with the zoom level z, as returned
+        by render_metatile().
+        """
+        if z is None:
+            self.write((key[2], key[0], key[1], data)
+                       for key, data in tiles.items())
+        else:
+            self.write((z, key[0], key[1], data)
+                       for key, data in tiles.items())
+
+    def close(self):
+        """Store all pending tiles and close the store."""
+        if self._queue is not None:
+            if self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            self._queue = None
+        else:
+            self._close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        try:
+            self._open()
+        except Exception as e:
+            self._error = e
+            return
+        done = False
+        try:
+            while not done:
+                tiles = self._queue.get()
+                if tiles is None:
+                    break
+                # Coalesce queued batches into one store call.
+                while True:
+                    try:
+                        more = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if more is None:
+                        done = True
+                        break
+                    tiles.extend(more)
+                self._store(tiles)
+        except Exception as e:
+            self._error = e
+            # Unblock producers, their tiles are dropped.
+            while not done and self._queue.get() is not None:
+                pass
+        finally:
+            self._close()
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    @abc.abstractmethod
+    def _store(self, tiles):
+        """Store a list of (z, x, y, data) tuples."""
+
+
+class MBTilesWriter(TileStoreWriter):
+    """
+    Writes tiles into an MBTiles file using the deduplicating schema,
+    identical tiles share one row in the images table. Rows of images
+    no longer referenced by rewritten tiles are deleted. Keys of metadata
+    are stored into the metadata table.
+    """
+
+    def __init__(self, path, metadata=None, background=False, max_queued=16):
+        self.path = path
+        self.metadata = metadata or {}
+        self._db = None
+        super(MBTilesWriter, self).__init__(background, max_queued)
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript("""
+            PRAGMA synchronous = OFF;
+            CREATE TABLE IF NOT EXISTS map (
+                zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                tile_id TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS map_index
+                ON map (zoom_level, tile_column, tile_row);
+            CREATE INDEX IF NOT EXISTS map_tile_id ON map (tile_id);
+            CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+            CREATE VIEW IF NOT EXISTS tiles AS
+                SELECT map.zoom_level AS zoom_level,
+                       map.tile_column AS tile_column,
+                       map.tile_row AS tile_row,
+                       images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name);
+            CREATE TEMP TABLE IF NOT EXISTS batch (
+                zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER);
+        """)
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)',
+                [(name, str(value)) for name, value in self.metadata.items()])
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _store(self, tiles):
+        images = []
+        rows = collections.OrderedDict()
+        replaced_ids = set()
+        for z, x, y, data in tiles:
+            tile_id = hashlib.sha1(data).hexdigest()
+            images.append((sqlite3.Binary(data), tile_id))
+            # MBTiles rows are numbered from the south.
+            key = (z, x, (1 << z) - 1 - y)
+            if key in rows:
+                replaced_ids.add(rows.pop(key))
+            rows[key] = tile_id
+        with self._db:
+            # Ids of replaced tiles are found by one join with the batch.
+            self._db.execute('DELETE FROM batch')
+            self._db.executemany(
+                'INSERT INTO batch (zoom_level, tile_column, tile_row) '
+                'VALUES (?, ?, ?)', list(rows))
+            replaced_ids.update(row[0] for row in self._db.execute(
+                'SELECT DISTINCT map.tile_id FROM map JOIN batch '
+                'USING (zoom_level, tile_column, tile_row)'))
+            changes = self._db.total_changes
+            self._db.executemany(
+                'INSERT OR IGNORE INTO images (tile_data, tile_id) '
+                'VALUES (?, ?)', images)
+            self.duplicates += len(images) - (self._db.total_changes - changes)
+            self._db.executemany(
+                'INSERT OR REPLACE INTO map '
+                '(zoom_level, tile_column, tile_row, tile_id) '
+                'VALUES (?, ?, ?, ?)',
+                [key + (tile_id,) for key, tile_id in rows.items()])
+            self._db.executemany(
+                'DELETE FROM images WHERE tile_id = ? AND NOT EXISTS '
+                '(SELECT 1 FROM map WHERE map.tile_id = ?)',
+                [(tile_id, tile_id) for tile_id in replaced_ids])
+        self.tiles_written += len(images)
+
+
+class DirectoryWriter(TileStoreWriter):
+    """
+    Writes tiles as files path/z/x/y.extension. Identical tiles are
+    hard links to the first file with the same content where the file
+    system supports it. Files of up to max_links recently written
+    contents are remembered for linking.
+    """
+
+    def __init__(self, path, extension='pbf', background=False,
+                 max_queued=16, max_links=65536):
+        self.path = path
+        self.extension = extension
+        self.max_links = max_links
+        self._directories = set()
+        # Files with the first copy of recent contents and the reverse.
+        self._files_by_id = collections.OrderedDict()
+        self._ids_by_file = {}
+        super(DirectoryWriter, self).__init__(background, max_queued)
+
+    def _store(self, tiles):
+        for z, x, y, data in tiles:
+            directory = os.path.join(self.path, str(z), str(x))
+            if directory not in self._directories:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._directories.add(directory)
+            filename = os.path.join(directory,
+                                    '%d.%s' % (y, self.extension))
+            tile_id = hashlib.sha1(data).digest()
+            first = self._files_by_id.get(tile_id)
+            if first is not None:
+                self._files_by_id.move_to_end(tile_id)
+            self.tiles_written += 1
+            if first == filename:
+                self.duplicates += 1
+                continue
+            # Never write through an existing file, it may be linked.
+            old_id = self._ids_by_file.pop(filename, None)
+            if old_id is not None:
+                del self._files_by_id[old_id]
+            if os.path.lexists(filename):
+                os.remove(filename)
+            if first is not None and self._link(first, filename):
+                self.duplicates += 1
+            else:
+                with open(filename, 'wb') as f:
+                    f.write(data)
+                self._remember(tile_id, filename)
+
+    def _remember(self, tile_id, filename):
+        old_filename = self._files_by_id.pop(tile_id, None)
+        if old_filename is not None:
+            del self._ids_by_file[old_filename]
+        self._files_by_id[tile_id] = filename
+        self._ids_by_file[filename] = tile_id
+        while len(self._files_by_id) > self.max_links:
+            _, old_filename = self._files_by_id.popitem(last=False)
+            del self._ids_by_file[old_filename]
+
+    def _link(self, source, filename):
+        try:
+            os.link(source, filename)
+            return True
+        except OSError:
+            return False
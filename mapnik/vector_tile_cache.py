@@ -0,0 +1,157 @@
+"""In-process cache of created vector tiles.
+
+    >>> import mapnik
+    >>> mapnik.set_vector_tile_cache(mapnik.VectorTileCache(256 * 1024 * 1024))
+    >>> mapnik.create_mvt_merc(m, 2257, 1393, 12)  # created
+    >>> mapnik.create_mvt_merc(m, 2257, 1393, 12)  # cached
+    >>> mapnik.get_vector_tile_cache().hits
+    1
+"""
+
+import collections
+import inspect
+import threading
+import weakref
+
+
+def call_signature(names, options):
+    """
+    Signature of a Boost.Python function, which inspect cannot read,
+    with positional arguments names and (name, default) options.
+    """
+    params = [inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+              for name in names]
+    params += [inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                                 default=default)
+               for name, default in options]
+    return inspect.Signature(params)
+
+
+# Arguments which do not change created tiles.
+_UNKEYED_ARGUMENTS = ('map', 'threading_mode')
+
+
+class VectorTileCache(object):
+    """
+    LRU cache of vector tiles limited by the total size of tile buffers.
+
+    Tiles are keyed by the Map object, tile coordinates and all other
+    arguments of create_mvt_merc() or create_mvt_wafer_merc(). Entries
+    of a Map are dropped when the Map is deleted. A Map modified after
+    its tiles were cached must be passed to invalidate().
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_create(self, create, m, args, kwargs, signature=None):
+        """
+        Return cached create(m, *args, **kwargs), call it on a miss.
+
+        With the signature of create, arguments are keyed with defaults
+        applied, so passing a default or a keyword argument positionally
+        gives the same key.
+        """
+        if signature is None:
+            arguments = (args, tuple(sorted(kwargs.items())))
+        else:
+            try:
+                bound = signature.bind(m, *args, **kwargs)
+            except TypeError:
+                # create() reports the invalid arguments
+                return create(m, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = tuple((name, value) for name, value in bound.arguments.items()
+                              if name not in _UNKEYED_ARGUMENTS)
+        key = (id(m), create.__name__, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[0]
+                # wafers are lists, callers must not modify the cached one
+                return list(value) if isinstance(value, list) else value
+            self.misses += 1
+        value = create(m, *args, **kwargs)
+        if isinstance(value, list):
+            self._insert(m, key, list(value))
+        else:
+            self._insert(m, key, value)
+        return value
+
+    def _insert(self, m, key, value):
+        if isinstance(value, list):
+            size = sum(len(tile) for tile in value)
+        else:
+            size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            map_id = id(m)
+            if map_id not in self._maps:
+                self._maps[map_id] = set()
+                weakref.finalize(m, self._drop_map, map_id)
+            self._maps[map_id].add(key)
+            self._entries[key] = (value, size)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                old_key, (_, old_size) = self._entries.popitem(last=False)
+                self._maps[old_key[0]].discard(old_key)
+                self.size_bytes -= old_size
+                self.evictions += 1
+
+    def _drop_map(self, map_id):
+        with self._lock:
+            for key in self._maps.pop(map_id, ()):
+                _, size = self._entries.pop(key)
+                self.size_bytes -= size
+
+    def invalidate(self, m):
+        """Drop all tiles created with the Map m."""
+        self._drop_map(id(m))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for keys in self._maps.values():
+                keys.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'size_bytes': self.size_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+_vector_tile_cache = None
+
+
+def set_vector_tile_cache(cache):
+    """
+    Set the VectorTileCache used by create_mvt_merc() and
+    create_mvt_wafer_merc(), None disables caching.
+    """
+    global _vector_tile_cache
+    _vector_tile_cache = cache
+
+
+def get_vector_tile_cache():
+    return _vector_tile_cache
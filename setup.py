@@ -343,6 +343,8 @@ setup(
             'src/mapnik_gamma_method.cpp',
             'src/mapnik_geometry.cpp',
             'src/mapnik_image.cpp',
+            'src/mapnik_image_buffer.cpp',
+            'src/mapnik_image_pool.cpp',
             'src/mapnik_image_view.cpp',
             'src/mapnik_label_collision_detector.cpp',
             'src/mapnik_layer.cpp',
@@ -367,6 +369,9 @@ setup(
             'src/mapnik_vector_tile_render.cpp',
             'src/mapnik_vector_tile_preview.cpp',
             'src/mapnik_vector_tile_info.cpp',
+            'src/mapnik_vector_tile_arrays.cpp',
+            'src/mapnik_vector_tile_decoded.cpp',
+            'src/mapnik_vector_tile_stats.cpp',
             '/usr/src/mapbox/mapnik-vector-tile/vector_tile.pb.cc',
             'src/parallel_encoding.cpp',
         ],
@@ -0,0 +1,43 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+#ifndef MAPNIK_DEFERRED_DATASOURCES_HPP
+#define MAPNIK_DEFERRED_DATASOURCES_HPP
+
+// stl
+#include <string>
+#include <vector>
+
+// Input plugins added by defer_datasource() are loaded only when
+// a datasource of their type is about to be created.
+
+void defer_datasource(std::string const& path);
+
+void load_deferred_datasource(std::string const& type);
+
+// Loads plugins of all datasource types referenced by a map XML.
+void load_deferred_datasources_for_xml(std::string const& xml);
+
+void load_deferred_datasources_for_file(std::string const& filename);
+
+std::vector<std::string> deferred_datasource_names();
+
+#endif // MAPNIK_DEFERRED_DATASOURCES_HPP
@@ -0,0 +1,75 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+
+#ifndef MAPNIK_FILE_STAMP_HPP
+#define MAPNIK_FILE_STAMP_HPP
+
+// stl
+#include <climits>
+#include <cstdint>
+#include <cstdlib>
+#include <string>
+
+#include <sys/stat.h>
+
+// A version of a file: its canonical path, modification time in
+// nanoseconds and size. Files modified or replaced in place get
+// a different stamp.
+struct file_stamp
+{
+    std::string path;
+    std::int64_t mtime_ns = 0;
+    std::int64_t size = 0;
+
+    bool operator==(file_stamp const& other) const
+    {
+        return path == other.path &&
+            mtime_ns == other.mtime_ns &&
+            size == other.size;
+    }
+
+    bool operator!=(file_stamp const& other) const
+    {
+        return !(*this == other);
+    }
+};
+
+inline bool get_file_stamp(std::string const& filename, file_stamp & stamp)
+{
+    struct stat file_stat;
+    if (::stat(filename.c_str(), &file_stat) != 0)
+    {
+        return false;
+    }
+    char resolved[PATH_MAX];
+    stamp.path = ::realpath(filename.c_str(), resolved) ? resolved : filename;
+#if defined(__APPLE__)
+    auto const& mtime = file_stat.st_mtimespec;
+#else
+    auto const& mtime = file_stat.st_mtim;
+#endif
+    stamp.mtime_ns = static_cast<std::int64_t>(mtime.tv_sec) * 1000000000 + mtime.tv_nsec;
+    stamp.size = file_stat.st_size;
+    return true;
+}
+
+#endif // MAPNIK_FILE_STAMP_HPP
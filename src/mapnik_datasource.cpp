@@ -40,6 +40,8 @@
 #include <mapnik/feature_layer_desc.hpp>
 #include <mapnik/memory_datasource.hpp>
 
+#include "deferred_datasources.hpp"
+
 
 using mapnik::datasource;
 using mapnik::memory_datasource;
@@ -88,6 +90,11 @@ std::shared_ptr<mapnik::datasource> create_datasource(dict const& d)
         }
     }
 
+    boost::optional<std::string> type = params.get<std::string>("type");
+    if (type)
+    {
+        load_deferred_datasource(*type);
+    }
     return mapnik::datasource_cache::instance().create(params);
 }
 
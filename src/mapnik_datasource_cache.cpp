@@ -33,6 +33,227 @@
 #include <mapnik/datasource.hpp>
 #include <mapnik/datasource_cache.hpp>
 
+// stl
+#include <algorithm>
+#include <fstream>
+#include <map>
+#include <mutex>
+#include <regex>
+#include <set>
+#include <sstream>
+
+#include "deferred_datasources.hpp"
+#include "file_stamp.hpp"
+
+namespace  {
+
+class deferred_datasources
+{
+public:
+    static deferred_datasources & instance()
+    {
+        static deferred_datasources deferred;
+        return deferred;
+    }
+
+    void add(std::string const& path)
+    {
+        std::string name = path.substr(path.find_last_of("/\\") + 1);
+        std::string::size_type ext = name.rfind(".input");
+        if (ext != std::string::npos)
+        {
+            name.erase(ext);
+        }
+        std::lock_guard<std::mutex> lock(mutex_);
+        plugins_[name] = path;
+    }
+
+    // Loading holds the lock, so a concurrent create() of the type waits
+    // until the plugin is registered. Plugins which fail to register
+    // stay deferred and are tried again.
+    void load(std::string const& name)
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto it = plugins_.find(name);
+        if (it == plugins_.end())
+        {
+            return;
+        }
+        mapnik::datasource_cache & cache = mapnik::datasource_cache::instance();
+        bool registered = cache.register_datasource(it->second);
+        if (!registered)
+        {
+            std::vector<std::string> names = cache.plugin_names();
+            registered = std::find(names.begin(), names.end(), name) != names.end();
+        }
+        if (registered)
+        {
+            plugins_.erase(it);
+        }
+    }
+
+    void load_all()
+    {
+        for (auto const& name : names())
+        {
+            load(name);
+        }
+    }
+
+    std::vector<std::string> names()
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        std::vector<std::string> result;
+        for (auto const& plugin : plugins_)
+        {
+            result.push_back(plugin.first);
+        }
+        return result;
+    }
+
+    bool empty()
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return plugins_.empty();
+    }
+
+private:
+    std::mutex mutex_;
+    std::map<std::string, std::string> plugins_;
+};
+
+}
+
+void defer_datasource(std::string const& path)
+{
+    deferred_datasources::instance().add(path);
+}
+
+void load_deferred_datasource(std::string const& type)
+{
+    deferred_datasources::instance().load(type);
+}
+
+namespace {
+
+struct xml_datasources
+{
+    // Entities and includes can bring datasources from other files.
+    bool all = false;
+    std::set<std::string> types;
+};
+
+xml_datasources scan_xml(std::string const& xml)
+{
+    xml_datasources found;
+    if (xml.find("<!ENTITY") != std::string::npos ||
+        xml.find("xi:include") != std::string::npos)
+    {
+        found.all = true;
+        return found;
+    }
+    static const std::regex type_param(
+        R"(<Parameter[^>]*name\s*=\s*["']type["'][^>]*>\s*(?:<!\[CDATA\[)?\s*([^<\]\s]+))");
+    for (std::sregex_iterator it(xml.begin(), xml.end(), type_param), end; it != end; ++it)
+    {
+        found.types.insert((*it)[1].str());
+    }
+    return found;
+}
+
+void load_datasources(xml_datasources const& found)
+{
+    deferred_datasources & deferred = deferred_datasources::instance();
+    if (found.all)
+    {
+        deferred.load_all();
+        return;
+    }
+    for (auto const& type : found.types)
+    {
+        deferred.load(type);
+    }
+}
+
+std::size_t const max_scanned_files = 256;
+
+// Datasource types of map files, scanned again when a file changes.
+class scanned_files
+{
+public:
+    static scanned_files & instance()
+    {
+        static scanned_files scanned;
+        return scanned;
+    }
+
+    bool find(file_stamp const& stamp, xml_datasources & found)
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto it = files_.find(stamp.path);
+        if (it == files_.end() || it->second.first != stamp)
+        {
+            return false;
+        }
+        found = it->second.second;
+        return true;
+    }
+
+    void insert(file_stamp const& stamp, xml_datasources const& found)
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        if (files_.size() >= max_scanned_files && files_.find(stamp.path) == files_.end())
+        {
+            files_.clear();
+        }
+        files_[stamp.path] = std::make_pair(stamp, found);
+    }
+
+private:
+    std::mutex mutex_;
+    std::map<std::string, std::pair<file_stamp, xml_datasources>> files_;
+};
+
+}
+
+void load_deferred_datasources_for_xml(std::string const& xml)
+{
+    if (deferred_datasources::instance().empty())
+    {
+        return;
+    }
+    load_datasources(scan_xml(xml));
+}
+
+void load_deferred_datasources_for_file(std::string const& filename)
+{
+    file_stamp stamp;
+    if (deferred_datasources::instance().empty() ||
+        !get_file_stamp(filename, stamp))
+    {
+        return;
+    }
+    xml_datasources found;
+    if (!scanned_files::instance().find(stamp, found))
+    {
+        std::ifstream file(filename.c_str(), std::ios::in | std::ios::binary);
+        if (!file)
+        {
+            return;
+        }
+        std::ostringstream content;
+        content << file.rdbuf();
+        found = scan_xml(content.str());
+        scanned_files::instance().insert(stamp, found);
+    }
+    load_datasources(found);
+}
+
+std::vector<std::string> deferred_datasource_names()
+{
+    return deferred_datasources::instance().names();
+}
+
 namespace  {
 
 using namespace boost::python;
@@ -63,6 +284,11 @@ std::shared_ptr<mapnik::datasource> create_datasource(const dict& d)
         }
     }
 
+    boost::optional<std::string> type = params.get<std::string>("type");
+    if (type)
+    {
+        load_deferred_datasource(*type);
+    }
     return mapnik::datasource_cache::instance().create(params);
 }
 
@@ -73,7 +299,11 @@ void register_datasources(std::string const& path)
 
 std::vector<std::string> plugin_names()
 {
-    return mapnik::datasource_cache::instance().plugin_names();
+    std::vector<std::string> names = mapnik::datasource_cache::instance().plugin_names();
+    std::vector<std::string> deferred = deferred_datasource_names();
+    names.insert(names.end(), deferred.begin(), deferred.end());
+    std::sort(names.begin(), names.end());
+    return names;
 }
 
 std::string plugin_directories()
@@ -92,6 +322,10 @@ void export_datasource_cache()
         .staticmethod("create")
         .def("register_datasources",&register_datasources)
         .staticmethod("register_datasources")
+        .def("defer_datasource",&defer_datasource,
+             "Register an input plugin file to be loaded when its\n"
+             "datasource type is first created.\n")
+        .staticmethod("defer_datasource")
         .def("plugin_names",&plugin_names)
         .staticmethod("plugin_names")
         .def("plugin_directories",&plugin_directories)
@@ -30,15 +30,30 @@
 
 #include <mapnik/font_engine_freetype.hpp>
 
+using mapnik::freetype_engine;
+
+boost::python::dict face_mapping()
+{
+    boost::python::dict mapping;
+    for (auto const& item : freetype_engine::get_mapping())
+    {
+        mapping[item.first] = boost::python::make_tuple(
+            item.second.first, item.second.second);
+    }
+    return mapping;
+}
+
 void export_font_engine()
 {
-    using mapnik::freetype_engine;
     using namespace boost::python;
     class_<freetype_engine, boost::noncopyable>("FontEngine", no_init)
         .def("register_font", &freetype_engine::register_font)
         .def("register_fonts", &freetype_engine::register_fonts)
         .def("face_names", &freetype_engine::face_names)
+        .def("face_mapping", &face_mapping,
+             "Return a dict of face names to (face index, font file).")
         .staticmethod("register_font")
         .staticmethod("register_fonts")
-        .staticmethod("face_names");
+        .staticmethod("face_names")
+        .staticmethod("face_mapping");
 }
@@ -38,6 +38,8 @@
 #include <mapnik/image_reader.hpp>
 #include <mapnik/image_compositing.hpp>
 #include <mapnik/image_view_any.hpp>
+#include <mapnik/value_error.hpp>
+#include <mapnik/util/parallelize.hpp>
 
 #include <mapnik/marker.hpp>
 #include <mapnik/marker_cache.hpp>
@@ -50,6 +52,13 @@
 #include <mapnik/svg/svg_renderer_agg.hpp>
 #include <mapnik/svg/svg_path_attributes.hpp>
 
+// stl
+#include <algorithm>
+#include <cstdint>
+#include <limits>
+#include <memory>
+#include <vector>
+
 #include "agg_rasterizer_scanline_aa.h"
 #include "agg_basics.h"
 #include "agg_rendering_buffer.h"
@@ -57,6 +66,10 @@
 #include "agg_pixfmt_rgba.h"
 #include "agg_scanline_u.h"
 
+#include "mapnik_image_buffer.hpp"
+#include "mapnik_threads.hpp"
+#include "parallel_encoding.hpp"
+
 // cairo
 #if defined(HAVE_CAIRO) && defined(HAVE_PYCAIRO)
 #include <mapnik/cairo/cairo_context.hpp>
@@ -70,6 +83,7 @@ using mapnik::image_reader;
 using mapnik::get_image_reader;
 using mapnik::type_from_filename;
 using mapnik::save_to_file;
+using mapnik::python_unblock_auto_block;
 
 using namespace boost::python;
 
@@ -82,30 +96,63 @@ PyObject* tostring1( image_any const& im)
 // encode (png,jpeg)
 PyObject* tostring2(image_any const & im, std::string const& format)
 {
-    std::string s = mapnik::save_to_string(im, format);
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = mapnik::save_to_string(im, format);
+    }
     return ::PyBytes_FromStringAndSize (s.data(),s.size());
 }
 
 PyObject* tostring3(image_any const & im, std::string const& format, mapnik::rgba_palette const& pal)
 {
-    std::string s = mapnik::save_to_string(im, format, pal);
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = mapnik::save_to_string(im, format, *copy_palette(pal));
+    }
+    return ::PyBytes_FromStringAndSize(s.data(),s.size());
+}
+
+// solid images are encoded once per color, size, format and palette
+PyObject* tostring4(image_any const & im, std::string const& format, encoded_image_cache & cache)
+{
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = encode_cached(mapnik::create_view(im, 0, 0, im.width(), im.height()), format, nullptr, cache);
+    }
+    return ::PyBytes_FromStringAndSize(s.data(),s.size());
+}
+
+PyObject* tostring5(image_any const & im, std::string const& format, mapnik::rgba_palette const& pal,
+                    encoded_image_cache & cache)
+{
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = encode_cached(mapnik::create_view(im, 0, 0, im.width(), im.height()), format, &pal, cache);
+    }
     return ::PyBytes_FromStringAndSize(s.data(),s.size());
 }
 
 
 void save_to_file1(mapnik::image_any const& im, std::string const& filename)
 {
+    python_unblock_auto_block b;
     save_to_file(im,filename);
 }
 
 void save_to_file2(mapnik::image_any const& im, std::string const& filename, std::string const& type)
 {
+    python_unblock_auto_block b;
     save_to_file(im,filename,type);
 }
 
 void save_to_file3(mapnik::image_any const& im, std::string const& filename, std::string const& type, mapnik::rgba_palette const& pal)
 {
-    save_to_file(im,filename,type,pal);
+    python_unblock_auto_block b;
+    save_to_file(im,filename,type,*copy_palette(pal));
 }
 
 mapnik::image_view_any get_view(mapnik::image_any const& data,unsigned x,unsigned y, unsigned w,unsigned h)
@@ -225,6 +272,7 @@ unsigned get_type(mapnik::image_any & im)
 
 std::shared_ptr<image_any> open_from_file(std::string const& filename)
 {
+    python_unblock_auto_block b;
     boost::optional<std::string> type = type_from_filename(filename);
     if (type)
     {
@@ -240,6 +288,7 @@ std::shared_ptr<image_any> open_from_file(std::string const& filename)
 
 std::shared_ptr<image_any> fromstring(std::string const& str)
 {
+    python_unblock_auto_block b;
     std::unique_ptr<image_reader> reader(get_image_reader(str.c_str(),str.size()));
     if (reader.get())
     {
@@ -250,17 +299,161 @@ std::shared_ptr<image_any> fromstring(std::string const& str)
 
 std::shared_ptr<image_any> frombuffer(PyObject * obj)
 {
-    void const* buffer=0;
-    Py_ssize_t buffer_len;
-    if (PyObject_AsReadBuffer(obj, &buffer, &buffer_len) == 0)
+    Py_buffer view;
+    if (PyObject_GetBuffer(obj, &view, PyBUF_SIMPLE) != 0)
     {
-        std::unique_ptr<image_reader> reader(get_image_reader(reinterpret_cast<char const*>(buffer),buffer_len));
-        if (reader.get())
+        PyErr_Clear();
+        throw mapnik::image_reader_exception("Failed to load image from buffer" );
+    }
+    // The exporter can not resize or free the buffer until it is released,
+    // so it is safe to decode it without the GIL.
+    std::unique_ptr<Py_buffer, void(*)(Py_buffer*)> buffer_guard(&view, &PyBuffer_Release);
+    python_unblock_auto_block b;
+    std::unique_ptr<image_reader> reader(get_image_reader(reinterpret_cast<char const*>(view.buf),view.len));
+    if (reader.get())
+    {
+        return std::make_shared<image_any>(reader->read(0,0,reader->width(),reader->height()));
+    }
+    throw mapnik::image_reader_exception("Failed to load image from buffer" );
+}
+
+// Holds a buffer of an exporter, the exporter is kept alive and
+// can not reallocate the memory until it is released.
+struct exported_buffer
+{
+    Py_buffer view;
+    bool writable = true;
+
+    explicit exported_buffer(PyObject * obj)
+    {
+        if (PyObject_GetBuffer(obj, &view, PyBUF_RECORDS) == 0)
         {
-            return std::make_shared<image_any>(reader->read(0,0,reader->width(),reader->height()));
+            return;
+        }
+        if (!PyErr_ExceptionMatches(PyExc_BufferError))
+        {
+            throw_error_already_set();
+        }
+        PyErr_Clear();
+        writable = false;
+        if (PyObject_GetBuffer(obj, &view, PyBUF_RECORDS_RO) != 0)
+        {
+            throw_error_already_set();
         }
     }
-    throw mapnik::image_reader_exception("Failed to load image from buffer" );
+
+    // The last reference of an image may be dropped without the GIL.
+    ~exported_buffer()
+    {
+        PyGILState_STATE state = PyGILState_Ensure();
+        PyBuffer_Release(&view);
+        PyGILState_Release(state);
+    }
+};
+
+template <typename T>
+image_any * wrap_pixels(void * data, int width, int height, bool premultiplied)
+{
+    return new image_any(T(width, height, static_cast<unsigned char*>(data), premultiplied, false));
+}
+
+image_any * wrap_pixels(mapnik::image_dtype dtype, void * data, int width, int height, bool premultiplied)
+{
+    switch (dtype)
+    {
+    case mapnik::image_dtype_rgba8:
+        return wrap_pixels<mapnik::image_rgba8>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray8:
+        return wrap_pixels<mapnik::image_gray8>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray8s:
+        return wrap_pixels<mapnik::image_gray8s>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray16:
+        return wrap_pixels<mapnik::image_gray16>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray16s:
+        return wrap_pixels<mapnik::image_gray16s>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray32:
+        return wrap_pixels<mapnik::image_gray32>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray32s:
+        return wrap_pixels<mapnik::image_gray32s>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray32f:
+        return wrap_pixels<mapnik::image_gray32f>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray64:
+        return wrap_pixels<mapnik::image_gray64>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray64s:
+        return wrap_pixels<mapnik::image_gray64s>(data, width, height, premultiplied);
+    case mapnik::image_dtype_gray64f:
+        return wrap_pixels<mapnik::image_gray64f>(data, width, height, premultiplied);
+    default:
+        throw mapnik::value_error("Unsupported image type");
+    }
+}
+
+// Pixels of writable, C-contiguous and aligned buffers are used by the
+// Image without copying, other buffers are copied.
+std::shared_ptr<image_any> from_array(object const& obj, mapnik::image_dtype dtype,
+                                      bool premultiplied, int width, int height)
+{
+    std::size_t const itemsize = image_buffer_itemsize(dtype);
+    if (itemsize == 0)
+    {
+        throw mapnik::value_error("Unsupported image type");
+    }
+    std::size_t const pixel_size = dtype == mapnik::image_dtype_rgba8 ? 4 : itemsize;
+    auto buffer = std::make_shared<exported_buffer>(obj.ptr());
+    Py_buffer & view = buffer->view;
+
+    if (width != 0 || height != 0)
+    {
+        // Raw pixels of the given size, the format is not checked.
+        if (width <= 0 || height <= 0)
+        {
+            throw mapnik::value_error("width and height must be both greater than zero");
+        }
+        if (static_cast<std::size_t>(view.len) !=
+            static_cast<std::size_t>(width) * static_cast<std::size_t>(height) * pixel_size)
+        {
+            throw mapnik::value_error("Buffer size does not match width and height");
+        }
+    }
+    else
+    {
+        bool const packed_rgba = dtype == mapnik::image_dtype_rgba8 && view.ndim == 2;
+        bool const valid_shape =
+            (view.ndim == 2 && static_cast<std::size_t>(view.itemsize) == pixel_size) ||
+            (view.ndim == 3 && dtype == mapnik::image_dtype_rgba8 &&
+             view.shape[2] == 4 && view.itemsize == 1);
+        if (!valid_shape)
+        {
+            throw mapnik::value_error(dtype == mapnik::image_dtype_rgba8
+                ? "Expected a buffer of shape (height, width, 4) of bytes or (height, width) of uint32"
+                : "Expected a buffer of shape (height, width) of pixel values");
+        }
+        if (!image_buffer_format_matches(view.format, packed_rgba ? mapnik::image_dtype_gray32 : dtype))
+        {
+            throw mapnik::value_error("Buffer format does not match the image type");
+        }
+        if (view.shape[0] > std::numeric_limits<int>::max() ||
+            view.shape[1] > std::numeric_limits<int>::max())
+        {
+            throw mapnik::value_error("Buffer is too large for an image");
+        }
+        height = static_cast<int>(view.shape[0]);
+        width = static_cast<int>(view.shape[1]);
+    }
+
+    bool const aligned = reinterpret_cast<std::uintptr_t>(view.buf) % pixel_size == 0;
+    if (buffer->writable && aligned && PyBuffer_IsContiguous(&view, 'C'))
+    {
+        std::unique_ptr<image_any> im(wrap_pixels(dtype, view.buf, width, height, premultiplied));
+        // The deleter keeps the buffer until the image is destroyed.
+        return std::shared_ptr<image_any>(im.release(), [buffer](image_any * p) { delete p; });
+    }
+    auto im = std::make_shared<image_any>(width, height, dtype, false, premultiplied, false);
+    if (PyBuffer_ToContiguous(im->bytes(), &view, view.len, 'C') != 0)
+    {
+        throw_error_already_set();
+    }
+    return im;
 }
 
 void set_grayscale_to_alpha(image_any & im)
@@ -303,19 +496,193 @@ void clear(image_any & im)
     mapnik::fill(im, 0);
 }
 
-void composite(image_any & dst, image_any & src, mapnik::composite_mode_e mode, float opacity, int dx, int dy)
+namespace {
+
+// Compositing is done in stripes of whole rows, images of up to 64K
+// pixels are processed in one stripe.
+unsigned stripe_rows(unsigned width)
+{
+    return std::max(1u, 65536u / std::max(1u, width));
+}
+
+// Rows [y0, y1) of the image, sharing its pixels.
+mapnik::image_rgba8 image_rows(mapnik::image_rgba8 const& im, unsigned y0, unsigned y1)
+{
+    auto * data = const_cast<mapnik::image_rgba8::pixel_type *>(im.get_row(y0));
+    return mapnik::image_rgba8(im.width(), y1 - y0,
+                               reinterpret_cast<unsigned char *>(data),
+                               im.get_premultiplied(), im.painted());
+}
+
+struct composite_layer
+{
+    image_any const* src;
+    mapnik::composite_mode_e mode;
+    float opacity;
+    int dx;
+    int dy;
+};
+
+// Every stripe of the destination is premultiplied, composited with all
+// layers in order and demultiplied again, stripes do not depend on each
+// other. Sources are only read: rows of a source which is not
+// premultiplied are premultiplied into a buffer of the job.
+struct composite_func
+{
+    mapnik::image_rgba8 & dst;
+    std::vector<composite_layer> const& layers;
+    unsigned rows;
+    bool premultiply;
+    bool demultiply;
+
+    void operator()(unsigned begin, unsigned end)
+    {
+        using pixel_type = mapnik::image_rgba8::pixel_type;
+        std::vector<pixel_type> buffer;
+        int width = dst.width();
+        for (unsigned stripe = begin; stripe < end; ++stripe)
+        {
+            int y0 = stripe * rows;
+            int y1 = std::min<int>(dst.height(), y0 + rows);
+            mapnik::image_rgba8 dst_rows = image_rows(dst, y0, y1);
+            if (premultiply)
+            {
+                mapnik::premultiply_alpha(dst_rows);
+            }
+            for (auto const& layer : layers)
+            {
+                auto const& src = layer.src->get<mapnik::image_rgba8>();
+                int s0 = std::max(0, y0 - layer.dy);
+                int s1 = std::min<int>(src.height(), y1 - layer.dy);
+                int x0 = std::max(0, -layer.dx);
+                int x1 = std::min<int>(src.width(), width - layer.dx);
+                if (s0 >= s1 || x0 >= x1)
+                {
+                    continue;
+                }
+                int dy = s0 + layer.dy - y0;
+                if (src.get_premultiplied())
+                {
+                    mapnik::composite(dst_rows, image_rows(src, s0, s1),
+                                      layer.mode, layer.opacity, layer.dx, dy);
+                    continue;
+                }
+                std::size_t row_size = x1 - x0;
+                buffer.resize(row_size * (s1 - s0));
+                for (int y = s0; y < s1; ++y)
+                {
+                    std::copy(src.get_row(y) + x0, src.get_row(y) + x1,
+                              buffer.data() + row_size * (y - s0));
+                }
+                mapnik::image_rgba8 src_rows(x1 - x0, s1 - s0,
+                                             reinterpret_cast<unsigned char *>(buffer.data()),
+                                             false, src.painted());
+                mapnik::premultiply_alpha(src_rows);
+                mapnik::composite(dst_rows, src_rows, layer.mode, layer.opacity,
+                                  layer.dx + x0, dy);
+            }
+            if (demultiply)
+            {
+                mapnik::demultiply_alpha(dst_rows);
+            }
+        }
+    }
+};
+
+// Called without the GIL. The destination is left premultiplied unless
+// demultiply is set.
+void composite_layers(image_any & dst, std::vector<composite_layer> const& layers,
+                      unsigned threads, bool demultiply)
+{
+    bool rgba8 = dst.is<mapnik::image_rgba8>();
+    for (auto const& layer : layers)
+    {
+        rgba8 = rgba8 && layer.src->is<mapnik::image_rgba8>();
+    }
+    if (!rgba8)
+    {
+        // Other image types are not premultiplied.
+        for (auto const& layer : layers)
+        {
+            mapnik::composite(dst, *layer.src, layer.mode, layer.opacity, layer.dx, layer.dy);
+        }
+        return;
+    }
+
+    auto & dst_rgba = dst.get<mapnik::image_rgba8>();
+    bool premultiply = !dst_rgba.get_premultiplied();
+    unsigned rows = stripe_rows(dst_rgba.width());
+    unsigned stripes = (dst_rgba.height() + rows - 1) / rows;
+    composite_func func{dst_rgba, layers, rows, premultiply, premultiply && demultiply};
+    mapnik::util::parallelize(func, jobs_by_chunks(stripes, threads), stripes);
+    dst_rgba.set_premultiplied(!(premultiply && demultiply));
+}
+
+// Images composited onto themselves are read while they are written,
+// they are composited from a copy.
+image_any const* layer_source(image_any const& dst, image_any const& src,
+                              std::vector<std::unique_ptr<image_any>> & copies)
 {
-    bool demultiply_dst = mapnik::premultiply_alpha(dst);
-    bool demultiply_src = mapnik::premultiply_alpha(src);
-    mapnik::composite(dst,src,mode,opacity,dx,dy);
-    if (demultiply_dst)
+    if (&src != &dst)
     {
-        mapnik::demultiply_alpha(dst);
+        return &src;
     }
-    if (demultiply_src)
+    copies.emplace_back(new image_any(src));
+    return copies.back().get();
+}
+
+}
+
+void composite(image_any & dst, image_any const& src, mapnik::composite_mode_e mode, float opacity, int dx, int dy,
+               unsigned threads, bool demultiply)
+{
+    std::vector<std::unique_ptr<image_any>> copies;
+    std::vector<composite_layer> layers{{layer_source(dst, src, copies), mode, opacity, dx, dy}};
+    python_unblock_auto_block b;
+    composite_layers(dst, layers, threads, demultiply);
+}
+
+void composite_many(image_any & dst, object const& layers, unsigned threads, bool demultiply)
+{
+    std::vector<object> items;
+    std::vector<std::unique_ptr<image_any>> copies;
+    std::vector<composite_layer> parsed;
+    stl_input_iterator<object> it(layers), end;
+    for (; it != end; ++it)
+    {
+        object item = *it;
+        auto size = len(item);
+        if (size < 1 || size > 5)
+        {
+            throw mapnik::value_error("composite_many expects (image, mode, opacity, dx, dy) tuples");
+        }
+        image_any const& src = extract<image_any const&>(item[0]);
+        composite_layer layer{layer_source(dst, src, copies), mapnik::src_over, 1.0f, 0, 0};
+        if (size > 1) layer.mode = extract<mapnik::composite_mode_e>(item[1]);
+        if (size > 2) layer.opacity = extract<float>(item[2]);
+        if (size > 3) layer.dx = extract<int>(item[3]);
+        if (size > 4) layer.dy = extract<int>(item[4]);
+        items.push_back(item);
+        parsed.push_back(layer);
+    }
+    python_unblock_auto_block b;
+    composite_layers(dst, parsed, threads, demultiply);
+}
+
+// Pixels are exported writable without copying, numpy.asarray(im)
+// shares them with the Image.
+int image_getbuffer(PyObject * obj, Py_buffer * view, int flags)
+{
+    extract<image_any&> im(obj);
+    if (!im.check())
     {
-        mapnik::demultiply_alpha(src);
+        view->obj = nullptr;
+        PyErr_SetString(PyExc_BufferError, "Expected a mapnik.Image");
+        return -1;
     }
+    image_any & data = im();
+    return get_image_buffer(obj, view, flags, data.bytes(), data.get_dtype(),
+                            data.width(), data.height(), data.row_size(), false);
 }
 
 #if defined(HAVE_CAIRO) && defined(HAVE_PYCAIRO)
@@ -477,7 +844,8 @@ void export_image()
         .def(init<int,int,mapnik::image_dtype,bool,bool,bool>())
         .def("width",&image_any::width)
         .def("height",&image_any::height)
-        .def("view",&get_view)
+        // The view refers to pixels of the image.
+        .def("view",&get_view,with_custodian_and_ward_postcall<0,1>())
         .def("painted",&image_any::painted)
         .def("is_solid",&is_solid)
         .def("fill",&fill_color)
@@ -493,8 +861,16 @@ void export_image()
            arg("mode")=mapnik::src_over,
            arg("opacity")=1.0f,
            arg("dx")=0,
-           arg("dy")=0
-         ))
+           arg("dy")=0,
+           arg("threads")=0u,
+           arg("demultiply")=true
+         ),
+         "Composites the image onto this Image without holding the GIL,\n"
+         "the image itself is not modified. Large images are composited\n"
+         "in stripes of rows by up to `threads` threads, 0 uses half of\n"
+         "the cores. The Image stays premultiplied\n"
+         "when demultiply is False, which saves premultiplying it again\n"
+         "for every composite of a chain, call demultiply() at the end.\n")
         .def("compare",&compare,
          ( arg("self"),
            arg("image"),
@@ -534,6 +910,8 @@ void export_image()
         .def("tostring",&tostring1)
         .def("tostring",&tostring2)
         .def("tostring",&tostring3)
+        .def("tostring",&tostring4)
+        .def("tostring",&tostring5)
         .def("save", &save_to_file1)
         .def("save", &save_to_file2)
         .def("save", &save_to_file3)
@@ -543,6 +921,21 @@ void export_image()
         .staticmethod("frombuffer")
         .def("fromstring",&fromstring)
         .staticmethod("fromstring")
+        .def("from_array",&from_array,
+         ( arg("obj"),
+           arg("dtype")=mapnik::image_dtype_rgba8,
+           arg("premultiplied")=false,
+           // Size of one-dimensional buffers of raw pixels.
+           arg("width")=0,
+           arg("height")=0
+         ),
+         "Creates an Image from an object supporting the buffer protocol.\n"
+         "Buffers of shape (height, width) or (height, width, 4) for rgba8\n"
+         "with values of the dtype are used without copying when they are\n"
+         "writable and C-contiguous, other buffers are copied. Buffers\n"
+         "of any shape are read as raw pixels when width and height are given.\n"
+         ">>> im = mapnik.Image.from_array(numpy.zeros((256, 256, 4), numpy.uint8))\n")
+        .staticmethod("from_array")
 #if defined(HAVE_CAIRO) && defined(HAVE_PYCAIRO)
         .def("from_cairo",&from_cairo)
         .staticmethod("from_cairo")
@@ -552,4 +945,20 @@ void export_image()
         .staticmethod("from_svg")
         ;
 
+    def("composite_many",&composite_many,
+        ( arg("dst"),
+          arg("layers"),
+          arg("threads")=0u,
+          arg("demultiply")=true
+        ),
+        "Composites a sequence of (image, mode, opacity, dx, dy) tuples onto\n"
+        "the destination Image in order, trailing values may be omitted.\n"
+        "Every stripe of rows is premultiplied once and composited with all\n"
+        "layers by one of the threads, the layers are not modified.\n"
+        ">>> mapnik.composite_many(canvas, [(hillshade, mapnik.CompositeOp.multiply, 0.5), (labels,)])\n");
+
+    static PyBufferProcs image_buffer_procs;
+    image_buffer_procs.bf_getbuffer = &image_getbuffer;
+    image_buffer_procs.bf_releasebuffer = &release_image_buffer;
+    set_buffer_procs(scope().attr("Image"), &image_buffer_procs);
 }
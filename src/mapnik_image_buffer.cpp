@@ -0,0 +1,274 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+
+#include <mapnik/config.hpp>
+
+#include "mapnik_image_buffer.hpp"
+
+// stl
+#include <cstdint>
+#include <cstring>
+
+namespace {
+
+struct buffer_layout
+{
+    Py_ssize_t shape[3];
+    Py_ssize_t strides[3];
+};
+
+// Pointer of empty images, which may have no allocated pixels.
+unsigned char empty_buffer[1] = {0};
+
+struct view_pixels_visitor
+{
+    image_view_pixels operator()(mapnik::image_view_null const&) const
+    {
+        return image_view_pixels();
+    }
+
+    template <typename T>
+    image_view_pixels operator()(T const& view) const
+    {
+        std::size_t const pixel_size = sizeof(typename T::pixel_type);
+        image_view_pixels pixels;
+        pixels.row_size = view.width() * pixel_size;
+        pixels.row_stride = view.data().width() * pixel_size;
+        pixels.height = view.height();
+        pixels.premultiplied = view.get_premultiplied();
+        if (view.width() > 0 && view.height() > 0)
+        {
+            pixels.data = reinterpret_cast<unsigned char const*>(view.get_row(0));
+        }
+        return pixels;
+    }
+};
+
+bool little_endian()
+{
+    std::uint16_t const one = 1;
+    return *reinterpret_cast<unsigned char const*>(&one) == 1;
+}
+
+}
+
+image_view_pixels get_view_pixels(mapnik::image_view_any const& view)
+{
+    return mapnik::util::apply_visitor(view_pixels_visitor(), view);
+}
+
+char const* image_buffer_format(mapnik::image_dtype dtype)
+{
+    switch (dtype)
+    {
+    case mapnik::image_dtype_rgba8:
+    case mapnik::image_dtype_gray8:
+        return "B";
+    case mapnik::image_dtype_gray8s:
+        return "b";
+    case mapnik::image_dtype_gray16:
+        return "H";
+    case mapnik::image_dtype_gray16s:
+        return "h";
+    case mapnik::image_dtype_gray32:
+        return "I";
+    case mapnik::image_dtype_gray32s:
+        return "i";
+    case mapnik::image_dtype_gray32f:
+        return "f";
+    case mapnik::image_dtype_gray64:
+        return "Q";
+    case mapnik::image_dtype_gray64s:
+        return "q";
+    case mapnik::image_dtype_gray64f:
+        return "d";
+    default:
+        return nullptr;
+    }
+}
+
+std::size_t image_buffer_itemsize(mapnik::image_dtype dtype)
+{
+    switch (dtype)
+    {
+    case mapnik::image_dtype_rgba8:
+    case mapnik::image_dtype_gray8:
+    case mapnik::image_dtype_gray8s:
+        return 1;
+    case mapnik::image_dtype_gray16:
+    case mapnik::image_dtype_gray16s:
+        return 2;
+    case mapnik::image_dtype_gray32:
+    case mapnik::image_dtype_gray32s:
+    case mapnik::image_dtype_gray32f:
+        return 4;
+    case mapnik::image_dtype_gray64:
+    case mapnik::image_dtype_gray64s:
+    case mapnik::image_dtype_gray64f:
+        return 8;
+    default:
+        return 0;
+    }
+}
+
+bool image_buffer_format_matches(char const* format, mapnik::image_dtype dtype)
+{
+    if (format == nullptr)
+    {
+        format = "B";
+    }
+    // Only values in the native byte order are accepted.
+    switch (*format)
+    {
+    case '@':
+    case '=':
+        ++format;
+        break;
+    case '<':
+        if (!little_endian())
+        {
+            return false;
+        }
+        ++format;
+        break;
+    case '>':
+    case '!':
+        if (little_endian())
+        {
+            return false;
+        }
+        ++format;
+        break;
+    default:
+        break;
+    }
+    if (format[0] == '\0' || format[1] != '\0')
+    {
+        return false;
+    }
+
+    char const* kinds;
+    switch (dtype)
+    {
+    case mapnik::image_dtype_rgba8:
+    case mapnik::image_dtype_gray8:
+    case mapnik::image_dtype_gray16:
+    case mapnik::image_dtype_gray32:
+    case mapnik::image_dtype_gray64:
+        kinds = "BHILQN";
+        break;
+    case mapnik::image_dtype_gray8s:
+    case mapnik::image_dtype_gray16s:
+    case mapnik::image_dtype_gray32s:
+    case mapnik::image_dtype_gray64s:
+        kinds = "bhilqn";
+        break;
+    case mapnik::image_dtype_gray32f:
+    case mapnik::image_dtype_gray64f:
+        kinds = "fd";
+        break;
+    default:
+        return false;
+    }
+    return std::strchr(kinds, format[0]) != nullptr;
+}
+
+int get_image_buffer(PyObject * obj, Py_buffer * view, int flags,
+                     unsigned char * data, mapnik::image_dtype dtype,
+                     std::size_t width, std::size_t height,
+                     std::size_t row_stride, bool readonly)
+{
+    view->obj = nullptr;
+    char const* format = image_buffer_format(dtype);
+    if (format == nullptr)
+    {
+        PyErr_SetString(PyExc_BufferError, "Image has no pixels");
+        return -1;
+    }
+    if (readonly && (flags & PyBUF_WRITABLE) == PyBUF_WRITABLE)
+    {
+        PyErr_SetString(PyExc_BufferError, "Image is read-only");
+        return -1;
+    }
+
+    int const ndim = dtype == mapnik::image_dtype_rgba8 ? 3 : 2;
+    std::size_t const itemsize = image_buffer_itemsize(dtype);
+    std::size_t const pixel_size = ndim == 3 ? 4 * itemsize : itemsize;
+    bool const contiguous = height <= 1 || row_stride == width * pixel_size;
+    if (!contiguous &&
+        ((flags & PyBUF_STRIDES) != PyBUF_STRIDES ||
+         (flags & PyBUF_C_CONTIGUOUS) == PyBUF_C_CONTIGUOUS ||
+         (flags & PyBUF_ANY_CONTIGUOUS) == PyBUF_ANY_CONTIGUOUS))
+    {
+        PyErr_SetString(PyExc_BufferError, "Image view is not contiguous");
+        return -1;
+    }
+    if ((flags & PyBUF_F_CONTIGUOUS) == PyBUF_F_CONTIGUOUS)
+    {
+        PyErr_SetString(PyExc_BufferError, "Image is not Fortran contiguous");
+        return -1;
+    }
+
+    buffer_layout * layout = static_cast<buffer_layout*>(
+        PyMem_Malloc(sizeof(buffer_layout)));
+    if (layout == nullptr)
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+    layout->shape[0] = static_cast<Py_ssize_t>(height);
+    layout->shape[1] = static_cast<Py_ssize_t>(width);
+    layout->shape[2] = 4;
+    layout->strides[0] = static_cast<Py_ssize_t>(row_stride);
+    layout->strides[1] = static_cast<Py_ssize_t>(pixel_size);
+    layout->strides[2] = static_cast<Py_ssize_t>(itemsize);
+
+    view->buf = data != nullptr ? data : empty_buffer;
+    view->obj = obj;
+    Py_INCREF(obj);
+    view->len = static_cast<Py_ssize_t>(width * height * pixel_size);
+    view->readonly = readonly ? 1 : 0;
+    view->itemsize = static_cast<Py_ssize_t>(itemsize);
+    view->format = (flags & PyBUF_FORMAT) == PyBUF_FORMAT ? const_cast<char*>(format) : nullptr;
+    view->ndim = ndim;
+    view->shape = (flags & PyBUF_ND) == PyBUF_ND ? layout->shape : nullptr;
+    view->strides = (flags & PyBUF_STRIDES) == PyBUF_STRIDES ? layout->strides : nullptr;
+    view->suboffsets = nullptr;
+    view->internal = layout;
+    return 0;
+}
+
+void release_image_buffer(PyObject *, Py_buffer * view)
+{
+    PyMem_Free(view->internal);
+    view->internal = nullptr;
+}
+
+void set_buffer_procs(boost::python::object const& cls,
+                      PyBufferProcs * procs)
+{
+    PyTypeObject * type = reinterpret_cast<PyTypeObject*>(cls.ptr());
+    type->tp_as_buffer = procs;
+#if PY_MAJOR_VERSION < 3
+    type->tp_flags |= Py_TPFLAGS_HAVE_NEWBUFFER;
+#endif
+}
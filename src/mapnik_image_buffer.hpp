@@ -0,0 +1,72 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+#ifndef MAPNIK_IMAGE_BUFFER_HPP
+#define MAPNIK_IMAGE_BUFFER_HPP
+
+#include <boost/python.hpp>
+
+// mapnik
+#include <mapnik/image_any.hpp>
+#include <mapnik/image_view_any.hpp>
+
+// stl
+#include <cstddef>
+
+struct image_view_pixels
+{
+    // First pixel, nullptr for empty views.
+    unsigned char const* data = nullptr;
+    // Bytes of pixels in a row and between starts of rows.
+    std::size_t row_size = 0;
+    std::size_t row_stride = 0;
+    std::size_t height = 0;
+    bool premultiplied = false;
+};
+
+image_view_pixels get_view_pixels(mapnik::image_view_any const& view);
+
+// Struct module format of pixel values, nullptr for image_dtype_null.
+// Pixels of rgba8 images are four "B" values.
+char const* image_buffer_format(mapnik::image_dtype dtype);
+
+// Size of a single pixel value in bytes.
+std::size_t image_buffer_itemsize(mapnik::image_dtype dtype);
+
+// True if values of the struct module format, nullptr for unsigned
+// bytes, are of the kind of pixel values of dtype, ignoring their size.
+bool image_buffer_format_matches(char const* format, mapnik::image_dtype dtype);
+
+// Fills view with pixels of an image starting at data, rows are
+// row_stride bytes apart. The shape is (height, width) and
+// (height, width, 4) for rgba8 images.
+int get_image_buffer(PyObject * obj, Py_buffer * view, int flags,
+                     unsigned char * data, mapnik::image_dtype dtype,
+                     std::size_t width, std::size_t height,
+                     std::size_t row_stride, bool readonly);
+
+void release_image_buffer(PyObject * obj, Py_buffer * view);
+
+// Makes instances of the class exporters of the buffer protocol.
+void set_buffer_procs(boost::python::object const& cls,
+                      PyBufferProcs * procs);
+
+#endif // MAPNIK_IMAGE_BUFFER_HPP
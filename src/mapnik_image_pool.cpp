@@ -0,0 +1,263 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+
+#include <mapnik/config.hpp>
+#include "boost_std_shared_shim.hpp"
+
+#pragma GCC diagnostic push
+#include <mapnik/warning_ignore.hpp>
+#include <boost/python.hpp>
+#include <boost/noncopyable.hpp>
+#pragma GCC diagnostic pop
+
+// mapnik
+#include <mapnik/image_util.hpp>
+#include <mapnik/value_error.hpp>
+
+// stl
+#include <algorithm>
+
+#include "mapnik_image_pool.hpp"
+#include "mapnik_threads.hpp"
+
+using mapnik::image_any;
+using mapnik::python_unblock_auto_block;
+
+namespace {
+
+struct reset_image_visitor
+{
+    bool premultiplied;
+
+    void operator()(mapnik::image_null &) const {}
+
+    template <typename T>
+    void operator()(T & image) const
+    {
+        image.set_premultiplied(premultiplied);
+        image.painted(false);
+        image.set_offset(0.0);
+        image.set_scaling(1.0);
+    }
+};
+
+}
+
+image_pool::image_pool(std::size_t max_size)
+    : max_size_(max_size) {}
+
+std::shared_ptr<image_any> image_pool::acquire(int width, int height,
+                                               mapnik::image_dtype dtype,
+                                               bool premultiplied)
+{
+    std::shared_ptr<image_any> image;
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        // The most recently released image is likely still in caches.
+        for (auto it = images_.rbegin(); it != images_.rend(); ++it)
+        {
+            if (it->use_count() == 1 &&
+                static_cast<int>((*it)->width()) == width &&
+                static_cast<int>((*it)->height()) == height &&
+                (*it)->get_dtype() == dtype)
+            {
+                image = *it;
+                ++hits_;
+                break;
+            }
+        }
+    }
+
+    if (image)
+    {
+        mapnik::fill(*image, 0);
+        mapnik::util::apply_visitor(reset_image_visitor{premultiplied}, *image);
+        return image;
+    }
+
+    image = std::make_shared<image_any>(width, height, dtype, true, premultiplied);
+    std::lock_guard<std::mutex> lock(mutex_);
+    ++misses_;
+    images_.push_back(image);
+    trim();
+    peak_size_ = std::max(peak_size_, images_.size());
+    return image;
+}
+
+bool image_pool::release(image_any const* image)
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    auto it = std::find_if(images_.begin(), images_.end(),
+        [image](std::shared_ptr<image_any> const& pooled) { return pooled.get() == image; });
+    if (it == images_.end())
+    {
+        return false;
+    }
+    // Move to the back, released images are dropped last by trim().
+    std::rotate(it, it + 1, images_.end());
+    trim();
+    return true;
+}
+
+void image_pool::clear()
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    images_.erase(std::remove_if(images_.begin(), images_.end(),
+        [](std::shared_ptr<image_any> const& image) { return image.use_count() == 1; }),
+        images_.end());
+}
+
+void image_pool::trim()
+{
+    std::size_t idle = 0;
+    for (auto const& image : images_)
+    {
+        idle += image.use_count() == 1;
+    }
+    for (auto it = images_.begin(); idle > max_size_ && it != images_.end();)
+    {
+        if (it->use_count() == 1)
+        {
+            it = images_.erase(it);
+            --idle;
+        }
+        else
+        {
+            ++it;
+        }
+    }
+}
+
+std::size_t image_pool::max_size() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return max_size_;
+}
+
+void image_pool::set_max_size(std::size_t max_size)
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    max_size_ = max_size;
+    trim();
+}
+
+std::size_t image_pool::size() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return images_.size();
+}
+
+std::size_t image_pool::idle() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return static_cast<std::size_t>(std::count_if(images_.begin(), images_.end(),
+        [](std::shared_ptr<image_any> const& image) { return image.use_count() == 1; }));
+}
+
+std::size_t image_pool::hits() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return hits_;
+}
+
+std::size_t image_pool::misses() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return misses_;
+}
+
+std::size_t image_pool::peak_size() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return peak_size_;
+}
+
+namespace {
+
+std::shared_ptr<image_any> acquire_image(image_pool & pool, int width, int height,
+                                         mapnik::image_dtype dtype, bool premultiplied)
+{
+    if (width <= 0 || height <= 0)
+    {
+        throw mapnik::value_error("width and height must be greater than zero");
+    }
+    python_unblock_auto_block b;
+    return pool.acquire(width, height, dtype, premultiplied);
+}
+
+void release_image(image_pool & pool, image_any const& image)
+{
+    if (!pool.release(&image))
+    {
+        throw mapnik::value_error("Image was not acquired from this ImagePool");
+    }
+}
+
+}
+
+void export_image_pool()
+{
+    using namespace boost::python;
+
+    class_<image_pool, std::shared_ptr<image_pool>, boost::noncopyable>(
+        "ImagePool",
+        "Thread-safe pool of images reused across renders.\n"
+        "\n"
+        "acquire() returns a cleared image, reusing an idle pooled image of\n"
+        "the same size and type if possible. Pooled images are idle once they\n"
+        "are no longer referenced, also by arrays of their pixels. Released\n"
+        "images are reused first. At most max_size idle images are kept.\n"
+        "The pool can be passed to\n"
+        "render_to_file, render_tile_to_file, render_tiles and render_metatile.\n"
+        "\n"
+        "Usage:\n"
+        ">>> pool = mapnik.ImagePool(8)\n"
+        ">>> im = pool.acquire(256, 256)\n"
+        ">>> mapnik.render(m, im)\n"
+        ">>> pool.release(im)\n"
+        ">>> del im\n",
+        init<std::size_t>((arg("max_size") = 16)))
+        .def("acquire", &acquire_image,
+             (arg("width"),
+              arg("height"),
+              arg("dtype") = mapnik::image_dtype_rgba8,
+              arg("premultiplied") = false),
+             "Returns a cleared image of the given size and type.\n")
+        .def("release", &release_image,
+             (arg("image")),
+             "Returns the image to the pool, it must not be used afterwards.\n")
+        .def("clear", &image_pool::clear,
+             "Drops all idle images.\n")
+        .add_property("max_size", &image_pool::max_size, &image_pool::set_max_size,
+                      "Maximum number of idle images kept by the pool.\n")
+        .add_property("size", &image_pool::size,
+                      "Number of pooled images, in use and idle.\n")
+        .add_property("idle", &image_pool::idle,
+                      "Number of idle images.\n")
+        .add_property("hits", &image_pool::hits,
+                      "Number of acquired images reused from the pool.\n")
+        .add_property("misses", &image_pool::misses,
+                      "Number of acquired images allocated by the pool.\n")
+        .add_property("peak_size", &image_pool::peak_size,
+                      "Largest number of images pooled at once.\n")
+        ;
+}
@@ -0,0 +1,76 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+#ifndef MAPNIK_IMAGE_POOL_HPP
+#define MAPNIK_IMAGE_POOL_HPP
+
+// mapnik
+#include <mapnik/image_any.hpp>
+
+// stl
+#include <cstddef>
+#include <memory>
+#include <mutex>
+#include <vector>
+
+// Pool of images reused across renders. All methods are thread-safe and
+// do not touch Python objects, so they can be called without the GIL.
+// The pool keeps a reference to every image it created. An image is
+// idle and can be handed out again once the pool holds the only
+// reference, that is after it was released and dropped by its user.
+class image_pool
+{
+public:
+    explicit image_pool(std::size_t max_size);
+
+    // Returns a cleared image, an idle one of the same size and type
+    // if there is any.
+    std::shared_ptr<mapnik::image_any> acquire(int width, int height,
+        mapnik::image_dtype dtype = mapnik::image_dtype_rgba8,
+        bool premultiplied = false);
+
+    // Returns false if the image was not created by the pool.
+    bool release(mapnik::image_any const* image);
+
+    void clear();
+
+    std::size_t max_size() const;
+    void set_max_size(std::size_t max_size);
+    std::size_t size() const;
+    std::size_t idle() const;
+    std::size_t hits() const;
+    std::size_t misses() const;
+    std::size_t peak_size() const;
+
+private:
+    // Drops idle images while more than max_size of them are pooled.
+    void trim();
+
+    mutable std::mutex mutex_;
+    // Images by the time of their release, most recent last.
+    std::vector<std::shared_ptr<mapnik::image_any>> images_;
+    std::size_t max_size_;
+    std::size_t hits_ = 0;
+    std::size_t misses_ = 0;
+    std::size_t peak_size_ = 0;
+};
+
+#endif // MAPNIK_IMAGE_POOL_HPP
@@ -38,8 +38,13 @@
 #include <mapnik/palette.hpp>
 #include <sstream>
 
+#include "mapnik_image_buffer.hpp"
+#include "mapnik_threads.hpp"
+#include "parallel_encoding.hpp"
+
 using mapnik::image_view_any;
 using mapnik::save_to_file;
+using mapnik::python_unblock_auto_block;
 
 // output 'raw' pixels
 PyObject* view_tostring1(image_view_any const& view)
@@ -52,13 +57,42 @@ PyObject* view_tostring1(image_view_any const& view)
 // encode (png,jpeg)
 PyObject* view_tostring2(image_view_any const & view, std::string const& format)
 {
-    std::string s = save_to_string(view, format);
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = save_to_string(view, format);
+    }
     return ::PyBytes_FromStringAndSize(s.data(),s.size());
 }
 
 PyObject* view_tostring3(image_view_any const & view, std::string const& format, mapnik::rgba_palette const& pal)
 {
-    std::string s = save_to_string(view, format, pal);
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = save_to_string(view, format, *copy_palette(pal));
+    }
+    return ::PyBytes_FromStringAndSize(s.data(),s.size());
+}
+
+PyObject* view_tostring4(image_view_any const & view, std::string const& format, encoded_image_cache & cache)
+{
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = encode_cached(view, format, nullptr, cache);
+    }
+    return ::PyBytes_FromStringAndSize(s.data(),s.size());
+}
+
+PyObject* view_tostring5(image_view_any const & view, std::string const& format, mapnik::rgba_palette const& pal,
+                         encoded_image_cache & cache)
+{
+    std::string s;
+    {
+        python_unblock_auto_block b;
+        s = encode_cached(view, format, &pal, cache);
+    }
     return ::PyBytes_FromStringAndSize(s.data(),s.size());
 }
 
@@ -70,6 +104,7 @@ bool is_solid(image_view_any const& view)
 void save_view1(image_view_any const& view,
                 std::string const& filename)
 {
+    python_unblock_auto_block b;
     save_to_file(view,filename);
 }
 
@@ -77,6 +112,7 @@ void save_view2(image_view_any const& view,
                 std::string const& filename,
                 std::string const& type)
 {
+    python_unblock_auto_block b;
     save_to_file(view,filename,type);
 }
 
@@ -85,9 +121,27 @@ void save_view3(image_view_any const& view,
                 std::string const& type,
                 mapnik::rgba_palette const& pal)
 {
-    save_to_file(view,filename,type,pal);
+    python_unblock_auto_block b;
+    save_to_file(view,filename,type,*copy_palette(pal));
 }
 
+// Views of images are exported read-only, rows are strided by
+// the width of the image.
+int view_getbuffer(PyObject * obj, Py_buffer * view, int flags)
+{
+    boost::python::extract<image_view_any const&> v(obj);
+    if (!v.check())
+    {
+        view->obj = nullptr;
+        PyErr_SetString(PyExc_BufferError, "Expected a mapnik.ImageView");
+        return -1;
+    }
+    image_view_any const& data = v();
+    image_view_pixels pixels = get_view_pixels(data);
+    return get_image_buffer(obj, view, flags, const_cast<unsigned char*>(pixels.data),
+                            data.get_dtype(), data.width(), data.height(),
+                            pixels.row_stride, true);
+}
 
 void export_image_view()
 {
@@ -99,8 +153,15 @@ void export_image_view()
         .def("tostring",&view_tostring1)
         .def("tostring",&view_tostring2)
         .def("tostring",&view_tostring3)
+        .def("tostring",&view_tostring4)
+        .def("tostring",&view_tostring5)
         .def("save",&save_view1)
         .def("save",&save_view2)
         .def("save",&save_view3)
         ;
+
+    static PyBufferProcs view_buffer_procs;
+    view_buffer_procs.bf_getbuffer = &view_getbuffer;
+    view_buffer_procs.bf_releasebuffer = &release_image_buffer;
+    set_buffer_procs(scope().attr("ImageView"), &view_buffer_procs);
 }
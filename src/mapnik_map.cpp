@@ -117,6 +117,13 @@ void set_maximum_extent(mapnik::Map & m, boost::optional<mapnik::box2d<double> >
     }
 }
 
+// Styles, fontsets and layers are copied, datasources, expressions
+// and cached markers are shared with the original map.
+Map copy_map(Map const& m)
+{
+    return Map(m);
+}
+
 struct extract_style
 {
     using result_type = boost::python::tuple;
@@ -320,6 +327,14 @@ void export_map()
              ">>> [<mapnik.Feature object at 0x3995630>]\n"
             )
 
+        .def("__copy__",copy_map,
+             "Return a copy of the Map sharing its datasources.\n"
+             "\n"
+             "Usage:\n"
+             ">>> import copy\n"
+             ">>> m2 = copy.copy(m)\n"
+            )
+
         .def("remove_all",&Map::remove_all,
              "Remove all Mapnik Styles and layers from the Map.\n"
              "\n"
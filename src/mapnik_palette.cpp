@@ -37,6 +37,8 @@
 // stl
 #include <stdexcept>
 
+#include "parallel_encoding.hpp"
+
 static std::shared_ptr<mapnik::rgba_palette> make_palette( std::string const& palette, std::string const& format )
 {
     mapnik::rgba_palette::palette_type type = mapnik::rgba_palette::PALETTE_RGBA;
@@ -46,7 +48,7 @@ static std::shared_ptr<mapnik::rgba_palette> make_palette( std::string const& pa
         type = mapnik::rgba_palette::PALETTE_ACT;
     else
         throw std::runtime_error("invalid type passed for mapnik.Palette: must be either rgba, rgb, or act");
-    return std::make_shared<mapnik::rgba_palette>(palette, type);
+    return std::make_shared<python_palette>(palette, type);
 }
 
 void export_palette ()
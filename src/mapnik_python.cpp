@@ -38,12 +38,22 @@
 #include <boost/python/module.hpp>      // for BOOST_PYTHON_MODULE
 #include <boost/python/object_core.hpp>  // for get_managed_object
 #include <boost/python/register_ptr_to_python.hpp>
+#include <boost/python/stl_iterator.hpp>
 #include <boost/python/to_python_converter.hpp>
+#include <boost/python/tuple.hpp>
 #pragma GCC diagnostic pop
 
 // stl
 #include <stdexcept>
 #include <fstream>
+#include <exception>
+#include <climits>
+#include <cstdlib>
+#include <limits>
+#include <list>
+#include <map>
+#include <mutex>
+#include <sstream>
 
 void export_color();
 void export_coord();
@@ -55,6 +65,7 @@ void export_geometry();
 void export_palette();
 void export_image();
 void export_image_view();
+void export_image_pool();
 void export_gamma_method();
 void export_scaling_method();
 void export_map();
@@ -105,9 +116,15 @@ void export_connection_manager();
 #include <mapnik/save_map.hpp>
 #include <mapnik/scale_denominator.hpp>
 #include <mapnik/collision_cache.hpp>
+#include <mapnik/util/parallelize.hpp>
+#include <mapbox/mapnik-vector-tile/vector_tile_projection.hpp>
+#include "mapnik_image_pool.hpp"
 #include "mapnik_value_converter.hpp"
 #include "mapnik_threads.hpp"
 #include "python_optional.hpp"
+#include "parallel_encoding.hpp"
+#include "deferred_datasources.hpp"
+#include "file_stamp.hpp"
 #include <mapnik/marker_cache.hpp>
 #if defined(SHAPE_MEMORY_MAPPED_FILE)
 #include <mapnik/mapped_memory_cache.hpp>
@@ -125,8 +142,97 @@ namespace mapnik {
     class layer;
     class color;
 }
+// Maps parsed by load_map(cache=True), the least recently used maps
+// are dropped beyond max_size.
+class load_map_cache
+{
+public:
+    static load_map_cache & instance()
+    {
+        static load_map_cache cache;
+        return cache;
+    }
+
+    std::shared_ptr<mapnik::Map const> find(std::string const& key)
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto it = maps_.find(key);
+        if (it == maps_.end())
+        {
+            return nullptr;
+        }
+        lru_.splice(lru_.end(), lru_, it->second.second);
+        return it->second.first;
+    }
+
+    void insert(std::string const& key, std::shared_ptr<mapnik::Map const> const& map)
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto it = maps_.find(key);
+        if (it != maps_.end())
+        {
+            it->second.first = map;
+            lru_.splice(lru_.end(), lru_, it->second.second);
+            return;
+        }
+        it = maps_.emplace(key, std::make_pair(map, lru_.end())).first;
+        lru_.push_back(&it->first);
+        it->second.second = std::prev(lru_.end());
+        evict();
+    }
+
+    void clear()
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        maps_.clear();
+        lru_.clear();
+    }
+
+    std::size_t max_size()
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        return max_size_;
+    }
+
+    void set_max_size(std::size_t max_size)
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        max_size_ = max_size;
+        evict();
+    }
+
+private:
+    void evict()
+    {
+        while (maps_.size() > max_size_)
+        {
+            auto it = maps_.find(*lru_.front());
+            lru_.pop_front();
+            maps_.erase(it);
+        }
+    }
+
+    // Keys can hold whole map XMLs, the LRU list points to keys of maps_.
+    std::mutex mutex_;
+    std::list<std::string const*> lru_;
+    std::map<std::string, std::pair<std::shared_ptr<mapnik::Map const>,
+                                    std::list<std::string const*>::iterator>> maps_;
+    std::size_t max_size_ = 32;
+};
+
+std::size_t load_map_cache_size()
+{
+    return load_map_cache::instance().max_size();
+}
+
+void set_load_map_cache_size(std::size_t max_size)
+{
+    load_map_cache::instance().set_max_size(max_size);
+}
+
 void clear_cache()
 {
+    load_map_cache::instance().clear();
     mapnik::marker_cache::instance().clear();
 #if defined(SHAPE_MEMORY_MAPPED_FILE)
     mapnik::mapped_memory_cache::instance().clear();
@@ -561,6 +667,22 @@ void render_tile_to_file(mapnik::Map const& map,
     mapnik::save_to_file(image,file,format);
 }
 
+void render_tile_to_file_pool(mapnik::Map const& map,
+                              unsigned offset_x, unsigned offset_y,
+                              unsigned width, unsigned height,
+                              std::string const& file,
+                              std::string const& format,
+                              image_pool & pool)
+{
+    std::shared_ptr<mapnik::image_any> image;
+    {
+        python_unblock_auto_block b;
+        image = pool.acquire(width, height);
+    }
+    render(map,*image,1.0,offset_x, offset_y);
+    mapnik::save_to_file(*image,file,format);
+}
+
 void render_to_file1(mapnik::Map const& map,
                      std::string const& filename,
                      std::string const& format)
@@ -654,6 +776,300 @@ void render_to_file3(mapnik::Map const& map,
     }
 }
 
+void render_to_file_pool(mapnik::Map const& map,
+                         std::string const& filename,
+                         std::string const& format,
+                         image_pool & pool,
+                         double scale_factor)
+{
+    if (format == "svg-ng" || format == "pdf" || format == "svg" || format =="ps" || format == "ARGB32" || format == "RGB24")
+    {
+        // Vector formats are not rendered into images.
+        render_to_file3(map, filename, format, scale_factor);
+        return;
+    }
+    std::shared_ptr<mapnik::image_any> image;
+    {
+        python_unblock_auto_block b;
+        image = pool.acquire(map.width(), map.height());
+    }
+    render(map,*image,scale_factor,0,0);
+    mapnik::save_to_file(*image,filename,format);
+}
+
+struct render_tile_chunk
+{
+    std::uint64_t x;
+    std::uint64_t y;
+    std::uint64_t z;
+    unsigned width;
+    unsigned height;
+    std::string encoded_img;
+    std::exception_ptr error;
+};
+
+struct render_tiles_func
+{
+    mapnik::Map const& map;
+    std::vector<render_tile_chunk> & chunks;
+    std::string const& format;
+    double scale_factor;
+    image_pool * pool;
+
+    void operator()(unsigned begin, unsigned end)
+    {
+        // Every job renders with its own copy of the map,
+        // resize() and zoom_to_box() are not thread safe.
+        mapnik::Map job_map(map);
+        for (unsigned i = begin; i < end; ++i)
+        {
+            render_tile_chunk & chunk = chunks[i];
+            try
+            {
+                job_map.resize(chunk.width, chunk.height);
+                job_map.zoom_to_box(mapnik::vector_tile_impl::merc_extent(
+                    chunk.x, chunk.y, chunk.z));
+                std::shared_ptr<mapnik::image_any> image = pool
+                    ? pool->acquire(chunk.width, chunk.height)
+                    : std::make_shared<mapnik::image_any>(chunk.width, chunk.height);
+                mapnik::util::apply_visitor(agg_renderer_visitor_1(
+                    job_map, scale_factor, 0, 0), *image);
+                chunk.encoded_img = mapnik::save_to_string(*image, format);
+            }
+            catch (...)
+            {
+                chunk.error = std::current_exception();
+            }
+        }
+    }
+};
+
+boost::python::dict render_tiles(mapnik::Map const& map,
+                                 boost::python::object const& tiles,
+                                 std::string const& format,
+                                 unsigned threads,
+                                 double scale_factor,
+                                 image_pool * pool)
+{
+    using namespace boost::python;
+
+    std::vector<render_tile_chunk> chunks;
+
+    stl_input_iterator<object> it(tiles), end;
+    for (; it != end; ++it)
+    {
+        if (len(*it) != 5)
+        {
+            throw mapnik::value_error("render_tiles expects (x, y, z, width, height) tuples");
+        }
+        chunks.emplace_back(render_tile_chunk{
+            extract<std::uint64_t>((*it)[0]),
+            extract<std::uint64_t>((*it)[1]),
+            extract<std::uint64_t>((*it)[2]),
+            extract<unsigned>((*it)[3]),
+            extract<unsigned>((*it)[4]),
+            std::string(),
+            std::exception_ptr() });
+    }
+
+    {
+        python_unblock_auto_block b;
+        unsigned jobs = jobs_by_chunks(chunks.size(), threads);
+        render_tiles_func render_func{map, chunks, format, scale_factor, pool};
+        mapnik::util::parallelize(render_func, jobs, chunks.size());
+    }
+
+    dict result;
+    for (auto const & chunk : chunks)
+    {
+        if (chunk.error)
+        {
+            std::rethrow_exception(chunk.error);
+        }
+        result[make_tuple(chunk.x, chunk.y, chunk.z)] = object(
+            handle<>(PyBytes_FromStringAndSize(
+                chunk.encoded_img.data(),
+                chunk.encoded_img.size())));
+    }
+    return result;
+}
+
+// Tiles are at most 2**32 per side, which keeps their extents precise.
+constexpr std::uint64_t max_metatile_zoom = 32;
+
+boost::python::dict render_metatile(mapnik::Map const& map,
+                                    std::uint64_t x,
+                                    std::uint64_t y,
+                                    std::uint64_t z,
+                                    unsigned metatile_size,
+                                    unsigned tile_size,
+                                    std::string const& format,
+                                    double scale_factor,
+                                    unsigned max_concurrency,
+                                    image_pool * pool)
+{
+    using namespace boost::python;
+
+    if (metatile_size == 0 || tile_size == 0)
+    {
+        throw mapnik::value_error("metatile_size and tile_size must be greater than zero");
+    }
+    if (z > max_metatile_zoom)
+    {
+        throw mapnik::value_error("z must be at most " + std::to_string(max_metatile_zoom));
+    }
+    std::uint64_t tiles_per_side = std::uint64_t(1) << z;
+    if (x >= tiles_per_side || y >= tiles_per_side)
+    {
+        throw mapnik::value_error("x and y must be lower than 2**z");
+    }
+
+    // Align to the metatile grid and clip it on low zoom levels.
+    std::uint64_t size = std::min<std::uint64_t>(metatile_size, tiles_per_side);
+    // Images have int dimensions, size and tile_size are at most 2**32.
+    if (size * tile_size > static_cast<std::uint64_t>(std::numeric_limits<int>::max()))
+    {
+        throw mapnik::value_error("The metatile is too large");
+    }
+    std::uint64_t meta_x = x - x % size;
+    std::uint64_t meta_y = y - y % size;
+
+    std::vector<std::string> encoded;
+    {
+        python_unblock_auto_block b;
+
+        mapnik::box2d<double> extent(
+            mapnik::vector_tile_impl::merc_extent(meta_x, meta_y, z));
+        extent.expand_to_include(
+            mapnik::vector_tile_impl::merc_extent(
+                meta_x + size - 1, meta_y + size - 1, z));
+
+        mapnik::Map meta_map(map);
+        meta_map.resize(size * tile_size, size * tile_size);
+        meta_map.zoom_to_box(extent);
+
+        std::shared_ptr<mapnik::image_any> image_ptr = pool
+            ? pool->acquire(meta_map.width(), meta_map.height())
+            : std::make_shared<mapnik::image_any>(meta_map.width(), meta_map.height());
+        mapnik::image_any & image = *image_ptr;
+        mapnik::util::apply_visitor(agg_renderer_visitor_1(
+            meta_map, scale_factor, 0, 0), image);
+
+        std::vector<mapnik::image_view_any> views;
+        views.reserve(size * size);
+        for (std::uint64_t ty = 0; ty < size; ++ty)
+        {
+            for (std::uint64_t tx = 0; tx < size; ++tx)
+            {
+                views.emplace_back(mapnik::create_view(image,
+                    tx * tile_size, ty * tile_size, tile_size, tile_size));
+            }
+        }
+
+        std::vector<encoding_chunk> chunks;
+        chunks.reserve(views.size());
+        for (auto const & view : views)
+        {
+            chunks.emplace_back(encoding_chunk{ view, format, nullptr });
+        }
+
+        encode_chunks(chunks, max_concurrency);
+
+        for (auto & chunk : chunks)
+        {
+            encoded.emplace_back(std::move(chunk.encoded_img));
+        }
+    }
+
+    dict result;
+    for (std::uint64_t i = 0; i < encoded.size(); ++i)
+    {
+        result[make_tuple(meta_x + i % size, meta_y + i / size)] = object(
+            handle<>(PyBytes_FromStringAndSize(
+                encoded[i].data(), encoded[i].size())));
+        std::string().swap(encoded[i]);
+    }
+    return result;
+}
+
+template <typename Loader>
+void load_map_with_cache(mapnik::Map & map, std::string const& key, Loader load)
+{
+    std::shared_ptr<mapnik::Map const> cached = load_map_cache::instance().find(key);
+    if (!cached)
+    {
+        auto parsed = std::make_shared<mapnik::Map>(map.width(), map.height());
+        load(*parsed);
+        load_map_cache::instance().insert(key, parsed);
+        cached = parsed;
+    }
+    mapnik::Map loaded(*cached);
+    loaded.resize(map.width(), map.height());
+    map = loaded;
+}
+
+// Relative paths are resolved against base_path, or against the
+// working directory if it is empty.
+std::string canonical_base_path(std::string const& base_path)
+{
+    char resolved[PATH_MAX];
+    return ::realpath(base_path.empty() ? "." : base_path.c_str(), resolved)
+        ? std::string(resolved) : base_path;
+}
+
+void load_map_file(mapnik::Map & map,
+                   std::string const& filename,
+                   bool strict,
+                   std::string const& base_path,
+                   std::launch datasource_init,
+                   bool cache)
+{
+    load_deferred_datasources_for_file(filename);
+    file_stamp stamp;
+    if (!cache || !get_file_stamp(filename, stamp))
+    {
+        mapnik::load_map(map, filename, strict, base_path, datasource_init);
+        return;
+    }
+    // Modified or replaced files get a new key. Without base_path, paths
+    // are relative to the file.
+    std::ostringstream key;
+    key << "file:" << stamp.path
+        << ':' << stamp.mtime_ns
+        << ':' << stamp.size
+        << ':' << strict
+        << ':' << static_cast<int>(datasource_init)
+        << ':' << (base_path.empty() ? std::string() : canonical_base_path(base_path));
+    load_map_with_cache(map, key.str(), [&](mapnik::Map & m) {
+        mapnik::load_map(m, filename, strict, base_path, datasource_init);
+    });
+}
+
+void load_map_from_string(mapnik::Map & map,
+                          std::string const& str,
+                          bool strict,
+                          std::string const& base_path,
+                          std::launch datasource_init,
+                          bool cache)
+{
+    load_deferred_datasources_for_xml(str);
+    if (!cache)
+    {
+        mapnik::load_map_string(map, str, strict, base_path, datasource_init);
+        return;
+    }
+    // The key holds the whole content, so that different strings never
+    // share a map.
+    std::ostringstream key;
+    key << "string:" << strict
+        << ':' << static_cast<int>(datasource_init)
+        << ':' << canonical_base_path(base_path)
+        << '\0' << str;
+    load_map_with_cache(map, key.str(), [&](mapnik::Map & m) {
+        mapnik::load_map_string(m, str, strict, base_path, datasource_init);
+    });
+}
+
 double scale_denominator(mapnik::Map const& map, bool geographic)
 {
     return mapnik::scale_denominator(map.scale(), geographic);
@@ -788,8 +1204,6 @@ BOOST_PYTHON_MODULE(_mapnik)
 
     using namespace boost::python;
 
-    using mapnik::load_map;
-    using mapnik::load_map_string;
     using mapnik::save_map;
     using mapnik::save_map_to_string;
 
@@ -812,6 +1226,7 @@ BOOST_PYTHON_MODULE(_mapnik)
     export_palette();
     export_image();
     export_image_view();
+    export_image_pool();
     export_gamma_method();
     export_scaling_method();
     export_expression();
@@ -851,13 +1266,22 @@ BOOST_PYTHON_MODULE(_mapnik)
 
     def("clear_cache", &clear_cache,
         "\n"
-        "Clear all global caches of markers and mapped memory regions.\n"
+        "Clear all global caches of markers, mapped memory regions\n"
+        "and maps loaded with cache=True.\n"
         "\n"
         "Usage:\n"
         ">>> from mapnik import clear_cache\n"
         ">>> clear_cache()\n"
         );
 
+    def("load_map_cache_size", &load_map_cache_size,
+        "Return the number of maps kept by load_map(cache=True).\n");
+
+    def("set_load_map_cache_size", &set_load_map_cache_size,
+        (arg("max_size")),
+        "Set the number of maps kept by load_map(cache=True), the least\n"
+        "recently used maps are dropped.\n");
+
     def("render_to_file",&render_to_file1,
         "\n"
         "Render Map to file using explicit image type.\n"
@@ -900,12 +1324,87 @@ BOOST_PYTHON_MODULE(_mapnik)
         "\n"
         );
 
+    def("render_to_file",&render_to_file_pool,
+        (arg("map"),
+         arg("filename"),
+         arg("format"),
+         arg("pool"),
+         arg("scale_factor")=1.0),
+        "\n"
+        "Render Map to file using an image from the ImagePool.\n"
+        "\n"
+        "Usage:\n"
+        ">>> from mapnik import Map, ImagePool, render_to_file, load_map\n"
+        ">>> pool = ImagePool()\n"
+        ">>> render_to_file(m,'image.png','png',pool)\n"
+        "\n"
+        );
+
     def("render_tile_to_file",&render_tile_to_file,
         "\n"
         "TODO\n"
         "\n"
         );
 
+    def("render_tile_to_file",&render_tile_to_file_pool,
+        "\n"
+        "Render a part of the Map to file using an image from the ImagePool.\n"
+        "\n"
+        );
+
+    def("render_tiles", &render_tiles,
+        (arg("map"),
+         arg("tiles"),
+         arg("format") = std::string("png"),
+         // Number of rendering threads, 0 means half of the CPU cores.
+         arg("threads") = 0u,
+         arg("scale_factor") = 1.0,
+         // ImagePool providing images of tiles
+         arg("pool") = boost::python::object()
+        ),
+        "\n"
+        "Render and encode Mercator tiles in parallel without the GIL.\n"
+        "Returns a dict of encoded images keyed by (x, y, z).\n"
+        "\n"
+        "Usage:\n"
+        ">>> from mapnik import Map, render_tiles, load_map\n"
+        ">>> m = Map(256,256)\n"
+        ">>> load_map(m,'mapfile.xml')\n"
+        ">>> tiles = render_tiles(m, [(0, 0, 1, 256, 256), (1, 0, 1, 256, 256)], 'png8', 4)\n"
+        ">>> tiles[(0, 0, 1)]\n"
+        "\n"
+        );
+
+    def("render_metatile", &render_metatile,
+        (arg("map"),
+         arg("x"),
+         arg("y"),
+         arg("z"),
+         arg("metatile_size") = 8u,
+         arg("tile_size") = 256u,
+         arg("format") = std::string("png"),
+         arg("scale_factor") = 1.0,
+         // Number of encoding threads, 0 means half of the CPU cores.
+         arg("max_concurrency") = 0u,
+         // ImagePool providing the image of the metatile
+         arg("pool") = boost::python::object()
+        ),
+        "\n"
+        "Render a Mercator metatile once and encode its tiles in parallel,\n"
+        "all without the GIL. The metatile is aligned to metatile_size.\n"
+        "Returns a dict of encoded images keyed by (x, y). Raises ValueError\n"
+        "for z above 32, x or y outside of the zoom level and metatiles\n"
+        "too large for an image.\n"
+        "\n"
+        "Usage:\n"
+        ">>> from mapnik import Map, render_metatile, load_map\n"
+        ">>> m = Map(256,256)\n"
+        ">>> load_map(m,'mapfile.xml')\n"
+        ">>> tiles = render_metatile(m, 2256, 1392, 12, 8, 256, 'png8')\n"
+        ">>> tiles[(2257, 1393)]\n"
+        "\n"
+        );
+
     def("render_with_vars",&render_with_vars,
         (arg("map"),
          arg("image"),
@@ -1136,19 +1635,47 @@ BOOST_PYTHON_MODULE(_mapnik)
         "\n"
         );
 
-    def("load_map", &load_map,
+    def("load_map", &load_map_file,
         (arg("map"),
          arg("filename"),
          arg("strict") = false,
          arg("base_path") = std::string(),
-         arg("datasource_init") = std::launch::deferred));
+         arg("datasource_init") = std::launch::deferred,
+         // Reuse a map parsed before from the same unchanged file.
+         arg("cache") = false),
+        "\n"
+        "Load a Map from XML file.\n"
+        "\n"
+        "With cache=True the parsed map is kept in memory keyed by\n"
+        "the canonical file path, modification time and size, and\n"
+        "repeated loads only copy it. The content of the map is then\n"
+        "replaced, only its size is kept. Up to load_map_cache_size()\n"
+        "maps are kept, the cache is emptied by clear_cache().\n"
+        "\n"
+        "Usage:\n"
+        ">>> from mapnik import Map, load_map\n"
+        ">>> m = Map(256,256)\n"
+        ">>> load_map(m,'mapfile.xml',cache=True)\n"
+        "\n"
+        );
 
-    def("load_map_from_string", &load_map_string,
+    def("load_map_from_string", &load_map_from_string,
         (arg("map"),
          arg("str"),
          arg("strict") = false,
          arg("base_path") = std::string(),
-         arg("datasource_init") = std::launch::deferred));
+         arg("datasource_init") = std::launch::deferred,
+         // Reuse a map parsed before from the same string.
+         arg("cache") = false),
+        "\n"
+        "Load a Map from XML string.\n"
+        "\n"
+        "With cache=True the parsed map is kept in memory keyed by\n"
+        "the whole content, and repeated loads only copy it. The\n"
+        "content of the map is then replaced, only its size is kept.\n"
+        "The cache is emptied by clear_cache().\n"
+        "\n"
+        );
 
     def("save_map", &save_map, save_map_overloads());
 /*
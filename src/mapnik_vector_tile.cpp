@@ -21,6 +21,9 @@
  *****************************************************************************/
 
 #include <mapnik/config.hpp>
+#include <mapnik/layer.hpp>
+#include <mapnik/map.hpp>
+#include <mapnik/value_error.hpp>
 
 #include <mapbox/mapnik-vector-tile/vector_tile_processor.hpp>
 #include <mapbox/mapnik-vector-tile/vector_tile_compression.hpp>
@@ -30,8 +33,28 @@
 #include <mapbox/mapnik-vector-tile/vector_tile_wafer.hpp>
 #include <mapbox/mapnik-vector-tile/vector_tile_merc_tile.hpp>
 
+#include "boost_std_shared_shim.hpp"
 #define BOOST_PYTHON_MAX_ARITY 20
 #include <boost/python.hpp>
+#include <boost/python/stl_iterator.hpp>
+#include <boost/noncopyable.hpp>
+
+#include <mapnik/util/parallelize.hpp>
+
+#include <deque>
+#include <exception>
+#include <functional>
+#include <iterator>
+#include <memory>
+#include <stdexcept>
+
+#include <zlib.h>
+
+#include "mapnik_threads.hpp"
+#include "mapnik_vector_tile_buffers.hpp"
+#include "parallel_encoding.hpp"
+
+using mapnik::python_unblock_auto_block;
 
 boost::python::object create_mvt_merc(
     mapnik::Map const& map,
@@ -53,27 +76,33 @@ boost::python::object create_mvt_merc(
     mapnik::scaling_method_e scaling_method,
     std::launch threading_mode)
 {
-    mapnik::vector_tile_impl::processor proc(map);
+    // The GIL is held again only for creating the resulting bytes object.
+    mapnik::vector_tile_impl::merc_tile tile = [&]()
+    {
+        python_unblock_auto_block b;
 
-    proc.set_area_threshold(area_threshold);
-    proc.set_simplify_distance(simplify_distance);
-    proc.set_multi_polygon_union(multi_polygon_union);
-    proc.set_process_all_rings(process_all_rings);
-    proc.set_fill_type(fill_type);
-    proc.set_image_format(image_format);
-    proc.set_scaling_method(scaling_method);
-    proc.set_threading_mode(threading_mode);
+        mapnik::vector_tile_impl::processor proc(map);
 
-    mapnik::vector_tile_impl::merc_tile tile(proc.create_tile(
-        x, y, z, tile_size, buffer_size, scale_denom,
-        offset_x, offset_y, style_level_filter));
+        proc.set_area_threshold(area_threshold);
+        proc.set_simplify_distance(simplify_distance);
+        proc.set_multi_polygon_union(multi_polygon_union);
+        proc.set_process_all_rings(process_all_rings);
+        proc.set_fill_type(fill_type);
+        proc.set_image_format(image_format);
+        proc.set_scaling_method(scaling_method);
+        proc.set_threading_mode(threading_mode);
+
+        return proc.create_tile(
+            x, y, z, tile_size, buffer_size, scale_denom,
+            offset_x, offset_y, style_level_filter);
+    }();
 
     std::string const& buffer = tile.get_buffer();
     return boost::python::object(boost::python::handle<>(
         PyBytes_FromStringAndSize(buffer.data(), buffer.size())));
 }
 
-boost::python::list create_mvt_wafer_merc(
+mapnik::vector_tile_impl::merc_wafer create_wafer(
     mapnik::Map const& map,
     std::uint64_t x,
     std::uint64_t y,
@@ -94,6 +123,8 @@ boost::python::list create_mvt_wafer_merc(
     mapnik::scaling_method_e scaling_method,
     std::launch threading_mode)
 {
+    python_unblock_auto_block b;
+
     mapnik::vector_tile_impl::processor proc(map);
 
     proc.set_area_threshold(area_threshold);
@@ -105,9 +136,38 @@ boost::python::list create_mvt_wafer_merc(
     proc.set_scaling_method(scaling_method);
     proc.set_threading_mode(threading_mode);
 
-    mapnik::vector_tile_impl::merc_wafer wafer(proc.create_wafer(
+    return proc.create_wafer(
         x, y, z, span, tile_size, buffer_size, scale_denom,
-        offset_x, offset_y, style_level_filter));
+        offset_x, offset_y, style_level_filter);
+}
+
+boost::python::list create_mvt_wafer_merc(
+    mapnik::Map const& map,
+    std::uint64_t x,
+    std::uint64_t y,
+    std::uint64_t z,
+    unsigned span,
+    std::uint32_t tile_size,
+    boost::optional<std::int32_t> buffer_size,
+    double scale_denom,
+    int offset_x,
+    int offset_y,
+    bool style_level_filter,
+    double simplify_distance,
+    double area_threshold,
+    bool process_all_rings,
+    bool multi_polygon_union,
+    mapnik::vector_tile_impl::polygon_fill_type fill_type,
+    std::string const& image_format,
+    mapnik::scaling_method_e scaling_method,
+    std::launch threading_mode)
+{
+    // The GIL is held again only for creating the resulting bytes objects.
+    mapnik::vector_tile_impl::merc_wafer wafer = create_wafer(
+        map, x, y, z, span, tile_size, buffer_size, scale_denom,
+        offset_x, offset_y, style_level_filter, simplify_distance,
+        area_threshold, process_all_rings, multi_polygon_union,
+        fill_type, image_format, scaling_method, threading_mode);
 
     boost::python::list tiles;
 
@@ -121,10 +181,223 @@ boost::python::list create_mvt_wafer_merc(
     return tiles;
 }
 
-boost::python::object compress_mvt(std::string const& input)
+// Creates tiles of a wafer lazily in smaller wafers of chunk_span
+// tiles per side, so that only the tiles of one of them are held at
+// a time and the first tiles are returned before the others exist.
+struct mvt_wafer_iterator
+{
+    using create_func = std::function<mapnik::vector_tile_impl::merc_wafer(
+        mapnik::Map const&, std::uint64_t, std::uint64_t, unsigned)>;
+
+    // Keeps the Map alive between calls of next().
+    boost::python::object map;
+    std::uint64_t x;
+    std::uint64_t y;
+    unsigned span;
+    unsigned chunk_span;
+    create_func create;
+    unsigned next_chunk = 0;
+    std::size_t remaining = 0;
+    bool running = false;
+    std::deque<mapnik::vector_tile_impl::merc_tile> tiles;
+};
+
+std::shared_ptr<mvt_wafer_iterator> iter_mvt_wafer_merc(
+    boost::python::object const& map,
+    std::uint64_t x,
+    std::uint64_t y,
+    std::uint64_t z,
+    unsigned span,
+    std::uint32_t tile_size,
+    boost::optional<std::int32_t> buffer_size,
+    double scale_denom,
+    int offset_x,
+    int offset_y,
+    bool style_level_filter,
+    double simplify_distance,
+    double area_threshold,
+    bool process_all_rings,
+    bool multi_polygon_union,
+    mapnik::vector_tile_impl::polygon_fill_type fill_type,
+    std::string const& image_format,
+    mapnik::scaling_method_e scaling_method,
+    std::launch threading_mode,
+    unsigned chunk_span)
+{
+    if (!boost::python::extract<mapnik::Map const&>(map).check())
+    {
+        throw mapnik::value_error("iter_mvt_wafer_merc expects a Map");
+    }
+    if (span == 0 || chunk_span == 0 || span % chunk_span != 0)
+    {
+        throw mapnik::value_error("span must be a positive multiple of chunk_span");
+    }
+
+    auto itr = std::make_shared<mvt_wafer_iterator>();
+    itr->map = map;
+    itr->x = x;
+    itr->y = y;
+    itr->span = span;
+    itr->chunk_span = chunk_span;
+    itr->remaining = static_cast<std::size_t>(span) * span;
+    itr->create = [=](mapnik::Map const& m, std::uint64_t chunk_x,
+                      std::uint64_t chunk_y, unsigned wafer_span) {
+        return create_wafer(
+            m, chunk_x, chunk_y, z, wafer_span, tile_size, buffer_size,
+            scale_denom, offset_x, offset_y, style_level_filter,
+            simplify_distance, area_threshold, process_all_rings,
+            multi_polygon_union, fill_type, image_format, scaling_method,
+            threading_mode);
+    };
+    return itr;
+}
+
+boost::python::object mvt_wafer_iterator_next(mvt_wafer_iterator & itr)
+{
+    if (itr.running)
+    {
+        throw std::runtime_error("VectorTileWaferIterator is already running");
+    }
+    unsigned const chunks = itr.span / itr.chunk_span;
+    if (itr.tiles.empty() && itr.next_chunk < chunks * chunks)
+    {
+        std::uint64_t const chunk_x = itr.x + (itr.next_chunk % chunks) * itr.chunk_span;
+        std::uint64_t const chunk_y = itr.y + (itr.next_chunk / chunks) * itr.chunk_span;
+        mapnik::Map const& map = boost::python::extract<mapnik::Map const&>(itr.map)();
+        // The GIL is released while the wafer is created.
+        itr.running = true;
+        try
+        {
+            mapnik::vector_tile_impl::merc_wafer wafer = itr.create(
+                map, chunk_x, chunk_y, itr.chunk_span);
+            itr.tiles.assign(std::make_move_iterator(wafer.tiles().begin()),
+                             std::make_move_iterator(wafer.tiles().end()));
+        }
+        catch (...)
+        {
+            itr.running = false;
+            throw;
+        }
+        itr.running = false;
+        ++itr.next_chunk;
+    }
+    if (itr.tiles.empty())
+    {
+        PyErr_SetString(PyExc_StopIteration, "No more tiles.");
+        boost::python::throw_error_already_set();
+    }
+
+    mapnik::vector_tile_impl::merc_tile const& tile = itr.tiles.front();
+    std::string const& buffer = tile.get_buffer();
+    boost::python::object result = boost::python::make_tuple(
+        tile.x(), tile.y(),
+        boost::python::object(boost::python::handle<>(
+            PyBytes_FromStringAndSize(buffer.data(), buffer.size()))));
+
+    // Native buffer of the tile is not needed anymore.
+    itr.tiles.pop_front();
+    --itr.remaining;
+
+    return result;
+}
+
+std::size_t mvt_wafer_iterator_len(mvt_wafer_iterator const& itr)
+{
+    return itr.remaining;
+}
+
+boost::python::object mvt_wafer_iterator_iter(boost::python::object const& o)
+{
+    return o;
+}
+
+namespace {
+
+struct tile_xyz
+{
+    std::uint64_t x;
+    std::uint64_t y;
+    std::uint64_t z;
+};
+
+tile_xyz extract_xyz(boost::python::object const& xyz)
+{
+    using boost::python::extract;
+
+    if (boost::python::len(xyz) != 3)
+    {
+        throw mapnik::value_error("Tile coordinates must be given as (x, y, z)");
+    }
+    return { extract<std::uint64_t>(xyz[0])(),
+             extract<std::uint64_t>(xyz[1])(),
+             extract<std::uint64_t>(xyz[2])() };
+}
+
+}
+
+boost::python::object overzoom_mvt_merc(
+    std::string const& parent_buffer,
+    boost::python::object const& parent_xyz,
+    boost::python::object const& child_xyz,
+    std::uint32_t tile_size,
+    std::int32_t buffer_size)
+{
+    tile_xyz const parent = extract_xyz(parent_xyz);
+    tile_xyz const child = extract_xyz(child_xyz);
+
+    std::uint64_t const dz = child.z - parent.z;
+    if (child.z < parent.z || dz >= 64 ||
+        (child.x >> dz) != parent.x || (child.y >> dz) != parent.y)
+    {
+        throw mapnik::value_error("The child tile is not within the parent tile");
+    }
+
+    mapnik::vector_tile_impl::merc_tile tile = [&]()
+    {
+        python_unblock_auto_block b;
+
+        mapnik::vector_tile_impl::merc_tile parent_tile(
+            parent.x, parent.y, parent.z);
+        mapnik::vector_tile_impl::merge_from_compressed_buffer(
+            parent_tile, parent_buffer.data(), parent_buffer.size());
+
+        // Each layer of the parent tile becomes a layer reading
+        // its features directly from the parent buffer.
+        mapnik::Map map(tile_size, tile_size, "+init=epsg:3857");
+        auto const& layer_names = parent_tile.get_layers();
+        for (std::size_t i = 0; i < layer_names.size(); i++)
+        {
+            protozero::pbf_reader layer_msg;
+            if (parent_tile.layer_reader(i, layer_msg))
+            {
+                using ds_type = mapnik::vector_tile_impl::tile_datasource_pbf;
+                mapnik::layer lyr(layer_names[i], map.srs());
+                lyr.set_datasource(std::make_shared<ds_type>(
+                    layer_msg, parent.x, parent.y, parent.z));
+                map.add_layer(lyr);
+            }
+        }
+
+        mapnik::vector_tile_impl::processor proc(map);
+        return proc.create_tile(child.x, child.y, child.z,
+                                tile_size, buffer_size);
+    }();
+
+    std::string const& buffer = tile.get_buffer();
+    return boost::python::object(boost::python::handle<>(
+        PyBytes_FromStringAndSize(buffer.data(), buffer.size())));
+}
+
+boost::python::object compress_mvt(std::string const& input,
+                                   int level,
+                                   int strategy)
 {
     std::string output;
-    mapnik::vector_tile_impl::zlib_compress(input, output);
+    {
+        python_unblock_auto_block b;
+        mapnik::vector_tile_impl::zlib_compress(input, output, true,
+                                                level, strategy);
+    }
     return boost::python::object(boost::python::handle<>(
         PyBytes_FromStringAndSize(output.data(), output.size())));
 }
@@ -132,11 +405,126 @@ boost::python::object compress_mvt(std::string const& input)
 boost::python::object decompress_mvt(std::string const& input)
 {
     std::string output;
-    mapnik::vector_tile_impl::zlib_decompress(input, output);
+    {
+        python_unblock_auto_block b;
+        mapnik::vector_tile_impl::zlib_decompress(input, output);
+    }
     return boost::python::object(boost::python::handle<>(
         PyBytes_FromStringAndSize(output.data(), output.size())));
 }
 
+struct compression_chunk
+{
+    Py_buffer view;
+    std::string output;
+    std::exception_ptr error;
+};
+
+using compression_chunks = buffer_chunks<compression_chunk>;
+
+struct compress_func
+{
+    compression_chunks & chunks;
+    int level;
+    int strategy;
+
+    void operator()(unsigned begin, unsigned end)
+    {
+        for (unsigned i = begin; i < end; ++i)
+        {
+            compression_chunk & chunk = chunks[i];
+            try
+            {
+                mapnik::vector_tile_impl::zlib_compress(
+                    static_cast<char const*>(chunk.view.buf),
+                    static_cast<std::size_t>(chunk.view.len),
+                    chunk.output, true, level, strategy);
+            }
+            catch (...)
+            {
+                chunk.error = std::current_exception();
+            }
+        }
+    }
+};
+
+struct decompress_func
+{
+    compression_chunks & chunks;
+
+    void operator()(unsigned begin, unsigned end)
+    {
+        for (unsigned i = begin; i < end; ++i)
+        {
+            compression_chunk & chunk = chunks[i];
+            try
+            {
+                mapnik::vector_tile_impl::zlib_decompress(
+                    static_cast<char const*>(chunk.view.buf),
+                    static_cast<std::size_t>(chunk.view.len),
+                    chunk.output);
+            }
+            catch (...)
+            {
+                chunk.error = std::current_exception();
+            }
+        }
+    }
+};
+
+boost::python::list chunks_to_list(compression_chunks & chunks)
+{
+    for (auto const& chunk : chunks)
+    {
+        if (chunk.error)
+        {
+            std::rethrow_exception(chunk.error);
+        }
+    }
+
+    boost::python::list result;
+    for (auto & chunk : chunks)
+    {
+        result.append(boost::python::object(boost::python::handle<>(
+            PyBytes_FromStringAndSize(chunk.output.data(),
+                                      chunk.output.size()))));
+        std::string().swap(chunk.output);
+    }
+    return result;
+}
+
+boost::python::list compress_mvt_many(boost::python::object const& buffers,
+                                      int level,
+                                      int strategy,
+                                      unsigned threads)
+{
+    compression_chunks chunks;
+    chunks.extend(buffers);
+    {
+        python_unblock_auto_block b;
+        compress_func func{chunks, level, strategy};
+        mapnik::util::parallelize(func,
+                                  jobs_by_chunks(chunks.size(), threads),
+                                  chunks.size());
+    }
+    return chunks_to_list(chunks);
+}
+
+boost::python::list decompress_mvt_many(boost::python::object const& buffers,
+                                        unsigned threads)
+{
+    compression_chunks chunks;
+    chunks.extend(buffers);
+    {
+        python_unblock_auto_block b;
+        decompress_func func{chunks};
+        mapnik::util::parallelize(func,
+                                  jobs_by_chunks(chunks.size(), threads),
+                                  chunks.size());
+    }
+    return chunks_to_list(chunks);
+}
+
 void export_mvt_create()
 {
     using namespace boost::python;
@@ -220,11 +608,93 @@ void export_mvt_create()
         "Creates MVT into a buffer\n"
         "mapnik.create_mvt_wafer_merc(m, 2257, 1393, 12, 8, 4096, 0, 0, 0, 0)");
 
+    class_<mvt_wafer_iterator, std::shared_ptr<mvt_wafer_iterator>,
+           boost::noncopyable>("VectorTileWaferIterator", no_init)
+        .def("__iter__", mvt_wafer_iterator_iter)
+        .def("__next__", mvt_wafer_iterator_next)
+        // Python2 support
+        .def("next", mvt_wafer_iterator_next)
+        .def("__len__", mvt_wafer_iterator_len)
+        ;
+
+    def("iter_mvt_wafer_merc", &iter_mvt_wafer_merc,
+        (arg("map"),
+         arg("x"),
+         arg("y"),
+         arg("z"),
+         arg("span"),
+         arg("tile_size") = 4096,
+         // If None, buffer size is taken from the Map.
+         arg("buffer_size") = boost::optional<std::int32_t>(),
+         arg("scale_denom") = 0.0,
+         arg("offset_x") = 0,
+         arg("offset_y") = 0,
+         // Filter features by rule conditions in styles.
+         arg("style_level_filter") = false,
+         // Positive value in the units of vector tile coordinates will turn on
+         // douglas-peucker with given simplification distance.
+         arg("simplify_distance") = 0.0,
+         // Skip polygons with area below this threshold,
+         // in vector tile coordinates units.
+         arg("area_threshold") = 0.1,
+         // Process all rings even exterior ring is degenerated
+         // or smaller than area_threshold.
+         arg("process_all_rings") = false,
+         // Conflate multi-polygon.
+         arg("multi_polygon_union") = false,
+         // Polygon fill strategy used during clipping.
+         arg("fill_type") = fill_type::positive_fill,
+         // Raster image format.
+         arg("image_format") = std::string("tiff"),
+         // Raster scaling method.
+         arg("scaling_method") = mapnik::SCALING_BILINEAR,
+         // Allows parallel processing of layers.
+         arg("threading_mode") = std::launch::deferred,
+         // Tiles per side of the wafers created at a time.
+         arg("chunk_span") = 1u),
+        "Returns an iterator of (x, y, buffer) tuples of the tiles of a wafer.\n"
+        "Tiles are created when they are needed, in wafers of chunk_span\n"
+        "tiles per side, and native buffers of the tiles are freed once they\n"
+        "are returned. Larger chunk_span queries datasources less often but\n"
+        "holds more tiles, chunk_span=span creates the whole wafer at once.\n"
+        "for x, y, buffer in mapnik.iter_mvt_wafer_merc(m, 2256, 1392, 12, 8):")
+
+    def("overzoom_mvt_merc", &overzoom_mvt_merc,
+        (arg("parent_buffer"),
+         arg("parent_xyz"),
+         arg("child_xyz"),
+         arg("tile_size") = 4096,
+         arg("buffer_size") = 128),
+        "Creates MVT of a child tile from the buffer of its parent tile.\n"
+        "Features are clipped and rescaled without accessing datasources.\n"
+        "The parent buffer can be compressed.\n"
+        "mapnik.overzoom_mvt_merc(parent, (1128, 696, 11), (2257, 1393, 12))");
+
     def("compress_mvt", &compress_mvt,
+        (arg("input"),
+         // zlib compression level, from 0 to 9, -1 is the zlib default.
+         arg("level") = Z_DEFAULT_COMPRESSION,
+         // zlib strategy, e.g. zlib.Z_FILTERED or zlib.Z_RLE.
+         arg("strategy") = Z_DEFAULT_STRATEGY),
         "gzip compression");
 
     def("decompress_mvt", &decompress_mvt,
         "decompress zlib or gzip compressed data");
+
+    def("compress_mvt_many", &compress_mvt_many,
+        (arg("buffers"),
+         arg("level") = Z_DEFAULT_COMPRESSION,
+         arg("strategy") = Z_DEFAULT_STRATEGY,
+         // Number of threads, 0 means half of the CPU cores.
+         arg("threads") = 0u),
+        "gzip compression of a list of buffers in parallel without the GIL");
+
+    def("decompress_mvt_many", &decompress_mvt_many,
+        (arg("buffers"),
+         // Number of threads, 0 means half of the CPU cores.
+         arg("threads") = 0u),
+        "decompress a list of zlib or gzip compressed buffers in parallel\n"
+        "without the GIL");
 }
 
 void merge_compressed_buffer(mapnik::vector_tile_impl::merc_tile & tile,
@@ -253,6 +723,9 @@ boost::python::object mvt_get_buffer(mapnik::vector_tile_impl::tile const& tile)
 extern void export_mvt_render();
 extern void export_mvt_preview();
 extern void export_mvt_info();
+extern void export_mvt_arrays();
+extern void export_mvt_decoded();
+extern void export_mvt_stats();
 
 void export_mvt()
 {
@@ -314,6 +787,9 @@ void export_mvt()
 
     export_mvt_create();
     export_mvt_info();
+    export_mvt_arrays();
+    export_mvt_decoded();
+    export_mvt_stats();
     export_mvt_render();
     export_mvt_preview();
 }
@@ -0,0 +1,506 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+
+#include <mapnik/config.hpp>
+#include <mapnik/params.hpp>
+
+#include <mapbox/mapnik-vector-tile/vector_tile_compression.hpp>
+#include <protozero/pbf_reader.hpp>
+
+#include <boost/python.hpp>
+
+#include <cmath>
+#include <cstdint>
+#include <limits>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include "mapnik_threads.hpp"
+#include "mapnik_vector_tile_buffers.hpp"
+#include "mapnik_value_converter.hpp"
+
+using mapnik::python_unblock_auto_block;
+
+namespace {
+
+// Columns of integers and booleans present in all features are int64
+// and bool arrays, other numeric columns are float64 arrays with NaN
+// for missing values. Columns with strings are lists of values.
+struct property_column
+{
+    enum column_type { bool_array, integer_array, double_array, value_list };
+
+    column_type type = value_list;
+    std::vector<std::uint8_t> bools;
+    std::vector<std::int64_t> integers;
+    std::vector<double> doubles;
+    std::vector<mapnik::value_holder const*> values;
+};
+
+// Layers decoded into flat arrays. Parts are points of a (multi)point,
+// linestrings or rings, geometry_offsets index parts of features and
+// part_offsets index vertices of parts.
+struct decoded_layer
+{
+    std::string name;
+    std::uint32_t version = 1;
+    std::uint32_t extent = 4096;
+    std::vector<std::uint64_t> ids;
+    std::vector<std::uint8_t> geom_types;
+    std::vector<std::uint32_t> geometry_offsets{0};
+    std::vector<std::uint32_t> part_offsets{0};
+    std::vector<std::uint8_t> part_exterior;
+    std::vector<std::int32_t> coords;
+    std::vector<std::string> keys;
+    std::vector<mapnik::value_holder> values;
+    std::vector<std::uint32_t> tag_offsets{0};
+    std::vector<std::uint32_t> tags;
+    std::vector<property_column> columns;
+};
+
+mapnik::value_holder decode_value(protozero::pbf_reader value_msg)
+{
+    while (value_msg.next())
+    {
+        switch (value_msg.tag())
+        {
+        case 1:
+            return value_msg.get_string();
+        case 2:
+            return static_cast<mapnik::value_double>(value_msg.get_float());
+        case 3:
+            return static_cast<mapnik::value_double>(value_msg.get_double());
+        case 4:
+            return static_cast<mapnik::value_integer>(value_msg.get_int64());
+        case 5:
+            return static_cast<mapnik::value_integer>(value_msg.get_uint64());
+        case 6:
+            return static_cast<mapnik::value_integer>(value_msg.get_sint64());
+        case 7:
+            return value_msg.get_bool();
+        default:
+            value_msg.skip();
+        }
+    }
+    return mapnik::value_null();
+}
+
+class geometry_decoder
+{
+public:
+    geometry_decoder(decoded_layer & layer, std::uint8_t geom_type)
+        : layer_(layer), geom_type_(geom_type) {}
+
+    template <typename Iterator>
+    void decode(Iterator it, Iterator end)
+    {
+        geometry_commands<Iterator> commands(it, end);
+        std::int32_t x = 0;
+        std::int32_t y = 0;
+        std::uint32_t cmd;
+        std::uint32_t count;
+        while (commands.next(cmd, count))
+        {
+            if (cmd == commands.close_path)
+            {
+                close_part();
+                continue;
+            }
+            for (; count > 0; --count)
+            {
+                std::int32_t dx;
+                std::int32_t dy;
+                commands.next_vertex(dx, dy);
+                x += dx;
+                y += dy;
+                // All points of a multipoint are a single part.
+                if (cmd == commands.move_to && (geom_type_ != 1 || !in_part_))
+                {
+                    finish_part();
+                    part_start_ = layer_.coords.size();
+                    in_part_ = true;
+                }
+                layer_.coords.push_back(x);
+                layer_.coords.push_back(y);
+            }
+        }
+    }
+
+    void finish()
+    {
+        finish_part();
+        layer_.geometry_offsets.push_back(
+            static_cast<std::uint32_t>(layer_.part_offsets.size() - 1));
+    }
+
+private:
+    void close_part()
+    {
+        if (in_part_ && layer_.coords.size() > part_start_)
+        {
+            std::int32_t const x = layer_.coords[part_start_];
+            std::int32_t const y = layer_.coords[part_start_ + 1];
+            layer_.coords.push_back(x);
+            layer_.coords.push_back(y);
+        }
+    }
+
+    void finish_part()
+    {
+        if (!in_part_)
+        {
+            return;
+        }
+        in_part_ = false;
+        bool exterior = false;
+        if (geom_type_ == 3)
+        {
+            // Exterior rings are clockwise in tile coordinates,
+            // which have the y axis pointing down.
+            double area = 0.0;
+            for (std::size_t i = part_start_; i + 3 < layer_.coords.size(); i += 2)
+            {
+                area += static_cast<double>(layer_.coords[i]) * layer_.coords[i + 3] -
+                        static_cast<double>(layer_.coords[i + 2]) * layer_.coords[i + 1];
+            }
+            exterior = area > 0.0;
+        }
+        layer_.part_exterior.push_back(exterior);
+        layer_.part_offsets.push_back(
+            static_cast<std::uint32_t>(layer_.coords.size() / 2));
+    }
+
+    decoded_layer & layer_;
+    std::uint8_t geom_type_;
+    std::size_t part_start_ = 0;
+    bool in_part_ = false;
+};
+
+void decode_feature(decoded_layer & layer, protozero::pbf_reader feature_msg)
+{
+    std::uint64_t id = 0;
+    std::uint8_t geom_type = 0;
+    bool has_geometry = false;
+    protozero::pbf_reader geometry_msg;
+
+    while (feature_msg.next())
+    {
+        switch (feature_msg.tag())
+        {
+        case 1:
+            id = feature_msg.get_uint64();
+            break;
+        case 2:
+        {
+            auto tags = feature_msg.get_packed_uint32();
+            layer.tags.insert(layer.tags.end(), tags.first, tags.second);
+            break;
+        }
+        case 3:
+            geom_type = static_cast<std::uint8_t>(feature_msg.get_enum());
+            break;
+        case 4:
+            geometry_msg = feature_msg;
+            has_geometry = true;
+            feature_msg.skip();
+            break;
+        default:
+            feature_msg.skip();
+        }
+    }
+
+    // The geometry type may follow the geometry in the message.
+    geometry_decoder decoder(layer, geom_type);
+    if (has_geometry)
+    {
+        auto geometry = geometry_msg.get_packed_uint32();
+        decoder.decode(geometry.first, geometry.second);
+    }
+    decoder.finish();
+
+    if (layer.tags.size() % 2 != 0)
+    {
+        throw std::runtime_error("Odd number of MVT feature tags");
+    }
+    layer.ids.push_back(id);
+    layer.geom_types.push_back(geom_type);
+    layer.tag_offsets.push_back(static_cast<std::uint32_t>(layer.tags.size()));
+}
+
+void set_column_type(property_column & column)
+{
+    std::size_t const features = column.values.size();
+    bool all_present = true;
+    bool all_integer = true;
+    bool all_bool = true;
+    bool all_numeric = true;
+    for (auto value : column.values)
+    {
+        if (value == nullptr || value->is<mapnik::value_null>())
+        {
+            all_present = false;
+            continue;
+        }
+        bool const is_integer = value->is<mapnik::value_integer>();
+        bool const is_bool = value->is<mapnik::value_bool>();
+        all_integer = all_integer && is_integer;
+        all_bool = all_bool && is_bool;
+        all_numeric = all_numeric && (is_integer || value->is<mapnik::value_double>());
+    }
+
+    if (all_present && all_bool && features > 0)
+    {
+        column.type = property_column::bool_array;
+        column.bools.reserve(features);
+        for (auto value : column.values)
+        {
+            column.bools.push_back(value->get<mapnik::value_bool>());
+        }
+    }
+    else if (all_present && all_integer)
+    {
+        column.type = property_column::integer_array;
+        column.integers.reserve(features);
+        for (auto value : column.values)
+        {
+            column.integers.push_back(value->get<mapnik::value_integer>());
+        }
+    }
+    else if (all_numeric)
+    {
+        column.type = property_column::double_array;
+        column.doubles.reserve(features);
+        for (auto value : column.values)
+        {
+            if (value == nullptr || value->is<mapnik::value_null>())
+            {
+                column.doubles.push_back(std::numeric_limits<double>::quiet_NaN());
+            }
+            else if (value->is<mapnik::value_integer>())
+            {
+                column.doubles.push_back(static_cast<double>(value->get<mapnik::value_integer>()));
+            }
+            else
+            {
+                column.doubles.push_back(value->get<mapnik::value_double>());
+            }
+        }
+    }
+    if (column.type != property_column::value_list)
+    {
+        std::vector<mapnik::value_holder const*>().swap(column.values);
+    }
+}
+
+// Fills columns of all keys in a single pass over tags of features,
+// the first tag of a key in a feature wins.
+void decode_columns(decoded_layer & layer)
+{
+    std::size_t const features = layer.ids.size();
+    layer.columns.resize(layer.keys.size());
+    for (auto & column : layer.columns)
+    {
+        column.values.assign(features, nullptr);
+    }
+    for (std::size_t i = 0; i < features; ++i)
+    {
+        for (std::uint32_t t = layer.tag_offsets[i]; t < layer.tag_offsets[i + 1]; t += 2)
+        {
+            std::uint32_t const key = layer.tags[t];
+            std::uint32_t const value = layer.tags[t + 1];
+            if (key < layer.columns.size() && value < layer.values.size())
+            {
+                auto & slot = layer.columns[key].values[i];
+                if (slot == nullptr)
+                {
+                    slot = &layer.values[value];
+                }
+            }
+        }
+    }
+    for (auto & column : layer.columns)
+    {
+        set_column_type(column);
+    }
+}
+
+decoded_layer decode_layer(protozero::pbf_reader layer_msg)
+{
+    decoded_layer layer;
+    while (layer_msg.next())
+    {
+        switch (layer_msg.tag())
+        {
+        case 1:
+            layer.name = layer_msg.get_string();
+            break;
+        case 2:
+            decode_feature(layer, layer_msg.get_message());
+            break;
+        case 3:
+            layer.keys.push_back(layer_msg.get_string());
+            break;
+        case 4:
+            layer.values.push_back(decode_value(layer_msg.get_message()));
+            break;
+        case 5:
+            layer.extent = layer_msg.get_uint32();
+            break;
+        case 15:
+            layer.version = layer_msg.get_uint32();
+            break;
+        default:
+            layer_msg.skip();
+        }
+    }
+    return layer;
+}
+
+std::vector<decoded_layer> decode_tile(std::string const& buffer)
+{
+    std::string uncompressed;
+    char const* data = buffer.data();
+    std::size_t size = buffer.size();
+    if (mapnik::vector_tile_impl::is_zlib_compressed(buffer) ||
+        mapnik::vector_tile_impl::is_gzip_compressed(buffer))
+    {
+        mapnik::vector_tile_impl::zlib_decompress(buffer, uncompressed);
+        data = uncompressed.data();
+        size = uncompressed.size();
+    }
+
+    std::vector<decoded_layer> layers;
+    protozero::pbf_reader tile_msg(data, size);
+    while (tile_msg.next(3))
+    {
+        layers.push_back(decode_layer(tile_msg.get_message()));
+    }
+    // Columns point to values of layers, which are not moved anymore.
+    for (auto & layer : layers)
+    {
+        decode_columns(layer);
+    }
+    return layers;
+}
+
+// Arrays are memoryviews of bytearrays, which numpy.asarray() and
+// numpy.frombuffer() use without copying.
+template <typename T>
+boost::python::object to_array(std::vector<T> const& data, char const* format)
+{
+    using namespace boost::python;
+    object buffer(handle<>(PyByteArray_FromStringAndSize(
+        reinterpret_cast<char const*>(data.data()),
+        static_cast<Py_ssize_t>(data.size() * sizeof(T)))));
+    object view(handle<>(PyMemoryView_FromObject(buffer.ptr())));
+    return view.attr("cast")(format);
+}
+
+boost::python::object value_to_python(mapnik::value_holder const& value)
+{
+    return boost::python::object(boost::python::handle<>(
+        mapnik::util::apply_visitor(boost::python::value_converter(), value)));
+}
+
+boost::python::object column_to_python(property_column const& column)
+{
+    switch (column.type)
+    {
+    case property_column::bool_array:
+        return to_array(column.bools, "?");
+    case property_column::integer_array:
+        return to_array(column.integers, "q");
+    case property_column::double_array:
+        return to_array(column.doubles, "d");
+    default:
+        break;
+    }
+    boost::python::list data;
+    for (auto value : column.values)
+    {
+        data.append(value ? value_to_python(*value) : boost::python::object());
+    }
+    return data;
+}
+
+boost::python::dict layer_to_python(decoded_layer const& layer)
+{
+    boost::python::dict properties;
+    for (std::size_t key = 0; key < layer.keys.size(); ++key)
+    {
+        properties[layer.keys[key]] = column_to_python(layer.columns[key]);
+    }
+
+    boost::python::dict result;
+    result["name"] = layer.name;
+    result["version"] = layer.version;
+    result["extent"] = layer.extent;
+    result["id"] = to_array(layer.ids, "Q");
+    result["geom_type"] = to_array(layer.geom_types, "B");
+    result["geometry_offsets"] = to_array(layer.geometry_offsets, "I");
+    result["part_offsets"] = to_array(layer.part_offsets, "I");
+    result["part_exterior"] = to_array(layer.part_exterior, "?");
+    result["coords"] = to_array(layer.coords, "i");
+    result["properties"] = properties;
+    return result;
+}
+
+}
+
+boost::python::list decode_mvt_arrays(std::string const& buffer)
+{
+    std::vector<decoded_layer> layers;
+    {
+        python_unblock_auto_block b;
+        layers = decode_tile(buffer);
+    }
+
+    boost::python::list result;
+    for (auto const& layer : layers)
+    {
+        result.append(layer_to_python(layer));
+    }
+    return result;
+}
+
+void export_mvt_arrays()
+{
+    using namespace boost::python;
+
+    def("decode_mvt_arrays", &decode_mvt_arrays,
+        (arg("buffer")),
+        "Decodes MVT layers into dicts of flat arrays usable by numpy.asarray().\n"
+        "The buffer can be compressed. Each layer contains:\n"
+        "  name, version, extent\n"
+        "  id, geom_type: uint64 and uint8 arrays by features\n"
+        "  geometry_offsets: uint32 array, parts of the feature i are\n"
+        "    geometry_offsets[i]:geometry_offsets[i + 1]\n"
+        "  part_offsets: uint32 array, vertices of the part j are\n"
+        "    part_offsets[j]:part_offsets[j + 1]\n"
+        "  part_exterior: bool array, True for exterior rings of polygons\n"
+        "  coords: int32 array of x, y pairs in tile coordinates\n"
+        "  properties: dict of columns by keys, int64, bool or float64\n"
+        "    arrays for numeric values, lists for other values\n"
+        ">>> layers = mapnik.decode_mvt_arrays(buffer)\n"
+        ">>> xy = numpy.asarray(layers[0]['coords']).reshape(-1, 2)\n");
+}
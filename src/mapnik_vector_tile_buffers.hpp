@@ -0,0 +1,131 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+#ifndef MAPNIK_VECTOR_TILE_BUFFERS_HPP
+#define MAPNIK_VECTOR_TILE_BUFFERS_HPP
+
+// boost
+#include <boost/python.hpp>
+#include <boost/python/stl_iterator.hpp>
+
+// stl
+#include <cstdint>
+#include <stdexcept>
+#include <vector>
+
+// Chunks of work reading Python buffers, chunk types have a Py_buffer
+// view member. Views are released on destruction, which has to happen
+// with the GIL held.
+template <typename Chunk>
+struct buffer_chunks : std::vector<Chunk>
+{
+    void append(boost::python::object const& buffer)
+    {
+        this->emplace_back();
+        if (PyObject_GetBuffer(buffer.ptr(), &this->back().view, PyBUF_SIMPLE) != 0)
+        {
+            this->pop_back();
+            boost::python::throw_error_already_set();
+        }
+    }
+
+    void extend(boost::python::object const& buffers)
+    {
+        boost::python::stl_input_iterator<boost::python::object> it(buffers), end;
+        for (; it != end; ++it)
+        {
+            append(*it);
+        }
+    }
+
+    ~buffer_chunks()
+    {
+        for (auto & chunk : *this)
+        {
+            PyBuffer_Release(&chunk.view);
+        }
+    }
+};
+
+inline std::int32_t decode_zigzag32(std::uint32_t n)
+{
+    return static_cast<std::int32_t>((n >> 1) ^ (~(n & 1) + 1));
+}
+
+// Walks commands of a packed MVT geometry. MoveTo and LineTo commands
+// are followed by count vertices, which have to be read or skipped
+// before the next command. ClosePath has no vertices.
+template <typename Iterator>
+class geometry_commands
+{
+public:
+    enum : std::uint32_t { move_to = 1, line_to = 2, close_path = 7 };
+
+    geometry_commands(Iterator begin, Iterator end)
+        : it_(begin), end_(end) {}
+
+    // Returns false at the end of the geometry.
+    bool next(std::uint32_t & cmd, std::uint32_t & count)
+    {
+        if (it_ == end_)
+        {
+            return false;
+        }
+        cmd = *it_ & 0x7;
+        count = *it_ >> 3;
+        ++it_;
+        if (cmd != move_to && cmd != line_to && cmd != close_path)
+        {
+            throw std::runtime_error("Unknown command in MVT geometry");
+        }
+        return true;
+    }
+
+    // Reads a vertex relative to the previous one.
+    void next_vertex(std::int32_t & dx, std::int32_t & dy)
+    {
+        dx = decode_zigzag32(param());
+        dy = decode_zigzag32(param());
+    }
+
+    void skip_vertices(std::uint32_t count)
+    {
+        for (std::uint64_t i = 0; i < 2ull * count; ++i)
+        {
+            param();
+        }
+    }
+
+private:
+    std::uint32_t param()
+    {
+        if (it_ == end_)
+        {
+            throw std::runtime_error("Truncated MVT geometry");
+        }
+        return *it_++;
+    }
+
+    Iterator it_;
+    Iterator end_;
+};
+
+#endif // MAPNIK_VECTOR_TILE_BUFFERS_HPP
@@ -0,0 +1,225 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+
+#include <mapnik/config.hpp>
+#include "boost_std_shared_shim.hpp"
+
+#include <mapnik/memory_datasource.hpp>
+#include <mapnik/params.hpp>
+#include <mapnik/query.hpp>
+
+#include <mapbox/mapnik-vector-tile/vector_tile_datasource_pbf.hpp>
+#include <mapbox/mapnik-vector-tile/vector_tile_projection.hpp>
+
+#pragma GCC diagnostic push
+#include <mapnik/warning_ignore.hpp>
+#include <boost/python.hpp>
+#include <boost/noncopyable.hpp>
+#pragma GCC diagnostic pop
+
+#include <iterator>
+
+#include "mapnik_vector_tile_decoded.hpp"
+
+namespace {
+
+// Decoded features take roughly this many times more memory
+// than their encoded form.
+constexpr std::size_t decoded_size_factor = 8;
+
+}
+
+decoded_vector_tile::decoded_vector_tile(mapnik::vector_tile_impl::merc_tile const& tile,
+                                         std::size_t memory_limit)
+    : buffer_(tile.get_buffer()),
+      x_(tile.x()),
+      y_(tile.y()),
+      z_(tile.z()),
+      extent_(tile.extent()),
+      memory_limit_(memory_limit)
+{
+    protozero::pbf_reader tile_msg(buffer_.data(), buffer_.size());
+    while (tile_msg.next(3))
+    {
+        auto data = tile_msg.get_data();
+        protozero::pbf_reader layer_msg(data.first, data.second);
+        if (layer_msg.next(1))
+        {
+            std::string name = layer_msg.get_string();
+            if (layers_.emplace(name, std::make_pair(
+                    static_cast<std::size_t>(data.first - buffer_.data()),
+                    static_cast<std::size_t>(data.second))).second)
+            {
+                names_.push_back(name);
+            }
+        }
+    }
+}
+
+mapnik::datasource_ptr decode_mvt_layer(protozero::pbf_reader const& layer_msg,
+                                        std::uint64_t x,
+                                        std::uint64_t y,
+                                        std::uint64_t z,
+                                        mapnik::box2d<double> const& extent)
+{
+    mapnik::vector_tile_impl::tile_datasource_pbf pbf_ds(layer_msg, x, y, z);
+    pbf_ds.set_envelope(extent);
+
+    mapnik::parameters params;
+    params["type"] = std::string("memory");
+    auto ds = std::make_shared<mapnik::memory_datasource>(params);
+
+    mapnik::query q(extent);
+    for (auto const& desc : pbf_ds.get_descriptor().get_descriptors())
+    {
+        q.add_property_name(desc.get_name());
+    }
+    mapnik::featureset_ptr fs = pbf_ds.features(q);
+    if (fs)
+    {
+        while (mapnik::feature_ptr feature = fs->next())
+        {
+            ds->push(feature);
+        }
+    }
+    return ds;
+}
+
+mapnik::datasource_ptr decoded_vector_tile::decode_layer(std::string const& name) const
+{
+    auto layer = layers_.find(name);
+    if (layer == layers_.end())
+    {
+        return nullptr;
+    }
+
+    protozero::pbf_reader layer_msg(buffer_.data() + layer->second.first,
+                                    layer->second.second);
+    // All features including the buffer of the tile.
+    mapnik::box2d<double> extent(extent_);
+    extent.pad(extent.width());
+    return decode_mvt_layer(layer_msg, x_, y_, z_, extent);
+}
+
+mapnik::datasource_ptr decoded_vector_tile::datasource(std::string const& name) const
+{
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        auto entry = cache_.find(name);
+        if (entry != cache_.end())
+        {
+            lru_.splice(lru_.end(), lru_, entry->second.lru_position);
+            return entry->second.ds;
+        }
+    }
+
+    mapnik::datasource_ptr ds = decode_layer(name);
+    if (!ds)
+    {
+        return ds;
+    }
+
+    std::size_t size = layers_.find(name)->second.second * decoded_size_factor;
+    std::lock_guard<std::mutex> lock(mutex_);
+    if (size <= memory_limit_ && cache_.find(name) == cache_.end())
+    {
+        evict(memory_limit_ - size);
+        lru_.push_back(name);
+        cache_.emplace(name, cache_entry{ ds, size, std::prev(lru_.end()) });
+        cache_size_ += size;
+    }
+    return ds;
+}
+
+void decoded_vector_tile::evict(std::size_t memory_limit) const
+{
+    while (cache_size_ > memory_limit && !lru_.empty())
+    {
+        auto entry = cache_.find(lru_.front());
+        cache_size_ -= entry->second.size;
+        cache_.erase(entry);
+        lru_.pop_front();
+    }
+}
+
+std::size_t decoded_vector_tile::memory_limit() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return memory_limit_;
+}
+
+void decoded_vector_tile::set_memory_limit(std::size_t memory_limit)
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    memory_limit_ = memory_limit;
+    evict(memory_limit_);
+}
+
+std::size_t decoded_vector_tile::cache_size() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return cache_size_;
+}
+
+void decoded_vector_tile::clear_cache()
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    evict(0);
+}
+
+boost::python::list decoded_layer_names(decoded_vector_tile const& tile)
+{
+    boost::python::list names;
+    for (auto const& name : tile.layer_names())
+    {
+        names.append(name);
+    }
+    return names;
+}
+
+void export_mvt_decoded()
+{
+    using namespace boost::python;
+
+    class_<decoded_vector_tile, std::shared_ptr<decoded_vector_tile>,
+           boost::noncopyable>("DecodedVectorTile",
+        "A MVT with layers indexed once and features decoded on first use.\n"
+        "It can be rendered by render_mvt_merc and preview_mvt_merc many times.\n"
+        "Decoded layers are cached while their estimated size fits memory_limit.",
+        init<mapnik::vector_tile_impl::merc_tile const&, std::size_t>(
+            (arg("tile"),
+             arg("memory_limit") = 64 * 1024 * 1024)
+        ))
+        .add_property("x", &decoded_vector_tile::x)
+        .add_property("y", &decoded_vector_tile::y)
+        .add_property("z", &decoded_vector_tile::z)
+        .add_property("extent", make_function(&decoded_vector_tile::extent,
+            return_value_policy<copy_const_reference>()))
+        .add_property("memory_limit",
+                      &decoded_vector_tile::memory_limit,
+                      &decoded_vector_tile::set_memory_limit)
+        .add_property("cache_size", &decoded_vector_tile::cache_size,
+                      "Estimated size of cached decoded layers in bytes.")
+        .def("layer_names", decoded_layer_names)
+        .def("clear_cache", &decoded_vector_tile::clear_cache)
+        ;
+}
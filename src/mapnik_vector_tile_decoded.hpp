@@ -0,0 +1,100 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+#ifndef MAPNIK_VECTOR_TILE_DECODED_HPP
+#define MAPNIK_VECTOR_TILE_DECODED_HPP
+
+// mapnik
+#include <mapnik/box2d.hpp>
+#include <mapnik/datasource.hpp>
+
+#include <mapbox/mapnik-vector-tile/vector_tile_merc_tile.hpp>
+#include <protozero/pbf_reader.hpp>
+
+// stl
+#include <cstdint>
+#include <list>
+#include <map>
+#include <mutex>
+#include <string>
+#include <utility>
+#include <vector>
+
+// Reads all features of the MVT layer of tile x, y, z within the
+// extent into a memory datasource.
+mapnik::datasource_ptr decode_mvt_layer(protozero::pbf_reader const& layer_msg,
+                                        std::uint64_t x,
+                                        std::uint64_t y,
+                                        std::uint64_t z,
+                                        mapnik::box2d<double> const& extent);
+
+// A vector tile with layers indexed once. Features of a layer are
+// decoded on first use into a memory datasource, which is cached
+// while the estimated size of all cached layers fits the memory limit.
+class decoded_vector_tile
+{
+public:
+    decoded_vector_tile(mapnik::vector_tile_impl::merc_tile const& tile,
+                        std::size_t memory_limit);
+
+    std::uint64_t x() const { return x_; }
+    std::uint64_t y() const { return y_; }
+    std::uint64_t z() const { return z_; }
+    mapnik::box2d<double> const& extent() const { return extent_; }
+    std::vector<std::string> const& layer_names() const { return names_; }
+
+    // Returns a datasource with all features of the layer,
+    // nullptr if there is no such layer. Thread-safe.
+    mapnik::datasource_ptr datasource(std::string const& name) const;
+
+    std::size_t memory_limit() const;
+    void set_memory_limit(std::size_t memory_limit);
+    std::size_t cache_size() const;
+    void clear_cache();
+
+private:
+    struct cache_entry
+    {
+        mapnik::datasource_ptr ds;
+        std::size_t size;
+        std::list<std::string>::iterator lru_position;
+    };
+
+    mapnik::datasource_ptr decode_layer(std::string const& name) const;
+    void evict(std::size_t memory_limit) const;
+
+    std::string buffer_;
+    std::uint64_t x_;
+    std::uint64_t y_;
+    std::uint64_t z_;
+    mapnik::box2d<double> extent_;
+    std::vector<std::string> names_;
+    // Offsets and sizes of layer messages in the buffer by names
+    std::map<std::string, std::pair<std::size_t, std::size_t>> layers_;
+
+    mutable std::mutex mutex_;
+    mutable std::list<std::string> lru_;
+    mutable std::map<std::string, cache_entry> cache_;
+    mutable std::size_t cache_size_ = 0;
+    std::size_t memory_limit_;
+};
+
+#endif // MAPNIK_VECTOR_TILE_DECODED_HPP
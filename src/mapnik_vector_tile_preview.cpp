@@ -36,6 +36,10 @@
 
 #include <boost/python.hpp>
 
+#include <vector>
+
+#include "mapnik_vector_tile_decoded.hpp"
+
 struct preview_map
 {
     static const std::string style_xml;
@@ -74,9 +78,10 @@ const std::string preview_map::style_xml(R"preview_style(
 
 static const preview_map preview_map_;
 
-void preview_mvt_merc_custom(mapnik::vector_tile_impl::merc_tile const& mvt,
-                             mapnik::Map const& map,
-                             mapnik::image_any& image)
+void preview_datasources(std::vector<mapnik::datasource_ptr> const& datasources,
+                         mapnik::box2d<double> const& map_extent,
+                         mapnik::Map const& map,
+                         mapnik::image_any& image)
 {
     if (!image.is<mapnik::image_rgba8>())
     {
@@ -89,7 +94,6 @@ void preview_mvt_merc_custom(mapnik::vector_tile_impl::merc_tile const& mvt,
     }
 
     const mapnik::projection map_proj(map.srs(), true);
-    const mapnik::box2d<double> map_extent = mvt.extent();
     const mapnik::request m_req(image.width(), image.height(), map_extent);
     const mapnik::attributes vars;
     const double scale_denom = 0;
@@ -100,6 +104,33 @@ void preview_mvt_merc_custom(mapnik::vector_tile_impl::merc_tile const& mvt,
     mapnik::agg_renderer<mapnik::image_rgba8> ren(map, m_req, vars, image_data, scale_factor);
     ren.start_map_processing(map);
 
+    for (auto const& ds : datasources)
+    {
+        layer.set_datasource(ds);
+
+        std::set<std::string> names;
+        ren.apply_to_layer(layer,
+                           ren,
+                           map_proj,
+                           m_req.scale(),
+                           scale_denom,
+                           m_req.width(),
+                           m_req.height(),
+                           m_req.extent(),
+                           m_req.buffer_size(),
+                           names);
+    }
+
+    ren.end_map_processing(map);
+}
+
+void preview_mvt_merc_custom(mapnik::vector_tile_impl::merc_tile const& mvt,
+                             mapnik::Map const& map,
+                             mapnik::image_any& image)
+{
+    const mapnik::box2d<double> map_extent = mvt.extent();
+    std::vector<mapnik::datasource_ptr> datasources;
+
     for (std::size_t i = 0; i < mvt.get_layers().size(); i++)
     {
         protozero::pbf_reader layer_msg;
@@ -110,23 +141,11 @@ void preview_mvt_merc_custom(mapnik::vector_tile_impl::merc_tile const& mvt,
             ds_holder_type ds = std::make_shared<ds_type>(
                 layer_msg, mvt.x(), mvt.y(), mvt.z());
             ds->set_envelope(map_extent);
-            layer.set_datasource(ds);
-
-            std::set<std::string> names;
-            ren.apply_to_layer(layer,
-                               ren,
-                               map_proj,
-                               m_req.scale(),
-                               scale_denom,
-                               m_req.width(),
-                               m_req.height(),
-                               m_req.extent(),
-                               m_req.buffer_size(),
-                               names);
+            datasources.push_back(ds);
         }
     }
 
-    ren.end_map_processing(map);
+    preview_datasources(datasources, map_extent, map, image);
 }
 
 void preview_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
@@ -135,6 +154,25 @@ void preview_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
     preview_mvt_merc_custom(mvt, preview_map_.map, image);
 }
 
+void preview_decoded_custom(decoded_vector_tile const& tile,
+                            mapnik::Map const& map,
+                            mapnik::image_any& image)
+{
+    std::vector<mapnik::datasource_ptr> datasources;
+    for (auto const& name : tile.layer_names())
+    {
+        datasources.push_back(tile.datasource(name));
+    }
+
+    preview_datasources(datasources, tile.extent(), map, image);
+}
+
+void preview_decoded(decoded_vector_tile const& tile,
+                     mapnik::image_any& image)
+{
+    preview_decoded_custom(tile, preview_map_.map, image);
+}
+
 void export_mvt_preview()
 {
     using namespace boost::python;
@@ -149,5 +187,16 @@ void export_mvt_preview()
         (arg("tile"),
          arg("image")),
         "Render all geometries of a MVT");
+
+    def("preview_mvt_merc", &preview_decoded_custom,
+        (arg("tile"),
+         arg("map"),
+         arg("image")),
+        "Render all geometries of a DecodedVectorTile with custom style");
+
+    def("preview_mvt_merc", &preview_decoded,
+        (arg("tile"),
+         arg("image")),
+        "Render all geometries of a DecodedVectorTile");
 }
 
@@ -27,6 +27,11 @@
 #include <mapnik/image_any.hpp>
 #include <mapnik/agg_renderer.hpp>
 #include <mapnik/scale_denominator.hpp>
+#include <mapnik/image_util.hpp>
+#include <mapnik/memory_datasource.hpp>
+#include <mapnik/query.hpp>
+#include <mapnik/util/parallelize.hpp>
+#include <mapnik/value_error.hpp>
 
 #include <mapbox/mapnik-vector-tile/vector_tile_tile.hpp>
 #include <mapbox/mapnik-vector-tile/vector_tile_projection.hpp>
@@ -36,24 +41,31 @@
 #include <mapbox/mapnik-vector-tile/vector_tile_merc_tile.hpp>
 
 #include <boost/python.hpp>
+#include <boost/python/stl_iterator.hpp>
+
+#include <exception>
+#include <functional>
+#include <map>
+#include <set>
 
 #include "python_to_value.hpp"
+#include "mapnik_threads.hpp"
+#include "parallel_encoding.hpp"
+#include "mapnik_vector_tile_decoded.hpp"
+
+using mapnik::python_unblock_auto_block;
 
+// Returns a datasource of the MVT layer with given name, or nullptr.
+using mvt_datasource_factory = std::function<mapnik::datasource_ptr(std::string const&)>;
 
 bool set_mvt_datasource(mapnik::layer & lyr,
-                        mapnik::box2d<double> const& buffered_extent,
                         std::string const& map_srs,
-                        mapnik::vector_tile_impl::merc_tile const& tile)
+                        mvt_datasource_factory const& factory)
 {
-    protozero::pbf_reader layer_msg;
-    if (tile.layer_reader(lyr.name(), layer_msg))
+    mapnik::datasource_ptr ds = factory(lyr.name());
+    if (ds)
     {
         lyr.set_srs(map_srs);
-        using ds_type = mapnik::vector_tile_impl::tile_datasource_pbf;
-        using ds_holder_type = std::shared_ptr<ds_type>;
-        ds_holder_type ds = std::make_shared<ds_type>(
-            layer_msg, tile.x(), tile.y(), tile.z());
-        ds->set_envelope(buffered_extent);
         lyr.set_datasource(ds);
         return true;
     }
@@ -61,20 +73,18 @@ bool set_mvt_datasource(mapnik::layer & lyr,
 }
 
 void prepare_sublayers(mapnik::layer & lyr,
-                       mapnik::box2d<double> const& buffered_extent,
                        double scale_denom,
                        std::string const& map_srs,
-                       mapnik::vector_tile_impl::merc_tile const& tile)
+                       mvt_datasource_factory const& factory)
 {
     for (auto & sublyr : lyr.layers())
     {
         bool sublayer_used = sublyr.visible(scale_denom) &&
-            set_mvt_datasource(sublyr, buffered_extent, map_srs, tile);
+            set_mvt_datasource(sublyr, map_srs, factory);
         sublyr.set_active(sublayer_used);
         if (sublayer_used)
         {
-            prepare_sublayers(sublyr, buffered_extent,
-                              scale_denom, map_srs, tile);
+            prepare_sublayers(sublyr, scale_denom, map_srs, factory);
         }
     }
 }
@@ -86,19 +96,16 @@ void process_layers(Renderer & ren,
                     std::deque<mapnik::layer> const& layers,
                     double scale_denom,
                     std::string const& map_srs,
-                    mapnik::vector_tile_impl::merc_tile const& tile)
+                    mvt_datasource_factory const& factory)
 {
-    mapnik::box2d<double> buffered_extent = m_req.get_buffered_extent();
     for (auto const& lyr : layers)
     {
         if (lyr.visible(scale_denom))
         {
             mapnik::layer lyr_copy(lyr);
-            if (set_mvt_datasource(lyr_copy, buffered_extent, map_srs, tile))
+            if (set_mvt_datasource(lyr_copy, map_srs, factory))
             {
-                prepare_sublayers(lyr_copy, buffered_extent,
-                                  scale_denom, map_srs, tile);
-                protozero::pbf_reader layer_msg;
+                prepare_sublayers(lyr_copy, scale_denom, map_srs, factory);
                 std::set<std::string> names;
                 ren.apply_to_layer(lyr_copy,
                                    ren,
@@ -115,20 +122,15 @@ void process_layers(Renderer & ren,
     }
 }
 
-void render_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
-                     mapnik::Map const& map,
-                     mapnik::image_any& image,
-                     boost::python::dict const& vars_dict,
-                     double scale_factor,
-                     double scale_denominator,
-                     boost::optional<std::int32_t> buffer_size,
-                     boost::optional<std::uint64_t> const& x,
-                     boost::optional<std::uint64_t> const& y,
-                     boost::optional<std::uint64_t> const& z)
+mapnik::request mvt_request(mapnik::box2d<double> const& tile_extent,
+                            mapnik::Map const& map,
+                            mapnik::image_any const& image,
+                            boost::optional<std::int32_t> buffer_size,
+                            boost::optional<std::uint64_t> const& x,
+                            boost::optional<std::uint64_t> const& y,
+                            boost::optional<std::uint64_t> const& z)
 {
-    mapnik::projection map_proj(map.srs(), true);
-
-    mapnik::box2d<double> map_extent = mvt.extent();
+    mapnik::box2d<double> map_extent = tile_extent;
 
     if (x || y || z)
     {
@@ -137,6 +139,18 @@ void render_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
 
     mapnik::request m_req(image.width(), image.height(), map_extent);
     m_req.set_buffer_size(buffer_size ? *buffer_size : map.buffer_size());
+    return m_req;
+}
+
+void render_mvt_layers(mvt_datasource_factory const& factory,
+                       mapnik::Map const& map,
+                       mapnik::request const& m_req,
+                       mapnik::image_any& image,
+                       mapnik::attributes const& vars,
+                       double scale_factor,
+                       double scale_denominator)
+{
+    mapnik::projection map_proj(map.srs(), true);
 
     if (scale_factor <= 0.0)
     {
@@ -151,7 +165,6 @@ void render_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
     scale_denom *= scale_factor;
 
     std::deque<mapnik::layer> const& layers = map.layers();
-    mapnik::attributes vars = mapnik::dict2attr(vars_dict);
 
     if (image.is<mapnik::image_rgba8>())
     {
@@ -162,7 +175,7 @@ void render_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
                                                       image_data,
                                                       scale_factor);
         ren.start_map_processing(map);
-        process_layers(ren, m_req, map_proj, layers, scale_denom, map.srs(), mvt);
+        process_layers(ren, m_req, map_proj, layers, scale_denom, map.srs(), factory);
         ren.end_map_processing(map);
     }
     else
@@ -171,6 +184,284 @@ void render_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
     }
 }
 
+void render_mvt_merc(mapnik::vector_tile_impl::merc_tile const& mvt,
+                     mapnik::Map const& map,
+                     mapnik::image_any& image,
+                     boost::python::dict const& vars_dict,
+                     double scale_factor,
+                     double scale_denominator,
+                     boost::optional<std::int32_t> buffer_size,
+                     boost::optional<std::uint64_t> const& x,
+                     boost::optional<std::uint64_t> const& y,
+                     boost::optional<std::uint64_t> const& z)
+{
+    mapnik::request m_req = mvt_request(mvt.extent(), map, image, buffer_size, x, y, z);
+    mapnik::box2d<double> buffered_extent = m_req.get_buffered_extent();
+    mapnik::attributes vars = mapnik::dict2attr(vars_dict);
+
+    auto factory = [&](std::string const& name) -> mapnik::datasource_ptr
+    {
+        protozero::pbf_reader layer_msg;
+        if (!mvt.layer_reader(name, layer_msg))
+        {
+            return nullptr;
+        }
+        using ds_type = mapnik::vector_tile_impl::tile_datasource_pbf;
+        auto ds = std::make_shared<ds_type>(layer_msg, mvt.x(), mvt.y(), mvt.z());
+        ds->set_envelope(buffered_extent);
+        return ds;
+    };
+
+    render_mvt_layers(factory, map, m_req, image, vars,
+                      scale_factor, scale_denominator);
+}
+
+void render_mvt_merc_decoded(decoded_vector_tile const& tile,
+                             mapnik::Map const& map,
+                             mapnik::image_any& image,
+                             boost::python::dict const& vars_dict,
+                             double scale_factor,
+                             double scale_denominator,
+                             boost::optional<std::int32_t> buffer_size,
+                             boost::optional<std::uint64_t> const& x,
+                             boost::optional<std::uint64_t> const& y,
+                             boost::optional<std::uint64_t> const& z)
+{
+    mapnik::request m_req = mvt_request(tile.extent(), map, image, buffer_size, x, y, z);
+    mapnik::attributes vars = mapnik::dict2attr(vars_dict);
+
+    python_unblock_auto_block b;
+
+    auto factory = [&](std::string const& name)
+    {
+        return tile.datasource(name);
+    };
+
+    render_mvt_layers(factory, map, m_req, image, vars,
+                      scale_factor, scale_denominator);
+}
+
+void collect_layer_names(std::deque<mapnik::layer> const& layers,
+                         std::set<std::string> & names)
+{
+    for (auto const& lyr : layers)
+    {
+        names.insert(lyr.name());
+        collect_layer_names(lyr.layers(), names);
+    }
+}
+
+struct render_variant
+{
+    mapnik::image_any & image;
+    double scale_factor;
+    mapnik::request m_req;
+    // Empty if the image is not encoded
+    std::string format;
+    std::string encoded_img;
+    std::exception_ptr error;
+};
+
+struct render_variants_func
+{
+    std::vector<render_variant> & variants;
+    mvt_datasource_factory const& factory;
+    mapnik::Map const& map;
+    mapnik::attributes const& vars;
+    double scale_denominator;
+
+    void operator()(unsigned begin, unsigned end)
+    {
+        for (unsigned i = begin; i < end; ++i)
+        {
+            render_variant & variant = variants[i];
+            try
+            {
+                render_mvt_layers(factory, map, variant.m_req, variant.image,
+                                  vars, variant.scale_factor, scale_denominator);
+                if (!variant.format.empty())
+                {
+                    variant.encoded_img = mapnik::save_to_string(variant.image, variant.format);
+                }
+            }
+            catch (...)
+            {
+                variant.error = std::current_exception();
+            }
+        }
+    }
+};
+
+// Returns datasources of MVT layers for rendering the variants, called
+// without the GIL.
+using mvt_variants_datasources =
+    std::function<mvt_datasource_factory(std::vector<render_variant> const&)>;
+
+boost::python::object render_variants(
+    mapnik::box2d<double> const& tile_extent,
+    mvt_variants_datasources const& datasources,
+    mapnik::Map const& map,
+    boost::python::object const& targets,
+    boost::python::dict const& vars_dict,
+    double scale_denominator,
+    boost::optional<std::int32_t> buffer_size,
+    boost::optional<std::uint64_t> const& x,
+    boost::optional<std::uint64_t> const& y,
+    boost::optional<std::uint64_t> const& z,
+    boost::python::object const& format,
+    unsigned threads)
+{
+    using namespace boost::python;
+
+    std::string default_format = format.is_none() ? std::string() :
+        extract<std::string>(format)();
+    bool encode = false;
+    std::vector<render_variant> variants;
+    stl_input_iterator<object> it(targets), end;
+    for (; it != end; ++it)
+    {
+        object target = *it;
+        auto size = len(target);
+        if (size != 2 && size != 3)
+        {
+            throw mapnik::value_error("render_mvt_merc_variants expects (image, scale_factor[, format]) tuples");
+        }
+        mapnik::image_any & image = extract<mapnik::image_any &>(target[0]);
+        double scale_factor = extract<double>(target[1]);
+        std::string target_format = default_format;
+        if (size == 3 && !object(target[2]).is_none())
+        {
+            target_format = extract<std::string>(target[2]);
+        }
+        encode = encode || !target_format.empty();
+        variants.emplace_back(render_variant{
+            image,
+            scale_factor,
+            mvt_request(tile_extent, map, image, buffer_size, x, y, z),
+            target_format });
+    }
+
+    mapnik::attributes vars = mapnik::dict2attr(vars_dict);
+
+    {
+        python_unblock_auto_block b;
+        mvt_datasource_factory factory = datasources(variants);
+        render_variants_func func{ variants, factory, map, vars,
+                                   scale_denominator };
+        mapnik::util::parallelize(func,
+                                  jobs_by_chunks(variants.size(), threads),
+                                  variants.size());
+    }
+
+    for (auto const& variant : variants)
+    {
+        if (variant.error)
+        {
+            std::rethrow_exception(variant.error);
+        }
+    }
+
+    if (!encode)
+    {
+        return object();
+    }
+
+    list encoded;
+    for (auto & variant : variants)
+    {
+        if (variant.format.empty())
+        {
+            encoded.append(object());
+            continue;
+        }
+        encoded.append(object(handle<>(PyBytes_FromStringAndSize(
+            variant.encoded_img.data(), variant.encoded_img.size()))));
+        std::string().swap(variant.encoded_img);
+    }
+    return encoded;
+}
+
+boost::python::object render_mvt_merc_variants(
+    mapnik::vector_tile_impl::merc_tile const& mvt,
+    mapnik::Map const& map,
+    boost::python::object const& targets,
+    boost::python::dict const& vars_dict,
+    double scale_denominator,
+    boost::optional<std::int32_t> buffer_size,
+    boost::optional<std::uint64_t> const& x,
+    boost::optional<std::uint64_t> const& y,
+    boost::optional<std::uint64_t> const& z,
+    boost::python::object const& format,
+    unsigned threads)
+{
+    auto datasources = [&](std::vector<render_variant> const& variants) -> mvt_datasource_factory
+    {
+        // Layers are decoded once for the union of extents of all variants.
+        mapnik::box2d<double> extent;
+        for (auto const& variant : variants)
+        {
+            if (extent.valid())
+            {
+                extent.expand_to_include(variant.m_req.get_buffered_extent());
+            }
+            else
+            {
+                extent = variant.m_req.get_buffered_extent();
+            }
+        }
+
+        std::set<std::string> names;
+        collect_layer_names(map.layers(), names);
+        auto decoded = std::make_shared<std::map<std::string, mapnik::datasource_ptr>>();
+        if (!variants.empty())
+        {
+            for (auto const& name : names)
+            {
+                protozero::pbf_reader layer_msg;
+                if (mvt.layer_reader(name, layer_msg))
+                {
+                    decoded->emplace(name, decode_mvt_layer(
+                        layer_msg, mvt.x(), mvt.y(), mvt.z(), extent));
+                }
+            }
+        }
+
+        return [decoded](std::string const& name)
+        {
+            auto ds = decoded->find(name);
+            return ds == decoded->end() ? nullptr : ds->second;
+        };
+    };
+
+    return render_variants(mvt.extent(), datasources, map, targets, vars_dict,
+                           scale_denominator, buffer_size, x, y, z, format, threads);
+}
+
+boost::python::object render_mvt_merc_variants_decoded(
+    decoded_vector_tile const& tile,
+    mapnik::Map const& map,
+    boost::python::object const& targets,
+    boost::python::dict const& vars_dict,
+    double scale_denominator,
+    boost::optional<std::int32_t> buffer_size,
+    boost::optional<std::uint64_t> const& x,
+    boost::optional<std::uint64_t> const& y,
+    boost::optional<std::uint64_t> const& z,
+    boost::python::object const& format,
+    unsigned threads)
+{
+    auto datasources = [&](std::vector<render_variant> const&) -> mvt_datasource_factory
+    {
+        return [&tile](std::string const& name)
+        {
+            return tile.datasource(name);
+        };
+    };
+
+    return render_variants(tile.extent(), datasources, map, targets, vars_dict,
+                           scale_denominator, buffer_size, x, y, z, format, threads);
+}
+
 void export_mvt_render()
 {
     using namespace boost::python;
@@ -190,5 +481,56 @@ void export_mvt_render()
          arg("y") = boost::optional<std::uint64_t>(),
          arg("z") = boost::optional<std::uint64_t>()),
         "Render vector tile in Mercator to a surface/image");
+
+    def("render_mvt_merc", &render_mvt_merc_decoded,
+        (arg("tile"),
+         arg("map"),
+         arg("image"),
+         arg("variables") = boost::python::dict(),
+         arg("scale_factor") = 1.0,
+         arg("scale_denom") = 0.0,
+         arg("buffer_size") = boost::optional<std::int32_t>(),
+         arg("x") = boost::optional<std::uint64_t>(),
+         arg("y") = boost::optional<std::uint64_t>(),
+         arg("z") = boost::optional<std::uint64_t>()),
+        "Render DecodedVectorTile to a surface/image without the GIL");
+
+    def("render_mvt_merc_variants", &render_mvt_merc_variants,
+        (arg("tile"),
+         arg("map"),
+         // List of (image, scale_factor[, format]) tuples
+         arg("targets"),
+         arg("variables") = boost::python::dict(),
+         // Override auto-calculated scale denominator
+         arg("scale_denom") = 0.0,
+         // Override buffer_size from Map
+         arg("buffer_size") = boost::optional<std::int32_t>(),
+         // Override MVT coordinates
+         arg("x") = boost::optional<std::uint64_t>(),
+         arg("y") = boost::optional<std::uint64_t>(),
+         arg("z") = boost::optional<std::uint64_t>(),
+         // Format of targets without their own format. If any target is
+         // encoded, a list of bytes, or None for images not encoded, is returned.
+         arg("format") = boost::python::object(),
+         // Number of rendering threads, 0 means half of the CPU cores
+         arg("threads") = 0u),
+        "Render vector tile in Mercator to several images, e.g. of different\n"
+        "sizes, scale factors and formats. Layers are decoded only once.\n"
+        ">>> mapnik.render_mvt_merc_variants(tile, m, [(im, 1.0, 'png'), (im2x, 2.0, 'png'), (jpeg_im, 1.0, 'jpeg')])\n");
+
+    def("render_mvt_merc_variants", &render_mvt_merc_variants_decoded,
+        (arg("tile"),
+         arg("map"),
+         arg("targets"),
+         arg("variables") = boost::python::dict(),
+         arg("scale_denom") = 0.0,
+         arg("buffer_size") = boost::optional<std::int32_t>(),
+         arg("x") = boost::optional<std::uint64_t>(),
+         arg("y") = boost::optional<std::uint64_t>(),
+         arg("z") = boost::optional<std::uint64_t>(),
+         arg("format") = boost::python::object(),
+         arg("threads") = 0u),
+        "Render DecodedVectorTile to several images, layers are taken from\n"
+        "the tile and its cache of decoded layers.\n");
 }
 
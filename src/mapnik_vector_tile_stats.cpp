@@ -0,0 +1,285 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+
+#include <mapnik/config.hpp>
+#include <mapnik/util/parallelize.hpp>
+
+#include <mapbox/mapnik-vector-tile/vector_tile_compression.hpp>
+#include <protozero/pbf_reader.hpp>
+
+#include <boost/python.hpp>
+
+#include <cstdint>
+#include <exception>
+#include <string>
+#include <vector>
+
+#include "mapnik_threads.hpp"
+#include "mapnik_vector_tile_buffers.hpp"
+#include "parallel_encoding.hpp"
+
+using mapnik::python_unblock_auto_block;
+
+namespace {
+
+struct layer_stats
+{
+    std::string name;
+    std::uint32_t version = 1;
+    std::uint32_t extent = 4096;
+    std::size_t bytes = 0;
+    std::size_t features = 0;
+    // Features by geometry type, unknown, point, linestring and polygon.
+    std::size_t geom_types[4] = {0, 0, 0, 0};
+    std::size_t keys = 0;
+    std::size_t keys_bytes = 0;
+    std::size_t values = 0;
+    std::size_t values_bytes = 0;
+    std::size_t vertices = 0;
+};
+
+// Counts vertices of MoveTo and LineTo commands, coordinates are skipped.
+template <typename Iterator>
+std::size_t count_vertices(Iterator it, Iterator end)
+{
+    geometry_commands<Iterator> commands(it, end);
+    std::size_t vertices = 0;
+    std::uint32_t cmd;
+    std::uint32_t count;
+    while (commands.next(cmd, count))
+    {
+        if (cmd != commands.close_path)
+        {
+            commands.skip_vertices(count);
+            vertices += count;
+        }
+    }
+    return vertices;
+}
+
+void feature_stats(layer_stats & layer, protozero::pbf_reader feature_msg)
+{
+    std::uint32_t geom_type = 0;
+    while (feature_msg.next())
+    {
+        switch (feature_msg.tag())
+        {
+        case 3:
+            geom_type = feature_msg.get_enum();
+            break;
+        case 4:
+        {
+            auto geometry = feature_msg.get_packed_uint32();
+            layer.vertices += count_vertices(geometry.first, geometry.second);
+            break;
+        }
+        default:
+            feature_msg.skip();
+        }
+    }
+    ++layer.features;
+    ++layer.geom_types[geom_type < 4 ? geom_type : 0];
+}
+
+layer_stats get_layer_stats(char const* data, std::size_t size)
+{
+    layer_stats layer;
+    layer.bytes = size;
+    protozero::pbf_reader layer_msg(data, size);
+    while (layer_msg.next())
+    {
+        switch (layer_msg.tag())
+        {
+        case 1:
+            layer.name = layer_msg.get_string();
+            break;
+        case 2:
+            feature_stats(layer, layer_msg.get_message());
+            break;
+        case 3:
+            ++layer.keys;
+            layer.keys_bytes += layer_msg.get_data().second;
+            break;
+        case 4:
+            ++layer.values;
+            layer.values_bytes += layer_msg.get_data().second;
+            break;
+        case 5:
+            layer.extent = layer_msg.get_uint32();
+            break;
+        case 15:
+            layer.version = layer_msg.get_uint32();
+            break;
+        default:
+            layer_msg.skip();
+        }
+    }
+    return layer;
+}
+
+std::vector<layer_stats> get_tile_stats(char const* data, std::size_t size)
+{
+    std::string uncompressed;
+    if (mapnik::vector_tile_impl::is_zlib_compressed(data, size) ||
+        mapnik::vector_tile_impl::is_gzip_compressed(data, size))
+    {
+        mapnik::vector_tile_impl::zlib_decompress(data, size, uncompressed);
+        data = uncompressed.data();
+        size = uncompressed.size();
+    }
+
+    std::vector<layer_stats> layers;
+    protozero::pbf_reader tile_msg(data, size);
+    while (tile_msg.next(3))
+    {
+        auto layer = tile_msg.get_data();
+        layers.push_back(get_layer_stats(layer.first, layer.second));
+    }
+    return layers;
+}
+
+struct stats_chunk
+{
+    Py_buffer view;
+    std::vector<layer_stats> layers;
+    std::exception_ptr error;
+};
+
+using stats_chunks = buffer_chunks<stats_chunk>;
+
+struct stats_func
+{
+    stats_chunks & chunks;
+
+    void operator()(unsigned begin, unsigned end)
+    {
+        for (unsigned i = begin; i < end; ++i)
+        {
+            stats_chunk & chunk = chunks[i];
+            try
+            {
+                chunk.layers = get_tile_stats(
+                    static_cast<char const*>(chunk.view.buf),
+                    static_cast<std::size_t>(chunk.view.len));
+            }
+            catch (...)
+            {
+                chunk.error = std::current_exception();
+            }
+        }
+    }
+};
+
+boost::python::list stats_to_python(std::vector<layer_stats> const& layers)
+{
+    boost::python::list result;
+    for (auto const& layer : layers)
+    {
+        boost::python::dict stats;
+        stats["name"] = layer.name;
+        stats["version"] = layer.version;
+        stats["extent"] = layer.extent;
+        stats["bytes"] = layer.bytes;
+        stats["features"] = layer.features;
+        stats["unknown"] = layer.geom_types[0];
+        stats["points"] = layer.geom_types[1];
+        stats["linestrings"] = layer.geom_types[2];
+        stats["polygons"] = layer.geom_types[3];
+        stats["keys"] = layer.keys;
+        stats["keys_bytes"] = layer.keys_bytes;
+        stats["values"] = layer.values;
+        stats["values_bytes"] = layer.values_bytes;
+        stats["vertices"] = layer.vertices;
+        result.append(stats);
+    }
+    return result;
+}
+
+}
+
+boost::python::list mvt_stats(boost::python::object const& buffer)
+{
+    stats_chunks chunks;
+    chunks.append(buffer);
+    {
+        python_unblock_auto_block b;
+        stats_func func{chunks};
+        func(0, 1);
+    }
+    if (chunks[0].error)
+    {
+        std::rethrow_exception(chunks[0].error);
+    }
+    return stats_to_python(chunks[0].layers);
+}
+
+boost::python::list mvt_stats_many(boost::python::object const& buffers,
+                                   unsigned threads)
+{
+    stats_chunks chunks;
+    chunks.extend(buffers);
+    {
+        python_unblock_auto_block b;
+        stats_func func{chunks};
+        mapnik::util::parallelize(func,
+                                  jobs_by_chunks(chunks.size(), threads),
+                                  chunks.size());
+    }
+
+    for (auto const& chunk : chunks)
+    {
+        if (chunk.error)
+        {
+            std::rethrow_exception(chunk.error);
+        }
+    }
+    boost::python::list result;
+    for (auto const& chunk : chunks)
+    {
+        result.append(stats_to_python(chunk.layers));
+    }
+    return result;
+}
+
+void export_mvt_stats()
+{
+    using namespace boost::python;
+
+    def("mvt_stats", &mvt_stats,
+        (arg("buffer")),
+        "Returns statistics of MVT layers without decoding features.\n"
+        "The buffer can be compressed. Each layer is a dict of:\n"
+        "  name, version, extent\n"
+        "  bytes: size of the encoded layer\n"
+        "  features: number of features, also by geometry type in\n"
+        "    unknown, points, linestrings and polygons\n"
+        "  keys, values: sizes of the key and value tables, and\n"
+        "  keys_bytes, values_bytes: their encoded sizes\n"
+        "  vertices: number of vertices of all geometries\n"
+        ">>> max(mapnik.mvt_stats(buffer), key=lambda layer: layer['bytes'])\n");
+
+    def("mvt_stats_many", &mvt_stats_many,
+        (arg("buffers"),
+         // Maximum number of threads, 0 uses half of available cores.
+         arg("threads") = 0u),
+        "Returns mvt_stats() of each buffer, computed in parallel.\n");
+}
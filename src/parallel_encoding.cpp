@@ -21,6 +21,7 @@
  *****************************************************************************/
 
 #include <mapnik/config.hpp>
+#include "boost_std_shared_shim.hpp"
 
 #pragma GCC diagnostic push
 #include <mapnik/warning_ignore.hpp>
@@ -28,6 +29,7 @@
 #include <boost/python/module.hpp>
 #include <boost/python/def.hpp>
 #include <boost/python/stl_iterator.hpp>
+#include <boost/noncopyable.hpp>
 #pragma GCC diagnostic pop
 
 // mapnik
@@ -35,67 +37,538 @@
 #include <mapnik/image_view_any.hpp>
 #include <mapnik/util/parallelize.hpp>
 
-unsigned jobs_by_chunks(unsigned chunks, unsigned max_concurrency=0)
+// stl
+#include <cstdint>
+#include <cstring>
+#include <iterator>
+
+#include "parallel_encoding.hpp"
+#include "mapnik_image_buffer.hpp"
+#include "mapnik_threads.hpp"
+
+using mapnik::python_unblock_auto_block;
+
+unsigned jobs_by_chunks(unsigned chunks, unsigned max_concurrency)
 {
     unsigned max_jobs = max_concurrency ? max_concurrency :
         std::max(1u, std::thread::hardware_concurrency() / 2);
     return std::max(1u, std::min(chunks, max_jobs));
 }
 
-struct encoding_chunk
+std::unique_ptr<mapnik::rgba_palette> copy_palette(mapnik::rgba_palette const& pal)
 {
-    boost::python::object key;
-    mapnik::image_view_any const & img;
-    std::string encoded_img;
-};
+    // Python only creates palettes by make_palette().
+    python_palette const& source = static_cast<python_palette const&>(pal);
+    return std::unique_ptr<mapnik::rgba_palette>(
+        new mapnik::rgba_palette(source.source, source.source_type));
+}
+
+namespace {
+
+// The palette must not be used by other threads.
+std::string encode_image(mapnik::image_view_any const& img,
+                         std::string const& format,
+                         mapnik::rgba_palette const* palette)
+{
+    if (palette)
+    {
+        return mapnik::save_to_string(img, format, *palette);
+    }
+    return mapnik::save_to_string(img, format);
+}
+
+template <typename T>
+void append_bytes(std::string & key, T const& value)
+{
+    key.append(reinterpret_cast<char const*>(&value), sizeof(T));
+}
+
+// Key of images encoded identically, except for their pixels.
+std::string image_key(mapnik::image_view_any const& img,
+                      image_view_pixels const& pixels,
+                      std::string const& format)
+{
+    std::string key(format);
+    key += '\0';
+    append_bytes(key, static_cast<std::uint8_t>(img.get_dtype()));
+    append_bytes(key, static_cast<std::uint32_t>(img.width()));
+    append_bytes(key, static_cast<std::uint32_t>(img.height()));
+    append_bytes(key, pixels.premultiplied);
+    return key;
+}
+
+std::uint64_t hash_pixels(image_view_pixels const& pixels)
+{
+    // FNV-1a over words of rows
+    std::uint64_t hash = 14695981039346656037ULL;
+    std::uint64_t const prime = 1099511628211ULL;
+    for (std::size_t row = 0; row < pixels.height; ++row)
+    {
+        unsigned char const* data = pixels.data + row * pixels.row_stride;
+        std::size_t i = 0;
+        for (; i + 8 <= pixels.row_size; i += 8)
+        {
+            std::uint64_t word;
+            std::memcpy(&word, data + i, 8);
+            hash = (hash ^ word) * prime;
+            hash ^= hash >> 32;
+        }
+        for (; i < pixels.row_size; ++i)
+        {
+            hash = (hash ^ data[i]) * prime;
+        }
+    }
+    return hash;
+}
+
+bool same_pixels(image_view_pixels const& a, image_view_pixels const& b)
+{
+    if (a.row_size != b.row_size || a.height != b.height)
+    {
+        return false;
+    }
+    for (std::size_t row = 0; row < a.height; ++row)
+    {
+        if (std::memcmp(a.data + row * a.row_stride,
+                        b.data + row * b.row_stride, a.row_size) != 0)
+        {
+            return false;
+        }
+    }
+    return true;
+}
 
 struct encoding_func
 {
     std::vector<encoding_chunk> & chunks;
-    std::string const & format;
 
     void operator()(unsigned begin, unsigned end)
     {
+        // Every job encodes with its own copies of palettes.
+        std::map<mapnik::rgba_palette const*,
+                 std::unique_ptr<mapnik::rgba_palette>> palettes;
         for (unsigned i = begin; i < end; ++i)
         {
             encoding_chunk & chunk = chunks[i];
-            chunk.encoded_img = std::move(mapnik::save_to_string(chunk.img, format));
+            mapnik::rgba_palette const* palette = nullptr;
+            if (chunk.palette)
+            {
+                auto & copy = palettes[chunk.palette];
+                if (!copy)
+                {
+                    copy = copy_palette(*chunk.palette);
+                }
+                palette = copy.get();
+            }
+            chunk.encoded_img = encode_image(chunk.img, chunk.format, palette);
         }
     }
 };
 
-void encode_parallel(boost::python::dict & tiles, std::string const & format)
+struct chunk_signature
+{
+    // Key of solid images, empty for other images.
+    std::string solid_key;
+    // Key of other images with hash of their pixels.
+    std::string hash_key;
+};
+
+struct signature_func
+{
+    std::vector<encoding_chunk> const& chunks;
+    std::vector<chunk_signature> & signatures;
+    bool solid;
+    bool duplicates;
+
+    void operator()(unsigned begin, unsigned end)
+    {
+        for (unsigned i = begin; i < end; ++i)
+        {
+            encoding_chunk const& chunk = chunks[i];
+            chunk_signature & signature = signatures[i];
+            if (solid)
+            {
+                signature.solid_key = encoded_image_cache::solid_key(
+                    chunk.img, chunk.format, chunk.palette);
+            }
+            image_view_pixels pixels = get_view_pixels(chunk.img);
+            if (duplicates && signature.solid_key.empty() && pixels.data)
+            {
+                // Palettes are compared by identity within one call.
+                signature.hash_key = image_key(chunk.img, pixels, chunk.format);
+                append_bytes(signature.hash_key, chunk.palette);
+                append_bytes(signature.hash_key, hash_pixels(pixels));
+            }
+        }
+    }
+};
+
+}
+
+void encode_chunks(std::vector<encoding_chunk> & chunks,
+                   unsigned max_concurrency)
+{
+    unsigned jobs = jobs_by_chunks(chunks.size(), max_concurrency);
+
+    encoding_func enc_func{chunks};
+    mapnik::util::parallelize(enc_func, jobs, chunks.size());
+}
+
+std::vector<std::size_t> encode_chunks_dedup(std::vector<encoding_chunk> & chunks,
+                                             encoded_image_cache * cache,
+                                             bool duplicates,
+                                             unsigned max_concurrency,
+                                             std::vector<std::string> * solid_keys)
+{
+    if (solid_keys)
+    {
+        solid_keys->assign(chunks.size(), std::string());
+    }
+    std::vector<std::size_t> sources(chunks.size());
+    for (std::size_t i = 0; i < chunks.size(); ++i)
+    {
+        sources[i] = i;
+    }
+    if (!cache && !duplicates)
+    {
+        encode_chunks(chunks, max_concurrency);
+        return sources;
+    }
+
+    std::vector<chunk_signature> signatures(chunks.size());
+    signature_func sign_func{chunks, signatures, cache != nullptr, duplicates};
+    mapnik::util::parallelize(sign_func,
+                              jobs_by_chunks(chunks.size(), max_concurrency),
+                              chunks.size());
+
+    std::map<std::string, std::size_t> solid_sources;
+    std::map<std::string, std::vector<std::size_t>> hash_sources;
+    std::vector<encoding_chunk> pending;
+    std::vector<std::size_t> pending_indexes;
+    for (std::size_t i = 0; i < chunks.size(); ++i)
+    {
+        chunk_signature const& signature = signatures[i];
+        if (!signature.solid_key.empty())
+        {
+            auto inserted = solid_sources.emplace(signature.solid_key, i);
+            if (!inserted.second)
+            {
+                sources[i] = inserted.first->second;
+                continue;
+            }
+            if (solid_keys)
+            {
+                (*solid_keys)[i] = signature.solid_key;
+            }
+            if (cache->find(signature.solid_key, chunks[i].encoded_img))
+            {
+                continue;
+            }
+        }
+        else if (!signature.hash_key.empty())
+        {
+            // Hashes only select candidates, pixels are compared.
+            auto & candidates = hash_sources[signature.hash_key];
+            image_view_pixels pixels = get_view_pixels(chunks[i].img);
+            for (std::size_t j : candidates)
+            {
+                if (same_pixels(get_view_pixels(chunks[j].img), pixels))
+                {
+                    sources[i] = j;
+                    break;
+                }
+            }
+            if (sources[i] != i)
+            {
+                continue;
+            }
+            candidates.push_back(i);
+        }
+        pending.emplace_back(encoding_chunk{ chunks[i].img, chunks[i].format, chunks[i].palette });
+        pending_indexes.push_back(i);
+    }
+
+    encode_chunks(pending, max_concurrency);
+
+    for (std::size_t k = 0; k < pending.size(); ++k)
+    {
+        std::size_t const i = pending_indexes[k];
+        chunks[i].encoded_img = std::move(pending[k].encoded_img);
+        if (!signatures[i].solid_key.empty())
+        {
+            cache->insert(signatures[i].solid_key, chunks[i].encoded_img);
+        }
+    }
+    return sources;
+}
+
+encoded_image_cache::encoded_image_cache(std::size_t max_size)
+    : max_size_(max_size) {}
+
+std::string encoded_image_cache::solid_key(mapnik::image_view_any const& img,
+                                           std::string const& format,
+                                           mapnik::rgba_palette const* palette)
+{
+    image_view_pixels pixels = get_view_pixels(img);
+    if (!pixels.data || !mapnik::is_solid(img))
+    {
+        return std::string();
+    }
+    std::string key = image_key(img, pixels, format);
+    if (palette)
+    {
+        key += palette->to_string();
+    }
+    key += '\0';
+    key.append(reinterpret_cast<char const*>(pixels.data), pixels.row_size / img.width());
+    return key;
+}
+
+bool encoded_image_cache::find(std::string const& key, std::string & encoded_img)
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    auto it = images_.find(key);
+    if (it == images_.end())
+    {
+        ++misses_;
+        return false;
+    }
+    ++hits_;
+    lru_.splice(lru_.end(), lru_, it->second.second);
+    encoded_img = it->second.first;
+    return true;
+}
+
+bool encoded_image_cache::contains(std::string const& key) const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return images_.find(key) != images_.end();
+}
+
+void encoded_image_cache::insert(std::string const& key, std::string const& encoded_img)
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    auto it = images_.find(key);
+    if (it != images_.end())
+    {
+        it->second.first = encoded_img;
+        lru_.splice(lru_.end(), lru_, it->second.second);
+        return;
+    }
+    lru_.push_back(key);
+    images_.emplace(key, std::make_pair(encoded_img, std::prev(lru_.end())));
+    evict();
+}
+
+void encoded_image_cache::evict()
+{
+    while (images_.size() > max_size_)
+    {
+        images_.erase(lru_.front());
+        lru_.pop_front();
+    }
+}
+
+void encoded_image_cache::clear()
+{
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        images_.clear();
+        lru_.clear();
+    }
+    tile_keys_.clear();
+}
+
+boost::python::dict & encoded_image_cache::tile_keys()
+{
+    return tile_keys_;
+}
+
+std::size_t encoded_image_cache::max_size() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return max_size_;
+}
+
+void encoded_image_cache::set_max_size(std::size_t max_size)
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    max_size_ = max_size;
+    evict();
+}
+
+std::size_t encoded_image_cache::size() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return images_.size();
+}
+
+std::size_t encoded_image_cache::hits() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return hits_;
+}
+
+std::size_t encoded_image_cache::misses() const
+{
+    std::lock_guard<std::mutex> lock(mutex_);
+    return misses_;
+}
+
+std::string encode_cached(mapnik::image_view_any const& img,
+                          std::string const& format,
+                          mapnik::rgba_palette const* palette,
+                          encoded_image_cache & cache)
+{
+    std::string const key = encoded_image_cache::solid_key(img, format, palette);
+    std::string encoded_img;
+    if (!key.empty() && cache.find(key, encoded_img))
+    {
+        return encoded_img;
+    }
+    std::unique_ptr<mapnik::rgba_palette> copy;
+    if (palette)
+    {
+        copy = copy_palette(*palette);
+    }
+    encoded_img = encode_image(img, format, copy.get());
+    if (!key.empty())
+    {
+        cache.insert(key, encoded_img);
+    }
+    return encoded_img;
+}
+
+template <typename T>
+T const * value_for_key(boost::python::object const & values,
+                        boost::python::object const & key)
+{
+    using namespace boost::python;
+
+    if (values.is_none())
+    {
+        return nullptr;
+    }
+    extract<T const &> value(values);
+    if (value.check())
+    {
+        return &value();
+    }
+    // Per-key values
+    object item = values.attr("get")(key);
+    if (item.is_none())
+    {
+        return nullptr;
+    }
+    return &extract<T const &>(item)();
+}
+
+boost::python::dict encode_parallel(boost::python::dict & tiles,
+                                    boost::python::object const & format,
+                                    boost::python::object const & palette,
+                                    unsigned max_concurrency,
+                                    encoded_image_cache * cache,
+                                    bool duplicates)
 {
     using namespace boost::python;
 
+    std::vector<object> keys;
     std::vector<encoding_chunk> chunks;
 
+    extract<std::string> common_format(format);
+
     auto tiles_iterator = tiles.items();
     stl_input_iterator<tuple> it(tiles_iterator), end;
 
     for (; it != end; ++it)
     {
+        object key = (*it)[0];
         extract<mapnik::image_view_any const &> img((*it)[1]);
         if (img.check())
         {
-            chunks.emplace_back(encoding_chunk{ (*it)[0], img() });
+            std::string key_format = common_format.check() ?
+                common_format() : extract<std::string>(format[key])();
+            keys.emplace_back(key);
+            chunks.emplace_back(encoding_chunk{
+                img(),
+                key_format,
+                value_for_key<mapnik::rgba_palette>(palette, key) });
         }
     }
 
-    unsigned jobs = jobs_by_chunks(chunks.size());
+    std::vector<std::size_t> sources;
+    std::vector<std::string> solid_keys;
+    {
+        python_unblock_auto_block b;
+        sources = encode_chunks_dedup(chunks, cache, duplicates, max_concurrency,
+                                      &solid_keys);
+    }
 
-    encoding_func enc_func{chunks, format};
-    mapnik::util::parallelize(enc_func, jobs, chunks.size());
+    dict deduplicated;
+    std::vector<object> encoded(chunks.size());
+    std::vector<object> first_keys(keys);
+    for (std::size_t i = 0; i < chunks.size(); ++i)
+    {
+        if (sources[i] != i)
+        {
+            // Duplicates share bytes of the first identical image.
+            encoded[i] = encoded[sources[i]];
+            first_keys[i] = first_keys[sources[i]];
+            deduplicated[keys[i]] = first_keys[i];
+        }
+        else
+        {
+            if (!solid_keys[i].empty())
+            {
+                // Solid images of earlier calls map to their first tiles.
+                object solid_key(handle<>(PyBytes_FromStringAndSize(
+                    solid_keys[i].data(), solid_keys[i].size())));
+                dict & tile_keys = cache->tile_keys();
+                PyObject * first_key = PyDict_GetItem(tile_keys.ptr(), solid_key.ptr());
+                if (first_key)
+                {
+                    first_keys[i] = object(handle<>(borrowed(first_key)));
+                    if (first_keys[i] != keys[i])
+                    {
+                        deduplicated[keys[i]] = first_keys[i];
+                    }
+                }
+                else
+                {
+                    tile_keys[solid_key] = keys[i];
+                }
+            }
+            std::string & encoded_img = chunks[i].encoded_img;
+            encoded[i] = boost::python::object(
+                boost::python::handle<>(
+                    PyBytes_FromStringAndSize(
+                        encoded_img.data(),
+                        encoded_img.size())));
+            // Free every encoded image as soon as it is copied, so that
+            // only one of them is held twice at a time.
+            std::string().swap(encoded_img);
+        }
+        tiles[keys[i]] = encoded[i];
+    }
 
-    for (auto const & chunk : chunks)
+    // Tile keys of images dropped from the cache are forgotten.
+    if (cache && static_cast<std::size_t>(len(cache->tile_keys())) > cache->max_size())
     {
-        // TODO: move the data instead of copy, if possible
-        tiles[chunk.key] = boost::python::object(
-            boost::python::handle<>(
-                PyBytes_FromStringAndSize(
-                    chunk.encoded_img.data(),
-                    chunk.encoded_img.size())));
+        dict & tile_keys = cache->tile_keys();
+        list cached_keys(tile_keys.keys());
+        stl_input_iterator<object> key_it(cached_keys), key_end;
+        for (; key_it != key_end; ++key_it)
+        {
+            object solid_key = *key_it;
+            std::string const key(PyBytes_AS_STRING(solid_key.ptr()),
+                                  PyBytes_GET_SIZE(solid_key.ptr()));
+            if (!cache->contains(key))
+            {
+                tile_keys[solid_key].del();
+            }
+        }
     }
+    return deduplicated;
 }
 
 void export_encode_parallel()
@@ -104,7 +577,40 @@ void export_encode_parallel()
 
     def("encode_parallel", &encode_parallel,
         (arg("tiles"),
-         arg("format")
-         )
+         // Either a format for all tiles or a dict of formats by keys.
+         arg("format"),
+         // None, a Palette for all tiles or a dict of Palettes by keys.
+         arg("palette") = object(),
+         // Number of encoding threads, 0 means half of the CPU cores.
+         arg("max_concurrency") = 0u,
+         // EncodedImageCache of solid images
+         arg("cache") = object(),
+         // Encode images with identical pixels once.
+         arg("duplicates") = false
+         ),
+        "Encodes image views in the dict to bytes in parallel without the GIL.\n"
+        "Every thread encodes with its own copies of palettes.\n"
+        "With a cache, solid images are encoded once per color, size, format\n"
+        "and palette. With duplicates, other images with identical pixels are\n"
+        "found by hashing. Returns a dict of keys of deduplicated images, the\n"
+        "values are keys of the first images with identical pixels. With a\n"
+        "cache, solid images encoded by earlier calls map to the key of the\n"
+        "first tile of the same image, as long as the image is cached.\n"
+        ">>> cache = mapnik.EncodedImageCache()\n"
+        ">>> links = mapnik.encode_parallel(tiles, 'png8', cache=cache, duplicates=True)\n"
         );
+
+    class_<encoded_image_cache, std::shared_ptr<encoded_image_cache>, boost::noncopyable>(
+        "EncodedImageCache",
+        "Thread-safe cache of encoded solid images by their color, size,\n"
+        "format and palette, used by encode_parallel() and tostring().\n"
+        "At most max_size least recently used images are kept.\n",
+        init<std::size_t>((arg("max_size") = 256)))
+        .def("clear", &encoded_image_cache::clear)
+        .add_property("max_size", &encoded_image_cache::max_size,
+                      &encoded_image_cache::set_max_size)
+        .add_property("size", &encoded_image_cache::size)
+        .add_property("hits", &encoded_image_cache::hits)
+        .add_property("misses", &encoded_image_cache::misses)
+        ;
 }
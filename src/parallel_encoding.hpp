@@ -0,0 +1,130 @@
+/*****************************************************************************
+ *
+ * This file is part of Mapnik (c++ mapping toolkit)
+ *
+ * Copyright (C) 2015 Artem Pavlenko, Jean-Francois Doyon
+ *
+ * This library is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation; either
+ * version 2.1 of the License, or (at your option) any later version.
+ *
+ * This library is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public
+ * License along with this library; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+ *
+ *****************************************************************************/
+#ifndef MAPNIK_PARALLEL_ENCODING_HPP
+#define MAPNIK_PARALLEL_ENCODING_HPP
+
+// boost
+#include <boost/python.hpp>
+
+// mapnik
+#include <mapnik/image_view_any.hpp>
+#include <mapnik/palette.hpp>
+
+// stl
+#include <cstddef>
+#include <list>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <vector>
+
+unsigned jobs_by_chunks(unsigned chunks, unsigned max_concurrency=0);
+
+struct encoding_chunk
+{
+    mapnik::image_view_any const & img;
+    std::string format;
+    mapnik::rgba_palette const * palette;
+    std::string encoded_img;
+};
+
+// Palettes created by mapnik.Palette() keep their source, so that they
+// can be copied. Quantization caches colors inside of the palette, so
+// threads encode with their own copies.
+struct python_palette : mapnik::rgba_palette
+{
+    python_palette(std::string const& pal, palette_type type)
+        : mapnik::rgba_palette(pal, type), source(pal), source_type(type) {}
+
+    std::string const source;
+    palette_type const source_type;
+};
+
+// Returns a new copy of a palette created by mapnik.Palette().
+std::unique_ptr<mapnik::rgba_palette> copy_palette(mapnik::rgba_palette const& pal);
+
+// Encodes all chunks on worker threads. It does not touch any Python
+// objects, so it can be called with the GIL released.
+void encode_chunks(std::vector<encoding_chunk> & chunks,
+                   unsigned max_concurrency=0);
+
+// Encoded solid images by their pixel, size, format and palette.
+// Thread-safe, the least recently used images are dropped when more
+// than max_size of them are cached.
+class encoded_image_cache
+{
+public:
+    explicit encoded_image_cache(std::size_t max_size);
+
+    // Returns the key of a solid image, empty for other images.
+    static std::string solid_key(mapnik::image_view_any const& img,
+                                 std::string const& format,
+                                 mapnik::rgba_palette const* palette);
+
+    bool find(std::string const& key, std::string & encoded_img);
+    bool contains(std::string const& key) const;
+    void insert(std::string const& key, std::string const& encoded_img);
+    void clear();
+
+    // Keys of the first tiles of solid images by their keys, kept by
+    // encode_parallel(). Only used with the GIL held.
+    boost::python::dict & tile_keys();
+
+    std::size_t max_size() const;
+    void set_max_size(std::size_t max_size);
+    std::size_t size() const;
+    std::size_t hits() const;
+    std::size_t misses() const;
+
+private:
+    void evict();
+
+    mutable std::mutex mutex_;
+    std::list<std::string> lru_;
+    std::map<std::string, std::pair<std::string, std::list<std::string>::iterator>> images_;
+    std::size_t max_size_;
+    std::size_t hits_ = 0;
+    std::size_t misses_ = 0;
+    boost::python::dict tile_keys_;
+};
+
+// Encodes an image, a solid image is taken from and added to the cache.
+std::string encode_cached(mapnik::image_view_any const& img,
+                          std::string const& format,
+                          mapnik::rgba_palette const* palette,
+                          encoded_image_cache & cache);
+
+// Encodes chunks like encode_chunks(), solid images are taken from and
+// added to the cache if it is not null. With duplicates, images with
+// pixels identical to an earlier chunk of the same format and palette
+// are found by hashes and encoded once. Returns for every chunk the
+// index of the chunk holding its encoded image, chunks with encoded
+// images of other chunks are left empty. If solid_keys is not null, it
+// gets the keys of solid images with a cache, empty keys for other images.
+std::vector<std::size_t> encode_chunks_dedup(std::vector<encoding_chunk> & chunks,
+                                             encoded_image_cache * cache,
+                                             bool duplicates,
+                                             unsigned max_concurrency=0,
+                                             std::vector<std::string> * solid_keys=nullptr);
+
+#endif // MAPNIK_PARALLEL_ENCODING_HPP
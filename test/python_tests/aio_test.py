@@ -0,0 +1,97 @@
+import asyncio
+import gc
+import os
+import weakref
+
+from nose.tools import eq_
+
+import mapnik
+from mapnik import aio
+
+from .utilities import execution_path, run_all
+
+
+def setup():
+    # All of the paths used are relative, if we run the tests
+    # from another directory we need to chdir()
+    os.chdir(execution_path('.'))
+
+
+def test_render_and_encode():
+    async def run():
+        m = mapnik.Map(256, 256)
+        await aio.load_map(m, 'styles/rule_level_filter_style.xml')
+        m.background = mapnik.Color('green')
+        m.zoom_all()
+        im = mapnik.Image(m.width, m.height)
+        await aio.render(m, im)
+        return im, await aio.tostring(im, 'png32')
+    im, encoded = asyncio.run(run())
+    eq_(encoded, im.tostring('png32'))
+
+
+def test_create_mvt_merc():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    expected = mapnik.create_mvt_merc(m, 2048, 2047, 12)
+
+    async def run():
+        return await asyncio.gather(
+            *[aio.create_mvt_merc(m, 2048, 2047, 12) for _ in range(4)])
+    for mvt_buffer in asyncio.run(run()):
+        eq_(mvt_buffer, expected)
+
+
+def test_map_concurrency():
+    pool = aio.Pool(max_workers=4)
+    m = mapnik.Map(256, 256)
+    pool.set_map_concurrency(m, 1)
+    running = []
+    peak = []
+
+    def call():
+        running.append(1)
+        peak.append(len(running))
+        mapnik.render(m, mapnik.Image(256, 256))
+        running.pop()
+
+    async def run():
+        await asyncio.gather(*[pool.run(call, map=m) for _ in range(4)])
+    asyncio.run(run())
+    pool.shutdown()
+    eq_(max(peak), 1)
+
+
+def test_map_semaphores_are_released():
+    pool = aio.Pool(max_workers=2, map_concurrency=2)
+    m = mapnik.Map(256, 256)
+    finalizers = []
+    finalize = weakref.finalize
+
+    def counted_finalize(*args):
+        finalizers.append(args)
+        return finalize(*args)
+    weakref.finalize = counted_finalize
+    try:
+        for limit in [1, 2, 3]:
+            pool.set_map_concurrency(m, limit)
+    finally:
+        weakref.finalize = finalize
+    eq_(len(finalizers), 1)
+
+    async def run():
+        await pool.run(len, [], map=m)
+    for _ in range(3):
+        asyncio.run(run())
+    gc.collect()
+    # semaphores of closed loops are dropped
+    eq_(len(pool._map_limits[id(m)][1]), 0)
+    del m
+    gc.collect()
+    eq_(pool._map_limits, {})
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    setup()
+    exit(run_all(eval(x) for x in dir() if x.startswith("test_")))
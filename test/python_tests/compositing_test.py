@@ -1,6 +1,8 @@
 import os
+import struct
+import threading
 
-from nose.tools import eq_
+from nose.tools import eq_, raises
 
 import mapnik
 
@@ -286,6 +288,160 @@ def test_background_image_with_alpha_and_background_color_against_composited_con
     #raise Todo("looks like we need to investigate PNG color rounding when saving")
     # eq_(get_unique_colors(im),get_unique_colors(im1))
 
+def make_layer(width, height, color):
+    im = mapnik.Image(width, height)
+    im.fill(mapnik.Color(color))
+    for y in range(0, height, 7):
+        im.set_pixel(y % width, y, mapnik.Color('rgba(0,128,255,.25)'))
+    return im
+
+
+def pixel_bytes(value):
+    return struct.pack('<I', value)
+
+
+def color_bytes(color):
+    return pixel_bytes(mapnik.Color(color).packed())
+
+
+def banded_image(width, bands):
+    # bands of (rows, color) from top to bottom
+    data = b''.join(color_bytes(color) * width * rows for rows, color in bands)
+    return mapnik.Image.from_array(bytearray(data), width=width,
+                                   height=sum(rows for rows, _ in bands))
+
+
+def composited_pixel(dst_color, src_color, mode, opacity):
+    dst = mapnik.Image(1, 1)
+    dst.fill(mapnik.Color(dst_color))
+    src = mapnik.Image(1, 1)
+    src.fill(mapnik.Color(src_color))
+    dst.composite(src, mode, opacity)
+    return pixel_bytes(dst.get_pixel(0, 0))
+
+
+def expected_composite(width, height, dst_color, bands, src_width, mode, opacity, dx, dy):
+    # Composites whole rows of solid colors one pixel at a time
+    background = color_bytes(dst_color)
+    rows = []
+    for rows_count, color in bands:
+        rows.extend([composited_pixel(dst_color, color, mode, opacity)] * rows_count)
+    x0 = min(max(dx, 0), width)
+    x1 = min(max(dx + src_width, 0), width)
+    data = []
+    for y in range(height):
+        if 0 <= y - dy < len(rows):
+            pixel = rows[y - dy]
+            data.append(background * x0 + pixel * (x1 - x0) + background * (width - x1))
+        else:
+            data.append(background * width)
+    return b''.join(data)
+
+
+BANDS = [(100, 'rgba(255,0,0,.5)'), (150, 'rgba(0,255,0,.75)'), (150, 'rgba(0,0,255,.25)')]
+
+
+def test_composite_stripes():
+    # Tall enough for several stripes of rows
+    for mode, opacity, dx, dy in [(mapnik.CompositeOp.multiply, 0.5, 20, 150),
+                                  (mapnik.CompositeOp.src_over, 1.0, -100, -250),
+                                  (mapnik.CompositeOp.src, 1.0, 300, -30)]:
+        dst = banded_image(512, [(600, 'rgba(255,255,255,.5)')])
+        src = banded_image(300, BANDS)
+        source = src.tostring()
+        dst.composite(src, mode, opacity, dx, dy, threads=4)
+        eq_(dst.tostring(), expected_composite(512, 600, 'rgba(255,255,255,.5)', BANDS,
+                                               300, mode, opacity, dx, dy))
+        eq_(dst.premultiplied(), False)
+        eq_(src.premultiplied(), False)
+        eq_(src.tostring(), source)
+
+
+def test_composite_shared_source():
+    src = banded_image(300, BANDS)
+    source = src.tostring()
+    expected = expected_composite(512, 600, 'rgba(255,255,255,.5)', BANDS, 300,
+                                  mapnik.CompositeOp.src_over, 0.8, 100, 50)
+    results = []
+    encoded = []
+
+    def composite():
+        for _ in range(5):
+            dst = banded_image(512, [(600, 'rgba(255,255,255,.5)')])
+            dst.composite(src, mapnik.CompositeOp.src_over, 0.8, 100, 50, threads=2)
+            results.append(dst.tostring())
+
+    def encode():
+        for _ in range(5):
+            encoded.append(src.tostring())
+
+    threads = [threading.Thread(target=composite) for _ in range(4)]
+    threads.append(threading.Thread(target=encode))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    eq_(len(results), 20)
+    for result in results:
+        eq_(result, expected)
+    for data in encoded:
+        eq_(data, source)
+    eq_(src.premultiplied(), False)
+
+
+def test_composite_onto_itself():
+    im = banded_image(300, BANDS)
+    expected = banded_image(300, BANDS)
+    expected.composite(banded_image(300, BANDS), mapnik.CompositeOp.src_over, 1.0, 0, 120)
+    im.composite(im, mapnik.CompositeOp.src_over, 1.0, 0, 120, threads=4)
+    eq_(im.tostring(), expected.tostring())
+
+
+def test_composite_keep_premultiplied():
+    dst = make_layer(256, 256, 'rgba(255,255,255,.5)')
+    expected = make_layer(256, 256, 'rgba(255,255,255,.5)')
+    layers = [make_layer(256, 256, 'rgba(0,255,0,.25)'),
+              make_layer(128, 128, 'rgba(0,0,255,.75)')]
+    for layer in layers:
+        expected.composite(layer)
+        dst.composite(layer, demultiply=False)
+        eq_(dst.premultiplied(), True)
+        eq_(layer.premultiplied(), False)
+    eq_(dst.demultiply(), True)
+    eq_(dst.tostring(), expected.tostring())
+
+
+def test_composite_many():
+    hillshade = make_layer(512, 512, 'rgba(128,128,128,.5)')
+    landcover = make_layer(256, 512, 'rgba(0,255,0,.5)')
+    labels = make_layer(64, 64, 'rgba(0,0,0,1)')
+    expected = make_layer(512, 512, 'white')
+    expected.composite(hillshade, mapnik.CompositeOp.multiply, 0.5)
+    expected.composite(landcover, mapnik.CompositeOp.src_over, 0.8, 128, -32)
+    expected.composite(labels, mapnik.CompositeOp.src_over, 1.0, 300, 400)
+    expected.composite(labels)
+
+    dst = make_layer(512, 512, 'white')
+    mapnik.composite_many(dst, [
+        (hillshade, mapnik.CompositeOp.multiply, 0.5),
+        (landcover, mapnik.CompositeOp.src_over, 0.8, 128, -32),
+        (labels, mapnik.CompositeOp.src_over, 1.0, 300, 400),
+        (labels,),
+    ], threads=4)
+    eq_(dst.tostring(), expected.tostring())
+    eq_(dst.premultiplied(), False)
+    eq_(labels.premultiplied(), False)
+
+    dst = make_layer(512, 512, 'white')
+    mapnik.composite_many(dst, iter([(hillshade, mapnik.CompositeOp.multiply, 0.5)]), demultiply=False)
+    eq_(dst.premultiplied(), True)
+
+
+@raises(ValueError)
+def test_composite_many_invalid_layer():
+    mapnik.composite_many(mapnik.Image(16, 16), [()])
+
+
 if __name__ == "__main__":
     setup()
     exit(run_all(eval(x) for x in dir() if x.startswith("test_")))
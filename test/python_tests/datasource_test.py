@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 from itertools import groupby
 
 from nose.tools import eq_, raises
@@ -18,6 +19,50 @@ def test_that_datasources_exist():
     if len(mapnik.DatasourceCache.plugin_names()) == 0:
         print('***NOTICE*** - no datasource plugins have been loaded')
 
+
+def test_lazy_plugins_are_listed():
+    from mapnik.paths import inputpluginspath
+    files = [f[:-len('.input')] for f in os.listdir(inputpluginspath)
+             if f.endswith('.input')]
+    names = mapnik.DatasourceCache.plugin_names()
+    for name in files:
+        eq_(name in names, True)
+
+
+if 'csv' in mapnik.DatasourceCache.plugin_names():
+
+    def test_lazy_plugin_loaded_by_create():
+        ds = mapnik.DatasourceCache.create({
+            'type': 'csv',
+            'inline': 'x,y\n1,2\n'})
+        eq_(ds.describe()['type'], mapnik.DataType.Vector)
+
+    def test_lazy_plugin_loaded_by_load_map():
+        m = mapnik.Map(256, 256)
+        mapnik.load_map(m, 'styles/rule_level_filter_style.xml', True)
+        eq_(m.layers[0].datasource.params()['type'], 'csv')
+
+    def test_lazy_plugin_loaded_by_concurrent_creates():
+        if 'geojson' in mapnik.DatasourceCache.plugin_names():
+            params = {'type': 'geojson',
+                      'inline': '{"type":"FeatureCollection","features":[]}'}
+        else:
+            params = {'type': 'csv', 'inline': 'x,y\n1,2\n'}
+        errors = []
+
+        def create():
+            try:
+                mapnik.DatasourceCache.create(params)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(errors, [])
+
 # adapted from raster_symboliser_test#test_dataraster_query_point
 
 
@@ -1,4 +1,7 @@
+import json
 import os
+import shutil
+import tempfile
 
 from nose.tools import eq_
 
@@ -20,6 +23,99 @@ def test_loading_fontset_from_map():
     eq_(len(fs.names), 2)
     eq_(list(fs.names), ['DejaVu Sans Book', 'DejaVu Sans Oblique'])
 
+def copy_font(font_dir):
+    """
+    Copy a font of the fonts collection, return its path and face names.
+    """
+    from mapnik.paths import fontscollectionpath
+    mapping = mapnik.FontEngine.face_mapping()
+    for name in sorted(os.listdir(fontscollectionpath)):
+        source = os.path.join(fontscollectionpath, name)
+        faces = [face for face, (_, filename) in mapping.items()
+                 if filename == source]
+        if name.lower().endswith('.ttf') and faces:
+            font = os.path.join(font_dir, name)
+            shutil.copy(source, font)
+            return font, faces
+    return None, []
+
+def test_font_index():
+    from mapnik.paths import fontscollectionpath
+    font_dir = fontscollectionpath
+    tmp = tempfile.mkdtemp()
+    try:
+        index_path = os.path.join(tmp, 'fonts.json')
+        os.environ['MAPNIK_FONT_INDEX'] = index_path
+        eq_(mapnik.font_index_path(font_dir), index_path)
+
+        # Without an index all fonts are registered and nothing is written
+        mapnik.register_fonts(font_dir)
+        eq_(os.path.exists(index_path), False)
+        eq_(mapnik._lazy_font_files, {})
+
+        eq_(mapnik.build_font_index(font_dir), index_path)
+        with open(index_path) as f:
+            index = json.load(f)
+        mapping = mapnik.FontEngine.face_mapping()
+        for name, filename in index['faces']:
+            eq_(mapping[name][1], filename)
+        if not index['faces']:
+            return
+
+        # With an index files are registered when maps use their faces
+        mapnik.register_fonts(font_dir)
+        eq_(sorted(mapnik._lazy_font_files), sorted(index['files']))
+        name, filename = index['faces'][0]
+        m = mapnik.Map(256, 256)
+        mapnik.load_map_from_string(m, """<Map>
+            <FontSet name="indexed"><Font face-name="%s"/></FontSet>
+        </Map>""" % name)
+        eq_(filename in mapnik._lazy_font_files, False)
+        eq_(list(m.find_fontset('indexed').names), [name])
+    finally:
+        os.environ.pop('MAPNIK_FONT_INDEX', None)
+        mapnik._lazy_font_files.clear()
+        mapnik._lazy_faces.clear()
+        shutil.rmtree(tmp)
+
+def test_font_index_file_replaced():
+    tmp = tempfile.mkdtemp()
+    try:
+        font_dir = os.path.join(tmp, 'fonts')
+        os.mkdir(font_dir)
+        font, faces = copy_font(font_dir)
+        if not font:
+            return
+        index_path = os.path.join(tmp, 'fonts.json')
+        extensions = ['.ttf']
+        mapnik.build_font_index(font_dir, extensions, index_path)
+        # Faces of the copy are mapped to the original file, which was
+        # registered first, so they are added to the index here.
+        with open(index_path) as f:
+            index = json.load(f)
+        index['faces'] = [[face, font] for face in faces]
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+        eq_(mapnik._load_font_index(index_path, font_dir, extensions) is None, False)
+        os.environ['MAPNIK_FONT_INDEX'] = index_path
+        mapnik.register_fonts(font_dir, extensions)
+        eq_(font in mapnik._lazy_font_files, True)
+        # Rewriting a file in place keeps the directory mtime, the file
+        # is detected when its faces are registered
+        st = os.stat(font_dir)
+        with open(font, 'ab') as f:
+            f.write(b'\0')
+        os.utime(font_dir, ns=(st.st_atime_ns, st.st_mtime_ns))
+        eq_(mapnik._load_font_index(index_path, font_dir, extensions) is None, False)
+        fs = mapnik.FontSet('indexed')
+        fs.add_face_name(faces[0])
+        eq_(mapnik._lazy_font_files, {})
+    finally:
+        os.environ.pop('MAPNIK_FONT_INDEX', None)
+        mapnik._lazy_font_files.clear()
+        mapnik._lazy_faces.clear()
+        shutil.rmtree(tmp)
+
 # def test_loading_fontset_from_python():
 #     m = mapnik.Map(256,256)
 #     fset = mapnik.FontSet('foo')
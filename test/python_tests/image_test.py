@@ -379,6 +379,31 @@ def test_image_open_from_string():
     eq_(len(mapnik.Image.frombuffer(memoryview(im1.tostring('tiff'))).tostring()), length)
 
 
+def test_image_frombuffer_invalid():
+    try:
+        mapnik.Image.frombuffer(object())
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('frombuffer accepted an object without buffer')
+
+
+def test_encode_from_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    im = mapnik.Image(512, 512)
+    im.fill(mapnik.Color('rgba(1,2,3,.5)'))
+    expected = im.tostring('png')
+    with ThreadPoolExecutor(4) as executor:
+        encoded = list(executor.map(
+            lambda view: view.tostring('png'),
+            [im.view(0, 0, 512, 512) for _ in range(8)]))
+        decoded = list(executor.map(mapnik.Image.fromstring, encoded))
+    for buf in encoded:
+        eq_(buf, expected)
+    for im2 in decoded:
+        eq_(im2.tostring(), im.tostring())
+
+
 def test_image_from_svg():
     filepath = 'data/tile0.expected-svg.svg'
     with open(filepath) as f:
@@ -389,6 +414,186 @@ def test_image_from_svg():
     eq_(len(im_buff), 17571)
 
 
+def test_image_buffer():
+    im = mapnik.Image(4, 3)
+    buf = memoryview(im)
+    eq_(buf.format, 'B')
+    eq_(buf.shape, (3, 4, 4))
+    eq_(buf.strides, (16, 4, 1))
+    eq_(buf.readonly, False)
+    eq_(buf.tobytes(), im.tostring())
+    # Pixels are shared with the image
+    buf[1, 2, 0] = 255
+    buf[1, 2, 3] = 128
+    c = im.get_pixel(2, 1, True)
+    eq_((c.r, c.g, c.b, c.a), (255, 0, 0, 128))
+    im.set_pixel(0, 2, mapnik.Color(1, 2, 3, 4))
+    eq_(buf.tolist()[2][0], [1, 2, 3, 4])
+
+
+def test_image_buffer_types():
+    types = [
+        (mapnik.ImageType.gray8, 'B', 1),
+        (mapnik.ImageType.gray8s, 'b', 1),
+        (mapnik.ImageType.gray16, 'H', 2),
+        (mapnik.ImageType.gray16s, 'h', 2),
+        (mapnik.ImageType.gray32, 'I', 4),
+        (mapnik.ImageType.gray32s, 'i', 4),
+        (mapnik.ImageType.gray32f, 'f', 4),
+        (mapnik.ImageType.gray64, 'Q', 8),
+        (mapnik.ImageType.gray64s, 'q', 8),
+        (mapnik.ImageType.gray64f, 'd', 8),
+    ]
+    for dtype, fmt, itemsize in types:
+        im = mapnik.Image(5, 2, dtype)
+        buf = memoryview(im)
+        eq_(buf.format, fmt)
+        eq_(buf.itemsize, itemsize)
+        eq_(buf.shape, (2, 5))
+        eq_(buf.strides, (5 * itemsize, itemsize))
+        buf[1, 3] = 7
+        eq_(im.get_pixel(3, 1), 7)
+
+
+def test_image_view_buffer():
+    im = mapnik.Image(4, 4)
+    im.set_pixel(2, 1, mapnik.Color(1, 2, 3, 4))
+    view = im.view(1, 1, 2, 3)
+    buf = memoryview(view)
+    eq_(buf.readonly, True)
+    eq_(buf.shape, (3, 2, 4))
+    eq_(buf.strides, (16, 4, 1))
+    eq_(buf.contiguous, False)
+    eq_(buf.tolist()[0][1], [1, 2, 3, 4])
+    eq_(buf.tobytes(), view.tostring())
+    eq_(bytes(view), view.tostring())
+    del im
+    # The view keeps the image alive
+    eq_(buf.tolist()[0][1], [1, 2, 3, 4])
+
+
+@raises(BufferError)
+def test_image_view_buffer_not_contiguous():
+    import hashlib
+    im = mapnik.Image(4, 4)
+    # Consumers of plain bytes can not use strided rows
+    hashlib.sha1(im.view(1, 1, 2, 2))
+
+
+def test_image_from_array():
+    data = bytearray(b'\x01\x02\x03\x04' * 6)
+    im = mapnik.Image.from_array(data, width=3, height=2)
+    eq_(im.width(), 3)
+    eq_(im.height(), 2)
+    eq_(im.get_type(), mapnik.ImageType.rgba8)
+    eq_(im.tostring(), bytes(data))
+    # Pixels are shared with the buffer
+    data[0] = 9
+    eq_(im.get_pixel(0, 0, True).r, 9)
+    im.fill(mapnik.Color(5, 6, 7, 8))
+    eq_(data[20:], bytearray(b'\x05\x06\x07\x08'))
+
+
+def test_image_from_array_shape():
+    import array
+    values = array.array('f', range(6))
+    buf = memoryview(values).cast('B').cast('f', (2, 3))
+    im = mapnik.Image.from_array(buf, mapnik.ImageType.gray32f)
+    eq_(im.width(), 3)
+    eq_(im.height(), 2)
+    eq_(im.get_pixel(2, 1), 5.0)
+    im.set_pixel(0, 0, 42.0)
+    eq_(values[0], 42.0)
+
+
+def test_image_from_image():
+    im = mapnik.Image(4, 3, mapnik.ImageType.rgba8, True, True)
+    im2 = mapnik.Image.from_array(im, premultiplied=True)
+    eq_(im2.premultiplied(), True)
+    im2.set_pixel(1, 2, mapnik.Color(1, 2, 3, 4))
+    eq_(im2.tostring(), im.tostring())
+    del im
+    eq_(im2.get_pixel(1, 2, True).a, 4)
+
+
+def test_image_from_array_copies():
+    im = mapnik.Image(4, 4)
+    im.fill(mapnik.Color(1, 2, 3, 4))
+    view = im.view(1, 1, 2, 3)
+    # Strided rows are copied
+    im2 = mapnik.Image.from_array(view)
+    eq_(im2.width(), 2)
+    eq_(im2.height(), 3)
+    eq_(im2.tostring(), view.tostring())
+    im2.fill(mapnik.Color(0, 0, 0, 0))
+    eq_(im.get_pixel(1, 1, True).a, 4)
+    # Read-only buffers are copied
+    data = b'\x00\x01' * 4
+    im3 = mapnik.Image.from_array(data, mapnik.ImageType.gray16, width=2, height=2)
+    eq_(im3.get_pixel(1, 1), 256)
+    im3.fill(0)
+    eq_(data, b'\x00\x01' * 4)
+
+
+@raises(ValueError)
+def test_image_from_array_format_mismatch():
+    import array
+    buf = memoryview(array.array('f', range(6))).cast('B').cast('f', (2, 3))
+    mapnik.Image.from_array(buf, mapnik.ImageType.gray8)
+
+
+@raises(ValueError)
+def test_image_from_array_size_mismatch():
+    mapnik.Image.from_array(bytearray(10), width=2, height=2)
+
+
+def test_image_pool():
+    pool = mapnik.ImagePool(2)
+    im = pool.acquire(16, 8)
+    eq_((im.width(), im.height()), (16, 8))
+    eq_(im.get_type(), mapnik.ImageType.rgba8)
+    eq_((pool.hits, pool.misses), (0, 1))
+    im.fill(mapnik.Color('red'))
+    pool.release(im)
+    del im
+    eq_(pool.idle, 1)
+    im = pool.acquire(16, 8)
+    eq_((pool.hits, pool.misses), (1, 1))
+    eq_(im.is_solid(), True)
+    eq_(im.get_pixel(0, 0), 0)
+    eq_(im.painted(), False)
+    # Images in use are not handed out
+    im2 = pool.acquire(16, 8)
+    gray = pool.acquire(16, 8, mapnik.ImageType.gray8)
+    eq_(gray.get_type(), mapnik.ImageType.gray8)
+    eq_((pool.hits, pool.misses), (1, 3))
+    eq_((pool.size, pool.idle, pool.peak_size), (3, 0, 3))
+    del im, im2, gray
+    pool.max_size = 1
+    eq_((pool.size, pool.idle), (1, 1))
+    pool.clear()
+    eq_(pool.size, 0)
+    eq_(pool.peak_size, 3)
+
+
+def test_image_pool_exported_buffer():
+    pool = mapnik.ImagePool()
+    im = pool.acquire(4, 4)
+    buf = memoryview(im)
+    pool.release(im)
+    del im
+    # The pixels are still used through the buffer
+    eq_(pool.idle, 0)
+    del buf
+    eq_(pool.idle, 1)
+
+
+@raises(ValueError)
+def test_image_pool_release_foreign_image():
+    pool = mapnik.ImagePool()
+    pool.release(mapnik.Image(4, 4))
+
+
 if __name__ == "__main__":
     setup()
     exit(run_all(eval(x) for x in dir() if x.startswith("test_")))
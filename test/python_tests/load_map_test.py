@@ -1,5 +1,7 @@
 import glob
 import os
+import shutil
+import tempfile
 
 from nose.tools import eq_
 
@@ -101,6 +103,71 @@ def test_good_files():
                         (filename, e))
     eq_(len(failures), 0, '\n' + '\n'.join(failures))
 
+def test_load_map_cache():
+    filename = 'styles/rule_level_filter_style.xml'
+    m1 = mapnik.Map(256, 256)
+    mapnik.load_map(m1, filename, cache=True)
+    m2 = mapnik.Map(512, 512)
+    mapnik.load_map(m2, filename, cache=True)
+    eq_(m2.width, 512)
+    eq_(m2.srs, m1.srs)
+    eq_([l.name for l in m2.layers], [l.name for l in m1.layers])
+    # cached maps share datasources
+    eq_(m2.layers[0].datasource.describe(), m1.layers[0].datasource.describe())
+    mapnik.clear_cache()
+
+
+def test_load_map_from_string_cache():
+    style = '<Map srs="+init=epsg:3857" background-color="green"/>'
+    m1 = mapnik.Map(256, 256)
+    mapnik.load_map_from_string(m1, style, cache=True)
+    m2 = mapnik.Map(256, 256)
+    mapnik.load_map_from_string(m2, style, cache=True)
+    eq_(m1.background, mapnik.Color('green'))
+    eq_(m2.background, mapnik.Color('green'))
+    m3 = mapnik.Map(256, 256)
+    mapnik.load_map_from_string(m3, style.replace('green', 'red'), cache=True)
+    eq_(m3.background, mapnik.Color('red'))
+    mapnik.clear_cache()
+
+
+def test_load_map_cache_size():
+    max_size = mapnik.load_map_cache_size()
+    style = '<Map srs="+init=epsg:3857" background-color="%s"/>'
+    try:
+        mapnik.set_load_map_cache_size(1)
+        eq_(mapnik.load_map_cache_size(), 1)
+        for color in ['green', 'red', 'green']:
+            m = mapnik.Map(256, 256)
+            mapnik.load_map_from_string(m, style % color, cache=True)
+            eq_(m.background, mapnik.Color(color))
+    finally:
+        mapnik.set_load_map_cache_size(max_size)
+        mapnik.clear_cache()
+
+
+def test_load_map_cache_after_chdir():
+    # Files of the same relative path, size and modification time
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        for color in ['green', 'white']:
+            os.mkdir(os.path.join(tmp, color))
+            filename = os.path.join(tmp, color, 'style.xml')
+            with open(filename, 'w') as f:
+                f.write('<Map srs="+init=epsg:3857" background-color="%s"/>' % color)
+            os.utime(filename, ns=(10 ** 18, 10 ** 18))
+        for color in ['green', 'white']:
+            os.chdir(os.path.join(tmp, color))
+            m = mapnik.Map(256, 256)
+            mapnik.load_map(m, 'style.xml', cache=True)
+            eq_(m.background, mapnik.Color(color))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+        mapnik.clear_cache()
+
+
 if __name__ == "__main__":
     setup()
     exit(run_all(eval(x) for x in dir() if x.startswith("test_")))
@@ -56,3 +56,19 @@ def test_preview_mvt_custom_style():
     actual = 'images/mvt/tile3.preview.custom.actual.png'
     im.save(actual, 'png32')
     eq_(compare_file_size(actual, expected, 100), True)
+
+
+def test_preview_decoded_vector_tile():
+    mvt = mapnik.VectorTileMerc(28, 12, 5)
+
+    with open('data/tile3.mvt', 'rb') as f:
+        mapnik.merge_compressed_buffer(mvt, f.read())
+
+    expected = mapnik.Image(1024, 1024)
+    mapnik.preview_mvt_merc(mvt, expected)
+
+    tile = mapnik.DecodedVectorTile(mvt)
+    for i in range(2):
+        im = mapnik.Image(1024, 1024)
+        mapnik.preview_mvt_merc(tile, im)
+        eq_(im.tostring(), expected.tostring())
@@ -153,6 +153,112 @@ def test_render_mvt_with_optional_arguments():
     im.save(actual, 'png32')
     eq_(compare_file_size(actual, expected, 100), True)
 
+def test_render_mvt_merc_variants():
+    mvt = mapnik.VectorTileMerc(28, 12, 5)
+    with open('data/tile3.mvt', 'rb') as f:
+        mapnik.merge_compressed_buffer(mvt, f.read())
+
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/mvt_render_test.xml')
+
+    expected = mapnik.Image(256, 256)
+    mapnik.render_mvt_merc(mvt, m, expected)
+    expected2x = mapnik.Image(512, 512)
+    mapnik.render_mvt_merc(mvt, m, expected2x, scale_factor=2.0)
+
+    im = mapnik.Image(256, 256)
+    im2x = mapnik.Image(512, 512)
+    eq_(mapnik.render_mvt_merc_variants(mvt, m, [(im, 1.0), (im2x, 2.0)]),
+        None)
+    eq_(im.tostring(), expected.tostring())
+    eq_(im2x.tostring(), expected2x.tostring())
+
+    im = mapnik.Image(256, 256)
+    im2x = mapnik.Image(512, 512)
+    encoded = mapnik.render_mvt_merc_variants(
+        mvt, m, [(im, 1.0), (im2x, 2.0)], format='png32', threads=2)
+    eq_(len(encoded), 2)
+    eq_(encoded[0], im.tostring('png32'))
+    eq_(mapnik.Image.fromstring(encoded[1]).width(), 512)
+
+    # Formats of targets
+    im = mapnik.Image(256, 256)
+    im2x = mapnik.Image(512, 512)
+    im_jpeg = mapnik.Image(256, 256)
+    im_raw = mapnik.Image(256, 256)
+    encoded = mapnik.render_mvt_merc_variants(
+        mvt, m, [(im, 1.0, 'png32'), (im2x, 2.0), (im_jpeg, 1.0, 'jpeg'),
+                 (im_raw, 1.0, None)], format='png8')
+    eq_(len(encoded), 4)
+    eq_(encoded[0], im.tostring('png32'))
+    eq_(encoded[1], im2x.tostring('png8'))
+    eq_(encoded[2], im_jpeg.tostring('jpeg'))
+    eq_(encoded[3], im_raw.tostring('png8'))
+    eq_(im_raw.tostring(), expected.tostring())
+
+    im = mapnik.Image(256, 256)
+    encoded = mapnik.render_mvt_merc_variants(
+        mvt, m, [(im, 1.0, 'png32'), (mapnik.Image(256, 256), 1.0)])
+    eq_(encoded[0], im.tostring('png32'))
+    eq_(encoded[1], None)
+
+def test_render_decoded_vector_tile():
+    mvt = mapnik.VectorTileMerc(28, 12, 5)
+    with open('data/tile3.mvt', 'rb') as f:
+        mapnik.merge_compressed_buffer(mvt, f.read())
+
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/mvt_render_test.xml')
+    expected = mapnik.Image(256, 256)
+    mapnik.render_mvt_merc(mvt, m, expected)
+
+    tile = mapnik.DecodedVectorTile(mvt)
+    eq_((tile.x, tile.y, tile.z), (28, 12, 5))
+    eq_(tile.extent, mvt.extent)
+    eq_(len(tile.layer_names()) > 0, True)
+    eq_(tile.cache_size, 0)
+    for i in range(2):
+        im = mapnik.Image(256, 256)
+        mapnik.render_mvt_merc(tile, m, im)
+        eq_(im.tostring(), expected.tostring())
+    eq_(tile.cache_size > 0, True)
+
+    # Layers are decoded for every render without cache
+    tile.memory_limit = 0
+    eq_(tile.cache_size, 0)
+    im = mapnik.Image(256, 256)
+    mapnik.render_mvt_merc(tile, m, im)
+    eq_(im.tostring(), expected.tostring())
+    eq_(tile.cache_size, 0)
+
+def test_render_decoded_vector_tile_variants():
+    mvt = mapnik.VectorTileMerc(28, 12, 5)
+    with open('data/tile3.mvt', 'rb') as f:
+        mapnik.merge_compressed_buffer(mvt, f.read())
+
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/mvt_render_test.xml')
+    expected = mapnik.Image(256, 256)
+    mapnik.render_mvt_merc(mvt, m, expected)
+    expected2x = mapnik.Image(512, 512)
+    mapnik.render_mvt_merc(mvt, m, expected2x, scale_factor=2.0)
+
+    tile = mapnik.DecodedVectorTile(mvt)
+    im = mapnik.Image(256, 256)
+    im2x = mapnik.Image(512, 512)
+    encoded = mapnik.render_mvt_merc_variants(
+        tile, m, [(im, 1.0), (im2x, 2.0, 'png32')], threads=2)
+    eq_(im.tostring(), expected.tostring())
+    eq_(im2x.tostring(), expected2x.tostring())
+    eq_(encoded, [None, im2x.tostring('png32')])
+    eq_(tile.cache_size > 0, True)
+
+@raises(ValueError)
+def test_render_mvt_merc_variants_invalid_target():
+    mvt = mapnik.VectorTileMerc(28, 12, 5)
+    m = mapnik.Map(256, 256)
+    mapnik.render_mvt_merc_variants(mvt, m, [(mapnik.Image(256, 256),)])
+
 
 if __name__ == "__main__":
     setup()
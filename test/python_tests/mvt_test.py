@@ -153,6 +153,188 @@ def test_create_mvt_merc_with_raster():
     im2.save(actual2, 'png32')
     eq_(compare_file_size(actual2, expected2, 100), True)
 
+def test_create_mvt_merc_from_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    expected = mapnik.create_mvt_merc(m, 2048, 2047, 12)
+    with ThreadPoolExecutor(4) as executor:
+        buffers = list(executor.map(
+            lambda _: mapnik.create_mvt_merc(m, 2048, 2047, 12), range(8)))
+    for mvt_buffer in buffers:
+        eq_(mvt_buffer, expected)
+
+def test_vector_tile_cache():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    expected = mapnik.create_mvt_merc(m, 2048, 2047, 12)
+    cache = mapnik.VectorTileCache(len(expected) * 2)
+    mapnik.set_vector_tile_cache(cache)
+    try:
+        eq_(mapnik.create_mvt_merc(m, 2048, 2047, 12), expected)
+        eq_(mapnik.create_mvt_merc(m, 2048, 2047, 12), expected)
+        eq_((cache.hits, cache.misses, len(cache)), (1, 1, 1))
+        # defaults given explicitly or positionally are the same key
+        eq_(mapnik.create_mvt_merc(m, 2048, 2047, 12, offset_x=0), expected)
+        eq_(mapnik.create_mvt_merc(m, 2048, 2047, 12, 4096), expected)
+        eq_(mapnik.create_mvt_merc(m, x=2048, y=2047, z=12,
+                                   threading_mode=mapnik.threading_mode.asynchronous), expected)
+        eq_((cache.hits, cache.misses, len(cache)), (4, 1, 1))
+        # options are part of the key
+        eq_(mapnik.create_mvt_merc(m, 2048, 2047, 12, process_all_rings=True), expected)
+        eq_((cache.hits, cache.misses, len(cache)), (4, 2, 2))
+        eq_(mapnik.create_mvt_merc(m, 2048, 2047, 12, multi_polygon_union=True), expected)
+        eq_((cache.evictions, len(cache)), (1, 2))
+        eq_(cache.size_bytes, len(expected) * 2)
+        eq_(mapnik.create_mvt_merc(m, 2048, 2047, 12), expected)
+        eq_((cache.hits, cache.misses), (4, 4))
+        cache.invalidate(m)
+        eq_((len(cache), cache.size_bytes), (0, 0))
+        wafer = mapnik.create_mvt_wafer_merc(m, 0, 0, 3, 2)
+        eq_(mapnik.create_mvt_wafer_merc(m, 0, 0, 3, 2), wafer)
+        eq_(cache.hits, 5)
+        del m
+        eq_((len(cache), cache.size_bytes), (0, 0))
+    finally:
+        mapnik.set_vector_tile_cache(None)
+
+def test_iter_mvt_wafer_merc():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    expected = mapnik.create_mvt_wafer_merc(m, 2048, 2046, 12, 2)
+    tiles = mapnik.iter_mvt_wafer_merc(m, 2048, 2046, 12, 2, chunk_span=2)
+    eq_(len(tiles), 4)
+    actual = list(tiles)
+    eq_(len(tiles), 0)
+    eq_([buf for x, y, buf in actual], expected)
+    eq_(sorted((x, y) for x, y, buf in actual),
+        [(2048, 2046), (2048, 2047), (2049, 2046), (2049, 2047)])
+
+    # Tiles are created one at a time by default
+    tiles = mapnik.iter_mvt_wafer_merc(m, 2048, 2046, 12, 2)
+    eq_(len(tiles), 4)
+    x, y, buf = next(tiles)
+    eq_((x, y), (2048, 2046))
+    eq_(len(tiles), 3)
+    eq_(buf, mapnik.create_mvt_wafer_merc(m, x, y, 12, 1)[0])
+    eq_([(x, y) for x, y, buf in tiles],
+        [(2049, 2046), (2048, 2047), (2049, 2047)])
+
+@raises(ValueError)
+def test_iter_mvt_wafer_merc_chunk_span():
+    m = mapnik.Map(256, 256)
+    mapnik.iter_mvt_wafer_merc(m, 2048, 2046, 12, 4, chunk_span=3)
+
+def test_overzoom_mvt_merc():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    parent = mapnik.create_mvt_merc(m, 1024, 1023, 11)
+    for child_xyz in [(2048, 2046, 12), (2049, 2047, 12)]:
+        expected = mapnik.VectorTileInfo()
+        expected.parse_from_string(
+            mapnik.create_mvt_merc(m, *child_xyz, buffer_size=0))
+        actual = mapnik.VectorTileInfo()
+        actual.parse_from_string(mapnik.overzoom_mvt_merc(
+            mapnik.compress_mvt(parent), (1024, 1023, 11), child_xyz,
+            buffer_size=0))
+        eq_(actual.layers_size(), expected.layers_size())
+        for i in range(expected.layers_size()):
+            eq_(actual.layers(i).name(), expected.layers(i).name())
+            eq_(actual.layers(i).features_size(),
+                expected.layers(i).features_size())
+
+@raises(ValueError)
+def test_overzoom_mvt_merc_not_a_child():
+    mapnik.overzoom_mvt_merc(b'', (1024, 1023, 11), (2050, 2046, 12))
+
+def test_decode_mvt_arrays():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    mvt_buffer = mapnik.create_mvt_merc(m, 2048, 2047, 12)
+    info = mapnik.VectorTileInfo()
+    info.parse_from_string(mvt_buffer)
+
+    layers = mapnik.decode_mvt_arrays(mapnik.compress_mvt(mvt_buffer))
+    eq_([layer['name'] for layer in layers], ['L1', 'L2'])
+    for i, layer in enumerate(layers):
+        features = info.layers(i).features_size()
+        eq_(layer['extent'], 4096)
+        eq_(len(layer['id']), features)
+        eq_(len(layer['geom_type']), features)
+        geometry_offsets = layer['geometry_offsets'].tolist()
+        part_offsets = layer['part_offsets'].tolist()
+        eq_(len(geometry_offsets), features + 1)
+        eq_(geometry_offsets[-1], len(part_offsets) - 1)
+        eq_(len(layer['part_exterior']), len(part_offsets) - 1)
+        eq_(part_offsets[-1] * 2, len(layer['coords']))
+        eq_(layer['coords'].format, 'i')
+        for column in layer['properties'].values():
+            eq_(len(column), features)
+
+def test_decode_mvt_arrays_geometries():
+    style = """
+        <Map srs="+init=epsg:3857">
+            <Layer name="polygon" srs="+init=epsg:4326">
+                <Datasource>
+                    <Parameter name="type">geojson</Parameter>
+                    <Parameter name="inline">
+                        {"type":"Feature","properties":{"n":1,"s":"a"},
+                         "geometry":{"type":"Polygon","coordinates":[
+                            [[-10, -10], [10, -10], [10, 10], [-10, 10], [-10, -10]],
+                            [[-5, -5], [-5, 5], [5, 5], [5, -5], [-5, -5]]]}}
+                    </Parameter>
+                </Datasource>
+            </Layer>
+        </Map>
+    """
+    m = mapnik.Map(256, 256)
+    mapnik.load_map_from_string(m, style)
+    layer = mapnik.decode_mvt_arrays(mapnik.create_mvt_merc(m, 0, 0, 0))[0]
+    eq_(layer['geom_type'].tolist(), [3])
+    eq_(layer['geometry_offsets'].tolist(), [0, 2])
+    eq_(layer['part_exterior'].tolist(), [True, False])
+    coords = layer['coords'].tolist()
+    # rings are closed
+    for begin, end in [(0, 5), (5, 10)]:
+        eq_(coords[begin * 2:begin * 2 + 2], coords[end * 2 - 2:end * 2])
+    eq_(layer['properties']['n'].tolist(), [1])
+    eq_(layer['properties']['s'], ['a'])
+
+def test_mvt_stats():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    mvt_buffer = mapnik.create_mvt_merc(m, 2048, 2047, 12)
+
+    layers = mapnik.mvt_stats(mapnik.compress_mvt(mvt_buffer))
+    eq_([layer['name'] for layer in layers], ['L1', 'L2'])
+    eq_([layer['features'] for layer in layers], [1, 2])
+    eq_([layer['points'] for layer in layers], [1, 2])
+    eq_([layer['vertices'] for layer in layers], [1, 2])
+    eq_([layer['keys'] for layer in layers], [1, 1])
+    eq_([layer['values'] for layer in layers], [1, 2])
+    for layer in layers:
+        eq_(layer['extent'], 4096)
+        eq_(layer['linestrings'] + layer['polygons'] + layer['unknown'], 0)
+        eq_(layer['keys_bytes'] + layer['values_bytes'] < layer['bytes'], True)
+    eq_(sum(layer['bytes'] for layer in layers) < len(mvt_buffer), True)
+    eq_(mapnik.mvt_stats(mvt_buffer), layers)
+
+def test_mvt_stats_many():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    buffers = [mapnik.create_mvt_merc(m, 2048, 2047, 12),
+               mapnik.create_mvt_merc(m, 0, 0, 12),
+               b'']
+    stats = mapnik.mvt_stats_many(buffers, threads=2)
+    eq_(len(stats), 3)
+    eq_(stats[0], mapnik.mvt_stats(buffers[0]))
+    eq_(stats[1], [])
+    eq_(stats[2], [])
+
+@raises(RuntimeError)
+def test_mvt_stats_invalid():
+    mapnik.mvt_stats(b'\x1a\xff\xff')
+
 def test_compress():
     content = b'test' * 100
     eq_(len(content), 400)
@@ -161,6 +343,33 @@ def test_compress():
     decompressed = mapnik.decompress_mvt(compressed)
     eq_(len(decompressed), 400)
 
+def test_compress_level():
+    import zlib
+    content = b''.join(str(i).encode() for i in range(1000))
+    stored = mapnik.compress_mvt(content, level=0)
+    best = mapnik.compress_mvt(content, level=9)
+    rle = mapnik.compress_mvt(content, level=9, strategy=zlib.Z_RLE)
+    eq_(len(stored) > len(content), True)
+    eq_(len(best) < len(content), True)
+    for compressed in [stored, best, rle]:
+        eq_(mapnik.decompress_mvt(compressed), content)
+
+def test_compress_many():
+    contents = [b'test' * i for i in range(1, 50)]
+    compressed = mapnik.compress_mvt_many(contents, level=1, threads=4)
+    eq_(compressed, [mapnik.compress_mvt(c, level=1) for c in contents])
+    eq_(mapnik.decompress_mvt_many(compressed, threads=4), contents)
+    eq_(mapnik.decompress_mvt_many([bytearray(compressed[0])]), contents[:1])
+    eq_(mapnik.compress_mvt_many([]), [])
+
+@raises(RuntimeError)
+def test_decompress_many_invalid():
+    mapnik.decompress_mvt_many([mapnik.compress_mvt(b'test'), b'not zlib'])
+
+@raises(TypeError)
+def test_compress_many_not_buffers():
+    mapnik.compress_mvt_many([b'test', 1])
+
 def test_buffer_size_from_style():
     m = mapnik.Map(256, 256)
     mapnik.load_map(m, 'styles/map_buffer_size.xml')
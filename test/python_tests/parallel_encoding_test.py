@@ -12,3 +12,94 @@ def test_encode():
     eq_(type(tiles[1]), bytes)
     eq_(type(tiles[2]), bytes)
     eq_(type(tiles[3]), list)
+
+def test_encode_max_concurrency():
+    im = mapnik.Image(256, 256)
+    tiles = dict((i, im.view(0, 0, 256, 256)) for i in range(8))
+    mapnik.encode_parallel(tiles, "png8", max_concurrency=3)
+    for i in range(8):
+        eq_(tiles[i], im.tostring("png8"))
+
+def test_encode_formats_by_key():
+    im = mapnik.Image(256, 256)
+    im.fill(mapnik.Color('green'))
+    tiles = {
+        "png": im.view(0, 0, 256, 256),
+        "jpeg": im.view(0, 0, 256, 256),
+    }
+    mapnik.encode_parallel(tiles, {"png": "png32", "jpeg": "jpeg"})
+    eq_(tiles["png"], im.tostring("png32"))
+    eq_(tiles["jpeg"], im.tostring("jpeg"))
+
+def test_encode_palette():
+    palette = mapnik.Palette(b'\xff\x00\xff\xff\xff\xff', 'rgb')
+    im = mapnik.Image(256, 256)
+    im.fill(mapnik.Color('white'))
+    tiles = {
+        1: im.view(0, 0, 256, 256),
+        2: im.view(0, 0, 256, 256),
+    }
+    mapnik.encode_parallel(tiles, "png", {1: palette})
+    eq_(tiles[1], im.tostring("png", palette))
+    eq_(tiles[2], im.tostring("png"))
+
+def test_encode_solid_cache():
+    cache = mapnik.EncodedImageCache()
+    im = mapnik.Image(256, 256)
+    im.fill(mapnik.Color('blue'))
+    other = mapnik.Image(256, 256)
+    other.fill(mapnik.Color('blue'))
+    tiles = {
+        1: im.view(0, 0, 256, 256),
+        2: other.view(0, 0, 256, 256),
+        3: im.view(0, 0, 128, 128),
+    }
+    eq_(mapnik.encode_parallel(tiles, "png8", cache=cache), {2: 1})
+    eq_(tiles[1], im.tostring("png8"))
+    eq_(tiles[2] is tiles[1], True)
+    eq_(tiles[3], im.view(0, 0, 128, 128).tostring("png8"))
+    eq_((cache.size, cache.hits, cache.misses), (2, 0, 2))
+
+    # Encoded images are reused by later calls and linked to first tiles
+    tiles = {"a": other.view(0, 0, 256, 256)}
+    eq_(mapnik.encode_parallel(tiles, "png8", cache=cache), {"a": 1})
+    eq_(tiles["a"], im.tostring("png8"))
+    eq_(cache.hits, 1)
+    tiles = {1: im.view(0, 0, 256, 256), "c": other.view(0, 0, 256, 256)}
+    eq_(mapnik.encode_parallel(tiles, "png8", cache=cache), {"c": 1})
+    eq_(cache.hits, 2)
+
+    eq_(im.tostring("png32", cache), im.tostring("png32"))
+    eq_(other.view(0, 0, 256, 256).tostring("png32", cache), im.tostring("png32"))
+    eq_((cache.size, cache.hits), (3, 3))
+
+    # Images which are not solid are not cached
+    im.set_pixel(0, 0, mapnik.Color('red'))
+    eq_(im.tostring("png32", cache), im.tostring("png32"))
+    eq_(cache.size, 3)
+    cache.max_size = 1
+    eq_(cache.size, 1)
+
+def test_encode_duplicates():
+    im = mapnik.Image(512, 256)
+    im.set_pixel(1, 1, mapnik.Color('red'))
+    im.set_pixel(257, 1, mapnik.Color('red'))
+    other = mapnik.Image(256, 256)
+    other.set_pixel(2, 2, mapnik.Color('red'))
+    tiles = {
+        1: im.view(0, 0, 256, 256),
+        2: im.view(256, 0, 256, 256),
+        3: other.view(0, 0, 256, 256),
+        4: im.view(256, 0, 256, 256),
+    }
+    eq_(mapnik.encode_parallel(tiles, "png", duplicates=True), {2: 1, 4: 1})
+    eq_(tiles[1], im.view(0, 0, 256, 256).tostring("png"))
+    eq_(tiles[2], tiles[1])
+    eq_(tiles[3], other.tostring("png"))
+
+    # Images encoded to different formats are not duplicates
+    tiles = {
+        1: im.view(0, 0, 256, 256),
+        2: im.view(256, 0, 256, 256),
+    }
+    eq_(mapnik.encode_parallel(tiles, {1: "png", 2: "png32"}, duplicates=True), {})
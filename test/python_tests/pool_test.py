@@ -0,0 +1,116 @@
+import copy
+import os
+import threading
+
+from nose.tools import eq_, raises
+
+import mapnik
+
+from .utilities import execution_path, run_all
+
+
+def setup():
+    # All of the paths used are relative, if we run the tests
+    # from another directory we need to chdir()
+    os.chdir(execution_path('.'))
+
+
+def test_map_copy():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    m2 = copy.copy(m)
+    eq_(m2.srs, m.srs)
+    eq_(len(m2.layers), len(m.layers))
+    eq_(m2.layers[0].datasource.describe(), m.layers[0].datasource.describe())
+    m2.resize(512, 512)
+    eq_(m.width, 256)
+
+
+def test_map_pool():
+    pool = mapnik.MapPool('styles/rule_level_filter_style.xml', 2)
+    with pool.checkout() as m1:
+        with pool.checkout() as m2:
+            eq_(m1 is m2, False)
+            eq_(len(m1.layers), 2)
+            m1.resize(512, 512)
+    with pool.checkout() as m3:
+        eq_(m3.width, 256)
+        eq_(m3 is m1 or m3 is m2, True)
+
+
+def test_map_pool_reset():
+    pool = mapnik.MapPool('styles/rule_level_filter_style.xml', 1)
+    with pool.checkout() as m:
+        m.resize(512, 256)
+        m.buffer_size = 64
+        m.zoom_to_box(mapnik.Box2d(0, 0, 100, 50))
+    with pool.checkout() as m:
+        eq_((m.width, m.height), (256, 256))
+        eq_(m.buffer_size, pool.template.buffer_size)
+        eq_(m.envelope(), pool.template.envelope())
+
+
+def test_map_pool_failed_copy():
+    pool = mapnik.MapPool('styles/rule_level_filter_style.xml', 1)
+    template = pool.template
+    copying = threading.Event()
+    waiting = threading.Event()
+
+    class FailingTemplate(object):
+        calls = 0
+
+        def __copy__(self):
+            self.calls += 1
+            if self.calls == 1:
+                copying.set()
+                waiting.wait()
+                raise RuntimeError('copy failed')
+            return copy.copy(template)
+
+    pool.template = FailingTemplate()
+    errors = []
+
+    def fail():
+        try:
+            pool.acquire()
+        except RuntimeError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=fail)
+    t.start()
+    copying.wait()
+    # The waiter gets the slot of the failed copy
+    threading.Timer(0.1, waiting.set).start()
+    m = pool.acquire(timeout=5)
+    t.join()
+    eq_(len(errors), 1)
+    eq_(len(m.layers), 2)
+
+
+@raises(RuntimeError)
+def test_map_pool_exhausted():
+    pool = mapnik.MapPool('styles/rule_level_filter_style.xml', 1)
+    with pool.checkout():
+        pool.acquire(timeout=0.01)
+
+
+def test_map_pool_threads():
+    pool = mapnik.MapPool('styles/rule_level_filter_style.xml', 2)
+    expected = mapnik.create_mvt_merc(pool.template, 2048, 2047, 12)
+    results = []
+
+    def work():
+        with pool.checkout() as m:
+            results.append(mapnik.create_mvt_merc(m, 2048, 2047, 12))
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    eq_(results, [expected] * 6)
+
+
+if __name__ == "__main__":
+    setup()
+    exit(run_all(eval(x) for x in dir() if x.startswith("test_")))
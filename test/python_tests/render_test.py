@@ -295,6 +295,83 @@ def test_render_with_parallelizer():
         'failed comparing actual (%s) and expected (%s)' % (im_parallel, im))
 
 
+def test_render_tiles():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    m.background = mapnik.Color('green')
+    tiles = [(0, 0, 1, 256, 256), (1, 1, 1, 256, 256), (0, 0, 0, 512, 512)]
+    encoded = mapnik.render_tiles(m, tiles, 'png32', 2)
+    eq_(sorted(encoded.keys()), [(0, 0, 0), (0, 0, 1), (1, 1, 1)])
+    for x, y, z, width, height in tiles:
+        im = mapnik.Image.fromstring(encoded[(x, y, z)])
+        eq_(im.width(), width)
+        eq_(im.height(), height)
+        eq_(im.get_pixel(0, 0, True), mapnik.Color('green'))
+
+
+@raises(ValueError)
+def test_render_tiles_invalid_tile():
+    m = mapnik.Map(256, 256)
+    mapnik.render_tiles(m, [(0, 0, 1)])
+
+
+def test_render_metatile():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    m.background = mapnik.Color('green')
+    encoded = mapnik.render_metatile(m, 5, 6, 3, 4, 256, 'png32')
+    eq_(len(encoded), 16)
+    eq_(min(encoded.keys()), (4, 4))
+    eq_(max(encoded.keys()), (7, 7))
+    im = mapnik.Image.fromstring(encoded[(5, 6)])
+    eq_(im.width(), 256)
+    eq_(im.height(), 256)
+    eq_(im.get_pixel(0, 0, True), mapnik.Color('green'))
+
+
+def test_render_metatile_low_zoom():
+    m = mapnik.Map(256, 256)
+    encoded = mapnik.render_metatile(m, 1, 0, 1, 8, 256, 'png32')
+    eq_(sorted(encoded.keys()), [(0, 0), (0, 1), (1, 0), (1, 1)])
+
+
+def test_render_metatile_invalid():
+    m = mapnik.Map(256, 256)
+    for args in [(0, 0, 64), (0, 0, 33), (2, 0, 1), (0, 4, 2),
+                 (0, 0, 20, 8, 1 << 30)]:
+        try:
+            mapnik.render_metatile(m, *args)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('render_metatile%r did not fail' % (args,))
+
+
+def test_render_with_image_pool():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    m.background = mapnik.Color('green')
+    m.zoom_all()
+    pool = mapnik.ImagePool()
+    tiles = [(0, 0, 1, 256, 256), (1, 1, 1, 256, 256), (0, 0, 0, 512, 512)]
+    expected = mapnik.render_tiles(m, tiles, 'png32', 2)
+    for i in range(2):
+        eq_(mapnik.render_tiles(m, tiles, 'png32', 2, pool=pool), expected)
+    eq_(pool.hits > 0, True)
+
+    expected = mapnik.render_metatile(m, 5, 6, 3, 4, 256, 'png32')
+    eq_(mapnik.render_metatile(m, 5, 6, 3, 4, 256, 'png32', pool=pool), expected)
+
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'pool.png')
+    mapnik.render_to_file(m, filename, 'png32', pool)
+    eq_(mapnik.Image.open(filename).get_pixel(0, 0, True), mapnik.Color('green'))
+    hits = pool.hits
+    mapnik.render_tile_to_file(m, 0, 0, 256, 256, filename, 'png32', pool)
+    eq_(pool.hits, hits + 1)
+    eq_(pool.idle, pool.size)
+
+
 def test_render_layer():
     ds = mapnik.MemoryDatasource()
     context = mapnik.Context()
@@ -0,0 +1,85 @@
+import os
+
+from nose.tools import eq_, raises
+
+import mapnik
+from mapnik.seed import tile_range, wafer_span_for_density
+
+from .utilities import execution_path, run_all
+
+
+def setup():
+    # All of the paths used are relative, if we run the tests
+    # from another directory we need to chdir()
+    os.chdir(execution_path('.'))
+
+
+def map_factory():
+    m = mapnik.Map(256, 256)
+    mapnik.load_map(m, 'styles/rule_level_filter_style.xml')
+    return m
+
+
+class ListSink(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def write(self, tiles):
+        self.batches.append(tiles)
+
+
+def test_tile_range():
+    eq_(tile_range((-180, -90, 180, 90), 0), (0, 0, 0, 0))
+    eq_(tile_range((-180, -90, 180, 90), 2), (0, 0, 3, 3))
+    eq_(tile_range((0.1, 0.1, 0.2, 0.2), 12), (2049, 2045, 2050, 2046))
+
+
+def test_wafer_span_for_density():
+    eq_(wafer_span_for_density(0, 8, 1024), 8)
+    eq_(wafer_span_for_density(64, 8, 1024), 4)
+    eq_(wafer_span_for_density(2048, 8, 1024), 1)
+
+
+def test_seed_mvt():
+    sink = ListSink()
+    reports = []
+    bbox = (-1.0, -1.0, 1.0, 1.0)
+    stats = mapnik.seed_mvt(map_factory, bbox, range(4), wafer_span=4,
+                            workers=2, sink=sink, compress=False,
+                            batch_size=5, progress=reports.append)
+    tiles = [tile for batch in sink.batches for tile in batch]
+    eq_(max(len(batch) for batch in sink.batches), 5)
+    expected = set()
+    for z in range(4):
+        min_x, min_y, max_x, max_y = tile_range(bbox, z)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                expected.add((z, x, y))
+    eq_(set((z, x, y) for z, x, y, data in tiles), expected)
+    eq_(stats['tiles'], len(expected))
+    eq_(stats['bytes'], sum(len(data) for z, x, y, data in tiles))
+    eq_(reports[-1]['tiles'], stats['tiles'])
+
+
+def test_seed_mvt_compressed():
+    bbox = (-1.0, -1.0, 1.0, 1.0)
+    sink = ListSink()
+    mapnik.seed_mvt(map_factory, bbox, [2], workers=1, sink=sink,
+                    compress=False)
+    compressed_sink = ListSink()
+    mapnik.seed_mvt(map_factory, bbox, [2], workers=1, sink=compressed_sink)
+    expected = sorted(sink.batches[0])
+    actual = sorted((z, x, y, mapnik.decompress_mvt(data))
+                    for z, x, y, data in compressed_sink.batches[0])
+    eq_(actual, expected)
+
+
+@raises(ValueError)
+def test_seed_mvt_without_sink():
+    mapnik.seed_mvt(map_factory, (-1.0, -1.0, 1.0, 1.0), [0])
+
+
+if __name__ == "__main__":
+    setup()
+    exit(run_all(eval(x) for x in dir() if x.startswith("test_")))
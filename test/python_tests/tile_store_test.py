@@ -0,0 +1,129 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from nose.tools import eq_, raises
+
+import mapnik
+
+from .utilities import execution_path, run_all
+
+
+def setup():
+    # All of the paths used are relative, if we run the tests
+    # from another directory we need to chdir()
+    os.chdir(execution_path('.'))
+
+
+TILES = [(1, 0, 0, b'ocean'), (1, 1, 0, b'ocean'), (1, 0, 1, b'land')]
+
+
+def check_mbtiles_writer(background):
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'tiles.mbtiles')
+        with mapnik.MBTilesWriter(path, {'format': 'pbf'},
+                                  background=background) as store:
+            store.write(TILES)
+            store.write_dict({(1, 1, 1): b'ocean'})
+        eq_(store.tiles_written, 4)
+        eq_(store.duplicates, 2)
+        db = sqlite3.connect(path)
+        eq_(db.execute('SELECT count(*) FROM images').fetchone()[0], 2)
+        eq_(db.execute('SELECT value FROM metadata WHERE name = ?',
+                       ('format',)).fetchone()[0], 'pbf')
+        # rows are flipped to the TMS scheme
+        eq_(db.execute('SELECT tile_data FROM tiles WHERE zoom_level = 1 '
+                       'AND tile_column = 0 AND tile_row = 0').fetchone()[0],
+            b'land')
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_mbtiles_writer():
+    check_mbtiles_writer(False)
+
+
+def test_mbtiles_writer_background():
+    check_mbtiles_writer(True)
+
+
+def test_mbtiles_writer_rewrite():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'tiles.mbtiles')
+        with mapnik.MBTilesWriter(path) as store:
+            store.write(TILES)
+            store.write([(1, 0, 1, b'forest'), (1, 0, 0, b'forest'),
+                         (1, 0, 0, b'desert')])
+        with mapnik.MBTilesWriter(path) as store:
+            store.write([(1, 1, 0, b'ice')])
+        db = sqlite3.connect(path)
+        # images of replaced tiles are deleted
+        eq_(sorted(row[0] for row in db.execute('SELECT tile_data FROM images')),
+            [b'desert', b'forest', b'ice'])
+        eq_(sorted(row[0] for row in db.execute('SELECT tile_data FROM tiles')),
+            [b'desert', b'forest', b'ice'])
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+@raises(TypeError)
+def test_tile_store_writer_is_abstract():
+    mapnik.tile_store.TileStoreWriter()
+
+
+@raises(TypeError)
+def test_mbtiles_writer_background_error():
+    tmp = tempfile.mkdtemp()
+    try:
+        store = mapnik.MBTilesWriter(os.path.join(tmp, 'tiles.mbtiles'),
+                                     background=True)
+        store.write([(1, 0, 0, u'not bytes')])
+        store.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_directory_writer():
+    tmp = tempfile.mkdtemp()
+    try:
+        with mapnik.DirectoryWriter(tmp, 'png') as store:
+            store.write(TILES)
+            # rewriting a linked tile does not change its duplicates
+            store.write([(1, 0, 0, b'forest')])
+        eq_(store.tiles_written, 4)
+        eq_(store.duplicates, 1)
+
+        def read(name):
+            with open(os.path.join(tmp, name), 'rb') as f:
+                return f.read()
+        eq_(read('1/0/0.png'), b'forest')
+        eq_(read('1/1/0.png'), b'ocean')
+        eq_(read('1/0/1.png'), b'land')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_directory_writer_max_links():
+    tmp = tempfile.mkdtemp()
+    try:
+        with mapnik.DirectoryWriter(tmp, 'png', max_links=1) as store:
+            store.write(TILES)
+            # only the file of the last content is remembered
+            store.write([(1, 1, 1, b'ocean'), (2, 0, 0, b'land')])
+        eq_(store.duplicates, 1)
+        eq_(len(store._files_by_id), 1)
+        eq_(len(store._ids_by_file), 1)
+        with open(os.path.join(tmp, '1/1/1.png'), 'rb') as f:
+            eq_(f.read(), b'ocean')
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    setup()
+    exit(run_all(eval(x) for x in dir() if x.startswith("test_")))